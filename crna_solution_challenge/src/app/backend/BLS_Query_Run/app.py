@@ -1,11 +1,135 @@
 # app.py
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, make_response
 from google.cloud import bigquery
+import hashlib
+import math
 import os # For PORT environment variable
+import threading
+import time
+
+import pgeocode
+from spatial_index import SphericalKDTree
 
 app = Flask(__name__)
 client = bigquery.Client() # This will use the Cloud Run service account credentials by default
 
+geo_nomi = None
+try:
+    geo_nomi = pgeocode.Nominatim('us')
+    app.logger.info("Pgeocode Nominatim client initialized for US.")
+except Exception as e_geo_init:
+    app.logger.error(f"Failed to initialize pgeocode client: {e_geo_init}", exc_info=True)
+    # geo_nomi remains None, /local-market-benchmark answers 503
+
+BLS_TABLE_ID = os.getenv("BLS_TABLE_ID", "mythical-patrol-455417-a7.BLS.occupational_employment_and_wage_statistics")
+
+# --- Caching Configuration ---
+# OEWS data changes about once a year, so GET responses are cacheable. The ETag is derived from the
+# data snapshot version plus the lookup parameters, which lets us answer If-None-Match with a 304
+# without running the BigQuery query.
+# BLS_DATA_SNAPSHOT_VERSION pins the version (e.g. "oews-2024"); otherwise the table's last-modified
+# time is used, re-checked at most every BLS_SNAPSHOT_CHECK_SECONDS.
+# A 404 has no ETag to revalidate against, so it is only cached for BLS_NOT_FOUND_MAX_AGE_SECONDS.
+BLS_DATA_SNAPSHOT_VERSION = os.getenv("BLS_DATA_SNAPSHOT_VERSION")
+BLS_SNAPSHOT_CHECK_SECONDS = int(os.getenv("BLS_SNAPSHOT_CHECK_SECONDS", 3600))
+BLS_CACHE_MAX_AGE_SECONDS = int(os.getenv("BLS_CACHE_MAX_AGE_SECONDS", 86400))
+BLS_NOT_FOUND_MAX_AGE_SECONDS = int(os.getenv("BLS_NOT_FOUND_MAX_AGE_SECONDS", 300))
+
+_snapshot_version_cache = {"version": None, "checked_at": 0.0}
+
+def get_snapshot_version():
+    if BLS_DATA_SNAPSHOT_VERSION:
+        return BLS_DATA_SNAPSHOT_VERSION
+    now = time.monotonic()
+    if _snapshot_version_cache["version"] is None or now - _snapshot_version_cache["checked_at"] > BLS_SNAPSHOT_CHECK_SECONDS:
+        table = client.get_table(BLS_TABLE_ID)
+        _snapshot_version_cache["version"] = table.modified.isoformat() if table.modified else table.etag
+        _snapshot_version_cache["checked_at"] = now
+        app.logger.info(f"BLS data snapshot version: {_snapshot_version_cache['version']}")
+    return _snapshot_version_cache["version"]
+
+def compute_bls_etag(snapshot_version, occ_title, a_mean_float):
+    key = f"{snapshot_version}|{occ_title}|{a_mean_float!r}"
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]
+
+def add_cache_headers(response, etag=None, max_age_seconds=None):
+    if etag:
+        response.set_etag(etag)
+    if max_age_seconds is None:
+        max_age_seconds = BLS_CACHE_MAX_AGE_SECONDS
+    response.headers["Cache-Control"] = f"public, max-age={max_age_seconds}"
+    return response
+
+# --- Shared Lookup Helpers ---
+def parse_bls_lookup_params(data):
+    # Returns (occ_title, a_mean_float, error_response). error_response is a (response, status) tuple or None.
+    # Check if required fields are present in the request
+    occ_title_param_from_request = data.get('OCC_TITLE')
+    # A_MEAN from request is expected to be a string that can be parsed as a number
+    a_mean_str_from_request = data.get('A_MEAN')
+
+    # Log received data
+    app.logger.info(f"Received OCC_TITLE: {occ_title_param_from_request}")
+    app.logger.info(f"Received A_MEAN (string): {a_mean_str_from_request}")
+
+    if occ_title_param_from_request is None or a_mean_str_from_request is None:
+        app.logger.warning("Missing required fields OCC_TITLE or A_MEAN from request") # Added logging
+        return None, None, (jsonify({'error': 'Missing required fields OCC_TITLE or A_MEAN'}), 400)
+
+    # Convert the A_MEAN string from the request to a float for the BQ parameter.
+    # This float will be compared against the A_MEAN column in BQ (which is a STRING)
+    # after casting the BQ column to FLOAT64 in the SQL.
+    try:
+        a_mean_float_for_bq_param = float(a_mean_str_from_request)
+    except ValueError:
+        app.logger.warning(f"A_MEAN '{a_mean_str_from_request}' from request is not a valid number") # Added logging
+        return None, None, (jsonify({'error': 'A_MEAN must be a string representing a valid number'}), 400)
+
+    return occ_title_param_from_request, a_mean_float_for_bq_param, None
+
+def query_bls_rows(occ_title_param, a_mean_float_param):
+    # SQL query targeting the table.
+    # Assuming OCC_TITLE column in BQ is STRING.
+    # Assuming A_MEAN column in BQ is STRING, so we SAFE_CAST it to FLOAT64 for comparison.
+    query = f"""
+        SELECT *
+        FROM `{BLS_TABLE_ID}`
+        WHERE OCC_TITLE = @occ_title_param  -- Parameter for OCC_TITLE (STRING)
+        AND SAFE_CAST(A_MEAN AS FLOAT64) = @a_mean_float_param -- Parameter for A_MEAN (FLOAT64)
+    """
+    # Note: Column names in BQ are OCC_TITLE and A_MEAN (as per your previous confirmation)
+
+    app.logger.info(f"Executing BigQuery query: {query}") # Log the query
+
+    # Set up the query parameters
+    query_params = [
+        bigquery.ScalarQueryParameter("occ_title_param", "STRING", occ_title_param),
+        bigquery.ScalarQueryParameter("a_mean_float_param", "FLOAT64", a_mean_float_param)
+    ]
+    app.logger.info(f"With query params: {[(p.name, p.type_, p.value) for p in query_params]}") # Log params
+
+    job_config = bigquery.QueryJobConfig(query_parameters=query_params)
+    query_job = client.query(query, job_config=job_config)
+    app.logger.info(f"BigQuery Job ID: {query_job.job_id}") # Log Job ID
+    results = query_job.result() # Waits for the query to finish
+
+    # Process results
+    output_data = []
+    for row in results:
+        row_dict = dict(row.items())
+        output_data.append(row_dict)
+
+    app.logger.info(f"Query returned {len(output_data)} rows.") # Log result count
+    return output_data
+
+def bigquery_error_response(bq_error):
+    app.logger.error(f"BigQuery error processing request: {str(bq_error)}")
+    # Extract more details if possible, like the job ID or reason
+    error_details = f"BigQuery API error: {str(bq_error)}"
+    if hasattr(bq_error, 'errors') and bq_error.errors:
+        error_details += f" - Reasons: {[e.get('reason', '') + ': ' + e.get('message', '') for e in bq_error.errors]}"
+    return jsonify({'error': f'An internal server error occurred (BigQuery): {error_details}'}), 500
+
 @app.route('/get-bls-data', methods=['POST'])
 def get_bls_data():
     try:
@@ -15,73 +139,199 @@ def get_bls_data():
             app.logger.warning("No JSON data provided in request body") # Added logging
             return jsonify({'error': 'No JSON data provided in request body'}), 400
 
-        # Check if required fields are present in the request
-        occ_title_param_from_request = data.get('OCC_TITLE')
-        # A_MEAN from request is expected to be a string that can be parsed as a number
-        a_mean_str_from_request = data.get('A_MEAN')
+        occ_title_param_from_request, a_mean_float_for_bq_param, error_response = parse_bls_lookup_params(data)
+        if error_response:
+            return error_response
+
+        output_data = query_bls_rows(occ_title_param_from_request, a_mean_float_for_bq_param)
+
+        if not output_data:
+            return jsonify({'message': 'No results found for the given criteria'}), 404
+
+        return jsonify({'data': output_data})
+
+    except bigquery.exceptions.GoogleCloudError as bq_error: # Catch BigQuery specific errors
+        return bigquery_error_response(bq_error)
+    except Exception as e:
+        app.logger.error(f"Generic error processing request: {str(e)}", exc_info=True) # Log full traceback for generic errors
+        return jsonify({'error': f'An internal server error occurred: {str(e)}'}), 500
+
+# Cacheable variant of the lookup: GET /get-bls-data?OCC_TITLE=...&A_MEAN=...
+# Responses carry an ETag and Cache-Control, and If-None-Match hits are answered with 304.
+@app.route('/get-bls-data', methods=['GET'])
+def get_bls_data_cacheable():
+    try:
+        occ_title_param_from_request, a_mean_float_for_bq_param, error_response = parse_bls_lookup_params(request.args)
+        if error_response:
+            return error_response
+
+        etag = compute_bls_etag(get_snapshot_version(), occ_title_param_from_request, a_mean_float_for_bq_param)
+        if request.if_none_match.contains_weak(etag): # If-None-Match uses weak comparison (RFC 9110 13.1.2)
+            app.logger.info(f"If-None-Match hit for ETag {etag}, returning 304")
+            return add_cache_headers(make_response('', 304), etag)
+
+        output_data = query_bls_rows(occ_title_param_from_request, a_mean_float_for_bq_param)
+
+        if not output_data:
+            not_found = make_response(jsonify({'message': 'No results found for the given criteria'}), 404)
+            return add_cache_headers(not_found, max_age_seconds=BLS_NOT_FOUND_MAX_AGE_SECONDS)
+
+        return add_cache_headers(make_response(jsonify({'data': output_data})), etag)
+
+    except bigquery.exceptions.GoogleCloudError as bq_error: # Catch BigQuery specific errors
+        return bigquery_error_response(bq_error)
+    except Exception as e:
+        app.logger.error(f"Generic error processing request: {str(e)}", exc_info=True) # Log full traceback for generic errors
+        return jsonify({'error': f'An internal server error occurred: {str(e)}'}), 500
+
+# --- Local Market Benchmark ---
+# Processed submissions carry their ZIP centroid (location_latitude/location_longitude). They are
+# loaded into in-memory KD-trees (spatial_index.py), one over all submissions and one per employment
+# type, rebuilt in the background every SPATIAL_INDEX_REFRESH_SECONDS, so radius and k-nearest lookups
+# are O(log n) instead of a table scan.
+CRNA_SUBMISSIONS_TABLE_ID = os.getenv("CRNA_SUBMISSIONS_TABLE_ID") # project.dataset.table written by CRNA_Data_Processor
+SPATIAL_INDEX_REFRESH_SECONDS = int(os.getenv("SPATIAL_INDEX_REFRESH_SECONDS", 900))
+SPATIAL_INDEX_RETRY_SECONDS = 60 # after a failed refresh, keep serving the old index this long before retrying
+LOCAL_MARKET_MAX_RADIUS_MILES = 500
+LOCAL_MARKET_MAX_K = 500
 
-        # Log received data
-        app.logger.info(f"Received OCC_TITLE: {occ_title_param_from_request}")
-        app.logger.info(f"Received A_MEAN (string): {a_mean_str_from_request}")
+_spatial_index_state = {"trees": None, "built_at": 0.0}
+_spatial_index_lock = threading.Lock() # held by whichever thread is (re)building the index
 
-        if occ_title_param_from_request is None or a_mean_str_from_request is None:
-            app.logger.warning("Missing required fields OCC_TITLE or A_MEAN from request") # Added logging
-            return jsonify({'error': 'Missing required fields OCC_TITLE or A_MEAN'}), 400
+def load_spatial_index():
+    # Returns {None: tree over all submissions, "<employment_type>": tree over that type, ...}.
+    # Separate trees make employment_type + k an exact k-nearest query instead of filter-after-fetch.
+    query = f"""
+        SELECT location_zip_code, location_latitude, location_longitude,
+               total_estimated_annual_compensation, employment_type, experience_bucket
+        FROM `{CRNA_SUBMISSIONS_TABLE_ID}`
+        WHERE location_latitude IS NOT NULL AND location_longitude IS NOT NULL
+          AND total_estimated_annual_compensation IS NOT NULL
+    """
+    points_by_type = {None: ([], [])}
+    for row in client.query(query).result():
+        point = (row["location_latitude"], row["location_longitude"])
+        payload = {
+            "zip": row["location_zip_code"],
+            "compensation": row["total_estimated_annual_compensation"],
+            "employment_type": row["employment_type"],
+            "experience_bucket": row["experience_bucket"],
+        }
+        # A NULL employment_type only goes into the all-submissions tree, which is already keyed None.
+        keys = (None,) if row["employment_type"] is None else (None, row["employment_type"])
+        for key in keys:
+            points, payloads = points_by_type.setdefault(key, ([], []))
+            points.append(point)
+            payloads.append(payload)
+    return {key: SphericalKDTree(points, payloads) for key, (points, payloads) in points_by_type.items()}
 
-        # Convert the A_MEAN string from the request to a float for the BQ parameter.
-        # This float will be compared against the A_MEAN column in BQ (which is a STRING)
-        # after casting the BQ column to FLOAT64 in the SQL.
+def rebuild_spatial_index():
+    # Caller must hold _spatial_index_lock; the swap is a single assignment, so readers never see a partial index.
+    started = time.monotonic()
+    try:
+        trees = load_spatial_index()
+    except Exception as e:
+        app.logger.error(f"Spatial index refresh failed, retrying in {SPATIAL_INDEX_RETRY_SECONDS}s: {e}", exc_info=True)
+        _spatial_index_state["built_at"] = time.monotonic() - SPATIAL_INDEX_REFRESH_SECONDS + SPATIAL_INDEX_RETRY_SECONDS
+        raise
+    _spatial_index_state.update(trees=trees, built_at=time.monotonic())
+    app.logger.info(f"Spatial index rebuilt with {len(trees[None])} submissions in {time.monotonic() - started:.2f}s")
+
+def _refresh_spatial_index_in_background():
+    try:
+        rebuild_spatial_index()
+    except Exception:
+        pass # already logged; the previous index keeps serving
+    finally:
+        _spatial_index_lock.release()
+
+def get_spatial_index():
+    # The first request builds the index synchronously. After that, a stale index keeps serving while one
+    # background thread rebuilds it; requests never wait on the full-table query.
+    if _spatial_index_state["trees"] is None:
+        with _spatial_index_lock:
+            if _spatial_index_state["trees"] is None:
+                rebuild_spatial_index()
+    elif time.monotonic() - _spatial_index_state["built_at"] > SPATIAL_INDEX_REFRESH_SECONDS:
+        if _spatial_index_lock.acquire(blocking=False): # busy means a refresh is already running
+            threading.Thread(target=_refresh_spatial_index_in_background, daemon=True).start()
+    return _spatial_index_state["trees"]
+
+def percentile(sorted_values, fraction):
+    # Linear interpolation between closest ranks; sorted_values must be non-empty.
+    position = (len(sorted_values) - 1) * fraction
+    lower = math.floor(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+def summarize_compensation(matches):
+    values = sorted(payload["compensation"] for _, payload in matches)
+    if not values:
+        return None
+    return {
+        "min": values[0],
+        "p25": percentile(values, 0.25),
+        "median": percentile(values, 0.5),
+        "p75": percentile(values, 0.75),
+        "max": values[-1],
+        "mean": sum(values) / len(values),
+    }
+
+# GET /local-market-benchmark?zip=90210&radius_miles=50   (all submissions within the radius)
+# GET /local-market-benchmark?zip=90210&k=25              (the 25 nearest submissions)
+# Optional: employment_type=W2 to restrict the benchmark to one employment type.
+@app.route('/local-market-benchmark', methods=['GET'])
+def local_market_benchmark():
+    try:
+        if not CRNA_SUBMISSIONS_TABLE_ID or not geo_nomi:
+            app.logger.error("Local market benchmark unavailable: CRNA_SUBMISSIONS_TABLE_ID not set or pgeocode not initialized.")
+            return jsonify({'error': 'Service temporarily unavailable (local market benchmark not configured)'}), 503
+
+        zip_code = (request.args.get('zip') or '').strip()[:5]
+        if len(zip_code) != 5 or not zip_code.isdigit():
+            return jsonify({'error': 'zip must be a 5-digit ZIP code'}), 400
+
+        radius_arg, k_arg = request.args.get('radius_miles'), request.args.get('k')
+        if (radius_arg is None) == (k_arg is None):
+            return jsonify({'error': 'Provide exactly one of radius_miles or k'}), 400
         try:
-            a_mean_float_for_bq_param = float(a_mean_str_from_request)
+            radius_miles = float(radius_arg) if radius_arg is not None else None
+            k = int(k_arg) if k_arg is not None else None
         except ValueError:
-            app.logger.warning(f"A_MEAN '{a_mean_str_from_request}' from request is not a valid number") # Added logging
-            return jsonify({'error': 'A_MEAN must be a string representing a valid number'}), 400
-
-        # SQL query targeting the table.
-        # Assuming OCC_TITLE column in BQ is STRING.
-        # Assuming A_MEAN column in BQ is STRING, so we SAFE_CAST it to FLOAT64 for comparison.
-        query = """
-            SELECT *
-            FROM `mythical-patrol-455417-a7.BLS.occupational_employment_and_wage_statistics`
-            WHERE OCC_TITLE = @occ_title_param  -- Parameter for OCC_TITLE (STRING)
-            AND SAFE_CAST(A_MEAN AS FLOAT64) = @a_mean_float_param -- Parameter for A_MEAN (FLOAT64)
-        """
-        # Note: Column names in BQ are OCC_TITLE and A_MEAN (as per your previous confirmation)
-
-        app.logger.info(f"Executing BigQuery query: {query}") # Log the query
-
-        # Set up the query parameters
-        query_params = [
-            bigquery.ScalarQueryParameter("occ_title_param", "STRING", occ_title_param_from_request),
-            bigquery.ScalarQueryParameter("a_mean_float_param", "FLOAT64", a_mean_float_for_bq_param)
-        ]
-        app.logger.info(f"With query params: {[(p.name, p.type_, p.value) for p in query_params]}") # Log params
-
-        job_config = bigquery.QueryJobConfig(query_parameters=query_params)
-        query_job = client.query(query, job_config=job_config)
-        app.logger.info(f"BigQuery Job ID: {query_job.job_id}") # Log Job ID
-        results = query_job.result() # Waits for the query to finish
-
-        # Process results
-        output_data = []
-        for row in results:
-            row_dict = dict(row.items())
-            output_data.append(row_dict)
-
-        app.logger.info(f"Query returned {len(output_data)} rows.") # Log result count
+            return jsonify({'error': 'radius_miles must be a number and k an integer'}), 400
+        if radius_miles is not None and not (0 < radius_miles <= LOCAL_MARKET_MAX_RADIUS_MILES):
+            return jsonify({'error': f'radius_miles must be between 0 and {LOCAL_MARKET_MAX_RADIUS_MILES}'}), 400
+        if k is not None and not (0 < k <= LOCAL_MARKET_MAX_K):
+            return jsonify({'error': f'k must be between 1 and {LOCAL_MARKET_MAX_K}'}), 400
 
-        if not output_data:
-            return jsonify({'message': 'No results found for the given criteria'}), 404
+        zip_info = geo_nomi.query_postal_code(zip_code)
+        if math.isnan(zip_info['latitude']) or math.isnan(zip_info['longitude']):
+            return jsonify({'message': f'Unknown ZIP code {zip_code}'}), 404
+        latitude, longitude = float(zip_info['latitude']), float(zip_info['longitude'])
 
-        return jsonify({'data': output_data})
+        employment_type = request.args.get('employment_type')
+        tree = get_spatial_index().get(employment_type or None)
+        if tree is None: # no submissions of that employment type
+            matches = []
+        elif radius_miles is not None:
+            matches = tree.within_radius(latitude, longitude, radius_miles)
+        else:
+            matches = tree.nearest(latitude, longitude, k)
+
+        app.logger.info(f"Local market benchmark for ZIP {zip_code}: {len(matches)} submissions matched")
+        return jsonify({
+            'zip': zip_code,
+            'centroid': {'latitude': latitude, 'longitude': longitude},
+            'radius_miles': radius_miles,
+            'k': k,
+            'employment_type': employment_type,
+            'count': len(matches),
+            'max_distance_miles': matches[-1][0] if matches else None,
+            'total_estimated_annual_compensation': summarize_compensation(matches),
+        })
 
     except bigquery.exceptions.GoogleCloudError as bq_error: # Catch BigQuery specific errors
-        app.logger.error(f"BigQuery error processing request: {str(bq_error)}")
-        # Extract more details if possible, like the job ID or reason
-        error_details = f"BigQuery API error: {str(bq_error)}"
-        if hasattr(bq_error, 'errors') and bq_error.errors:
-            error_details += f" - Reasons: {[e.get('reason', '') + ': ' + e.get('message', '') for e in bq_error.errors]}"
-        return jsonify({'error': f'An internal server error occurred (BigQuery): {error_details}'}), 500
+        return bigquery_error_response(bq_error)
     except Exception as e:
         app.logger.error(f"Generic error processing request: {str(e)}", exc_info=True) # Log full traceback for generic errors
         return jsonify({'error': f'An internal server error occurred: {str(e)}'}), 500
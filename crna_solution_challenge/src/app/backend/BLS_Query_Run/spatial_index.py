@@ -0,0 +1,117 @@
+# spatial_index.py
+#
+# KD-tree over ZIP centroids for "compensation near this ZIP" lookups.
+#
+# Points are stored as 3D unit vectors on the sphere. The straight-line (chord) distance between
+# two unit vectors grows monotonically with their great-circle (haversine) distance, so an ordinary
+# Euclidean KD-tree answers radius and k-nearest queries exactly, and chords convert back to miles
+# at the end. The tree is stored implicitly: `_order` is arranged so every subtree is a contiguous
+# slice with its splitting point in the middle, so there are no node objects to allocate.
+import heapq
+import math
+
+EARTH_RADIUS_MILES = 3958.8
+
+
+def to_unit_vector(latitude, longitude):
+    lat = math.radians(latitude)
+    lon = math.radians(longitude)
+    cos_lat = math.cos(lat)
+    return (cos_lat * math.cos(lon), cos_lat * math.sin(lon), math.sin(lat))
+
+def miles_to_chord(miles):
+    # Capped at half the circumference: beyond that every point on the sphere matches.
+    angle = min(miles / EARTH_RADIUS_MILES, math.pi)
+    return 2.0 * math.sin(angle / 2.0)
+
+def chord_to_miles(chord):
+    return 2.0 * EARTH_RADIUS_MILES * math.asin(min(chord / 2.0, 1.0))
+
+
+class SphericalKDTree:
+    def __init__(self, points, payloads):
+        # points: iterable of (latitude, longitude); payloads: same-length list returned with matches
+        self._xyz = [to_unit_vector(lat, lon) for lat, lon in points]
+        self._payloads = list(payloads)
+        if len(self._xyz) != len(self._payloads):
+            raise ValueError("points and payloads must have the same length")
+        self._order = list(range(len(self._xyz)))
+        self._axes = [0] * len(self._xyz) # splitting axis, indexed by position in _order
+        self._build(0, len(self._order))
+
+    def __len__(self):
+        return len(self._xyz)
+
+    def _build(self, lo, hi):
+        # Iterative to stay clear of the recursion limit on large, skewed inputs.
+        stack = [(lo, hi)]
+        while stack:
+            lo, hi = stack.pop()
+            if hi - lo <= 1:
+                continue
+            segment = self._order[lo:hi]
+            # Split on the axis with the widest spread; keeps cells compact for clustered ZIPs.
+            spreads = [max(self._xyz[i][a] for i in segment) - min(self._xyz[i][a] for i in segment) for a in range(3)]
+            axis = spreads.index(max(spreads))
+            segment.sort(key=lambda i: self._xyz[i][axis])
+            self._order[lo:hi] = segment
+            mid = (lo + hi) // 2
+            self._axes[mid] = axis
+            stack.append((lo, mid))
+            stack.append((mid + 1, hi))
+
+    def within_radius(self, latitude, longitude, radius_miles):
+        # Returns [(distance_miles, payload), ...] sorted by distance.
+        query = to_unit_vector(latitude, longitude)
+        radius_chord = miles_to_chord(radius_miles)
+        radius_sq = radius_chord * radius_chord
+        matches = []
+        stack = [(0, len(self._order))]
+        while stack:
+            lo, hi = stack.pop()
+            if lo >= hi:
+                continue
+            mid = (lo + hi) // 2
+            point_index = self._order[mid]
+            point = self._xyz[point_index]
+            dist_sq = (point[0] - query[0]) ** 2 + (point[1] - query[1]) ** 2 + (point[2] - query[2]) ** 2
+            if dist_sq <= radius_sq:
+                matches.append((math.sqrt(dist_sq), point_index))
+            if hi - lo == 1:
+                continue
+            axis = self._axes[mid]
+            diff = query[axis] - point[axis]
+            near, far = ((mid + 1, hi), (lo, mid)) if diff > 0 else ((lo, mid), (mid + 1, hi))
+            stack.append(near)
+            if diff * diff <= radius_sq:
+                stack.append(far)
+        matches.sort()
+        return [(chord_to_miles(chord), self._payloads[i]) for chord, i in matches]
+
+    def nearest(self, latitude, longitude, k):
+        # Returns the k nearest [(distance_miles, payload), ...] sorted by distance.
+        if k <= 0 or not self._order:
+            return []
+        query = to_unit_vector(latitude, longitude)
+        best = [] # max-heap via negated squared distance
+        def visit(lo, hi):
+            if lo >= hi:
+                return
+            mid = (lo + hi) // 2
+            point_index = self._order[mid]
+            point = self._xyz[point_index]
+            dist_sq = (point[0] - query[0]) ** 2 + (point[1] - query[1]) ** 2 + (point[2] - query[2]) ** 2
+            if len(best) < k:
+                heapq.heappush(best, (-dist_sq, point_index))
+            elif dist_sq < -best[0][0]:
+                heapq.heapreplace(best, (-dist_sq, point_index))
+            if hi - lo == 1:
+                return
+            axis = self._axes[mid]
+            diff = query[axis] - point[axis]
+            near, far = ((mid + 1, hi), (lo, mid)) if diff > 0 else ((lo, mid), (mid + 1, hi))
+            visit(*near)
+            if len(best) < k or diff * diff < -best[0][0]:
+                visit(*far)
+        visit(0, len(self._order)) # depth is O(log n) because every split is at the median
+        return [(chord_to_miles(math.sqrt(-neg_sq)), self._payloads[i]) for neg_sq, i in sorted(best, reverse=True)]
@@ -0,0 +1,36 @@
+# Shared fixtures for the BLS_Query_Run tests.
+# Run from BLS_Query_Run/:  pip install -r requirements-test.txt && python -m pytest tests
+import os
+import sys
+from unittest import mock
+
+import pytest
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVICE_DIR)
+
+# app.py creates its BigQuery client and pgeocode lookup at import time; neither may touch the network here.
+with mock.patch("google.cloud.bigquery.Client"), mock.patch("pgeocode.Nominatim"):
+    import app as bls_app_module  # noqa: E402
+
+
+@pytest.fixture
+def bls_app(monkeypatch):
+    # Fresh BigQuery mock, pinned snapshot version and empty spatial index per test.
+    monkeypatch.setattr(bls_app_module, "client", mock.MagicMock())
+    monkeypatch.setattr(bls_app_module, "BLS_DATA_SNAPSHOT_VERSION", "oews-2024")
+    monkeypatch.setattr(bls_app_module, "_spatial_index_state", {"trees": None, "built_at": 0.0})
+    return bls_app_module
+
+
+@pytest.fixture
+def http(bls_app):
+    return bls_app.app.test_client()
+
+
+@pytest.fixture
+def query_returns(bls_app):
+    # query_returns(rows) makes every BigQuery query in the app yield `rows`.
+    def set_rows(rows):
+        bls_app.client.query.return_value.result.return_value = rows
+    return set_rows
@@ -0,0 +1,56 @@
+# GET /get-bls-data caching: ETag on 200, 304 on strong and weak If-None-Match, short-lived 404s.
+
+LOOKUP = "/get-bls-data?OCC_TITLE=Nurse%20Anesthetists&A_MEAN=214200"
+ROWS = [{"OCC_TITLE": "Nurse Anesthetists", "A_MEAN": "214200", "AREA_TITLE": "U.S."}]
+
+
+def test_hit_carries_etag_and_long_cache_lifetime(bls_app, http, query_returns):
+    query_returns(ROWS)
+    response = http.get(LOOKUP)
+    assert response.status_code == 200
+    assert response.get_json() == {"data": ROWS}
+    assert response.headers["ETag"] == f'"{bls_app.compute_bls_etag("oews-2024", "Nurse Anesthetists", 214200.0)}"'
+    assert response.headers["Cache-Control"] == f"public, max-age={bls_app.BLS_CACHE_MAX_AGE_SECONDS}"
+
+
+def test_strong_if_none_match_returns_304_without_querying(bls_app, http, query_returns):
+    query_returns(ROWS)
+    etag = http.get(LOOKUP).headers["ETag"]
+    bls_app.client.query.reset_mock()
+
+    response = http.get(LOOKUP, headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+    assert response.data == b""
+    bls_app.client.query.assert_not_called()
+
+
+def test_weak_if_none_match_returns_304(bls_app, http, query_returns):
+    # Compressing proxies/CDNs hand the client W/"..." in place of the origin's strong ETag.
+    query_returns(ROWS)
+    etag = http.get(LOOKUP).headers["ETag"]
+    response = http.get(LOOKUP, headers={"If-None-Match": f"W/{etag}"})
+    assert response.status_code == 304
+
+
+def test_stale_etag_is_answered_with_full_response(bls_app, http, query_returns):
+    query_returns(ROWS)
+    etag = bls_app.compute_bls_etag("oews-2023", "Nurse Anesthetists", 214200.0)
+    response = http.get(LOOKUP, headers={"If-None-Match": f'"{etag}"'})
+    assert response.status_code == 200
+    assert response.get_json() == {"data": ROWS}
+
+
+def test_not_found_is_cached_briefly_without_etag(bls_app, http, query_returns):
+    query_returns([])
+    response = http.get(LOOKUP)
+    assert response.status_code == 404
+    assert "ETag" not in response.headers
+    assert response.headers["Cache-Control"] == f"public, max-age={bls_app.BLS_NOT_FOUND_MAX_AGE_SECONDS}"
+    assert bls_app.BLS_NOT_FOUND_MAX_AGE_SECONDS < bls_app.BLS_CACHE_MAX_AGE_SECONDS
+
+
+def test_invalid_a_mean_is_rejected_before_querying(bls_app, http):
+    response = http.get("/get-bls-data?OCC_TITLE=Nurse%20Anesthetists&A_MEAN=lots")
+    assert response.status_code == 400
+    bls_app.client.query.assert_not_called()
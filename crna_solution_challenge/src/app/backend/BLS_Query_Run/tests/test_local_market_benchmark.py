@@ -0,0 +1,107 @@
+# GET /local-market-benchmark over a stubbed spatial index and ZIP lookup.
+import time
+
+import pytest
+
+from spatial_index import SphericalKDTree
+
+ZIP_CENTROIDS = {"90210": (34.0901, -118.4065), "90024": (34.0633, -118.4455), "10001": (40.7506, -73.9972)}
+SUBMISSIONS = [
+    ("90210", 210000, "W2"), ("90210", 230000, "1099/Contractor"), ("90024", 250000, "W2"),
+    ("90024", 190000, None), ("10001", 300000, "W2"),
+]
+
+
+class StubNominatim:
+    def query_postal_code(self, zip_code):
+        latitude, longitude = ZIP_CENTROIDS.get(zip_code, (float("nan"), float("nan")))
+        return {"latitude": latitude, "longitude": longitude}
+
+
+def submission_rows():
+    return [
+        {"location_zip_code": zip_code, "location_latitude": ZIP_CENTROIDS[zip_code][0],
+         "location_longitude": ZIP_CENTROIDS[zip_code][1], "total_estimated_annual_compensation": compensation,
+         "employment_type": employment_type, "experience_bucket": "5-9"}
+        for zip_code, compensation, employment_type in SUBMISSIONS
+    ]
+
+
+@pytest.fixture
+def benchmark_app(bls_app, monkeypatch):
+    monkeypatch.setattr(bls_app, "CRNA_SUBMISSIONS_TABLE_ID", "project.dataset.submissions")
+    monkeypatch.setattr(bls_app, "geo_nomi", StubNominatim())
+    return bls_app
+
+
+def build_tree(rows):
+    return SphericalKDTree([(row["location_latitude"], row["location_longitude"]) for row in rows],
+                           [{"zip": row["location_zip_code"], "compensation": row["total_estimated_annual_compensation"]} for row in rows])
+
+
+@pytest.fixture
+def stub_index(benchmark_app):
+    # A fresh prebuilt index, so requests never reach BigQuery.
+    rows = submission_rows()
+    trees = {None: build_tree(rows)}
+    for employment_type in ("W2", "1099/Contractor"):
+        trees[employment_type] = build_tree([row for row in rows if row["employment_type"] == employment_type])
+    benchmark_app._spatial_index_state.update(trees=trees, built_at=time.monotonic())
+    return trees
+
+
+def test_radius_lookup(benchmark_app, stub_index, http):
+    response = http.get("/local-market-benchmark?zip=90210&radius_miles=10")
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body["count"] == 4
+    assert body["total_estimated_annual_compensation"]["min"] == 190000
+    assert body["total_estimated_annual_compensation"]["max"] == 250000
+    assert body["total_estimated_annual_compensation"]["median"] == 220000
+    benchmark_app.client.query.assert_not_called()
+
+
+def test_k_nearest_by_employment_type(benchmark_app, stub_index, http):
+    body = http.get("/local-market-benchmark?zip=90210&k=2&employment_type=W2").get_json()
+    assert body["count"] == 2
+    assert body["k"] == 2 and body["employment_type"] == "W2"
+    assert body["total_estimated_annual_compensation"]["min"] == 210000
+    assert body["total_estimated_annual_compensation"]["max"] == 250000
+
+
+def test_unknown_employment_type_matches_nothing(benchmark_app, stub_index, http):
+    body = http.get("/local-market-benchmark?zip=90210&k=5&employment_type=Locum").get_json()
+    assert body["count"] == 0
+    assert body["total_estimated_annual_compensation"] is None
+
+
+@pytest.mark.parametrize("query", [
+    "zip=9021&k=5", "zip=abcde&k=5", "k=5",
+    "zip=90210", "zip=90210&k=5&radius_miles=10",
+    "zip=90210&k=five", "zip=90210&radius_miles=far",
+    "zip=90210&k=0", "zip=90210&k=501", "zip=90210&radius_miles=0", "zip=90210&radius_miles=501",
+])
+def test_invalid_parameters_return_400(benchmark_app, stub_index, http, query):
+    response = http.get(f"/local-market-benchmark?{query}")
+    assert response.status_code == 400
+    assert "error" in response.get_json()
+
+
+def test_unknown_zip_returns_404(benchmark_app, stub_index, http):
+    response = http.get("/local-market-benchmark?zip=00000&k=5")
+    assert response.status_code == 404
+
+
+@pytest.mark.parametrize("missing", ["CRNA_SUBMISSIONS_TABLE_ID", "geo_nomi"])
+def test_unconfigured_service_returns_503(benchmark_app, stub_index, http, monkeypatch, missing):
+    monkeypatch.setattr(benchmark_app, missing, None)
+    assert http.get("/local-market-benchmark?zip=90210&k=5").status_code == 503
+
+
+def test_load_spatial_index_keeps_null_employment_type_out_of_typed_trees(benchmark_app, query_returns):
+    query_returns(submission_rows())
+    trees = benchmark_app.load_spatial_index()
+    assert sorted(trees, key=str) == sorted([None, "W2", "1099/Contractor"], key=str)
+    assert len(trees[None]) == len(SUBMISSIONS) # the NULL-typed row is indexed once, not twice
+    assert len(trees["W2"]) == 3
+    assert len(trees["1099/Contractor"]) == 1
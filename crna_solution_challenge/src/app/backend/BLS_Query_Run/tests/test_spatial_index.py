@@ -0,0 +1,79 @@
+# SphericalKDTree against a brute-force haversine scan.
+import math
+import random
+
+import pytest
+
+from spatial_index import EARTH_RADIUS_MILES, SphericalKDTree
+
+
+def haversine_miles(lat1, lon1, lat2, lon2):
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    a = (math.sin((phi2 - phi1) / 2) ** 2
+         + math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_MILES * math.asin(math.sqrt(a))
+
+
+@pytest.fixture(scope="module")
+def points():
+    # Continental-US-ish spread with clusters of identical ZIP centroids, as real submissions have.
+    rng = random.Random(33)
+    centroids = [(rng.uniform(25, 49), rng.uniform(-124, -67)) for _ in range(300)]
+    return centroids + [rng.choice(centroids) for _ in range(300)]
+
+
+@pytest.fixture(scope="module")
+def tree(points):
+    return SphericalKDTree(points, list(range(len(points))))
+
+
+QUERIES = [(34.05, -118.24), (40.71, -74.0), (41.88, -87.63), (25.76, -80.19), (47.6, -122.33), (0.0, 0.0)]
+
+
+def brute_force(points, latitude, longitude):
+    return sorted((haversine_miles(latitude, longitude, lat, lon), index) for index, (lat, lon) in enumerate(points))
+
+
+@pytest.mark.parametrize("latitude,longitude", QUERIES)
+@pytest.mark.parametrize("radius_miles", [0.5, 25, 150, 800, 20000])
+def test_within_radius_matches_brute_force(tree, points, latitude, longitude, radius_miles):
+    expected = [(distance, index) for distance, index in brute_force(points, latitude, longitude) if distance <= radius_miles]
+    matches = tree.within_radius(latitude, longitude, radius_miles)
+    assert sorted(index for _, index in matches) == sorted(index for _, index in expected)
+    assert [distance for distance, _ in matches] == pytest.approx([distance for distance, _ in expected], abs=1e-6)
+
+
+@pytest.mark.parametrize("latitude,longitude", QUERIES)
+@pytest.mark.parametrize("k", [1, 5, 40, 600, 1000])
+def test_nearest_matches_brute_force(tree, points, latitude, longitude, k):
+    expected = brute_force(points, latitude, longitude)[:k]
+    matches = tree.nearest(latitude, longitude, k)
+    assert len(matches) == min(k, len(points))
+    distances = [distance for distance, _ in matches]
+    assert distances == sorted(distances)
+    assert distances == pytest.approx([distance for distance, _ in expected], abs=1e-6)
+    # Ties between duplicate centroids may be broken either way, but never by skipping a closer point.
+    assert len({index for _, index in matches}) == len(matches)
+
+
+def test_duplicate_points_are_all_returned(points):
+    duplicated = [points[0]] * 10 + points[1:20]
+    tree = SphericalKDTree(duplicated, list(range(len(duplicated))))
+    at_point = tree.within_radius(*points[0], 0.001)
+    assert sorted(index for _, index in at_point)[:10] == list(range(10))
+    assert all(distance == pytest.approx(0.0, abs=1e-6) for distance, _ in tree.nearest(*points[0], 10))
+
+
+def test_empty_tree_and_degenerate_k():
+    empty = SphericalKDTree([], [])
+    assert len(empty) == 0
+    assert empty.within_radius(34.0, -118.0, 100) == []
+    assert empty.nearest(34.0, -118.0, 5) == []
+    single = SphericalKDTree([(34.0, -118.0)], ["only"])
+    assert single.nearest(34.0, -118.0, 0) == []
+    assert [payload for _, payload in single.nearest(0.0, 0.0, 3)] == ["only"]
+
+
+def test_points_and_payloads_must_align():
+    with pytest.raises(ValueError):
+        SphericalKDTree([(34.0, -118.0)], [])
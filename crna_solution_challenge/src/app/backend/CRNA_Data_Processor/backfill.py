@@ -0,0 +1,260 @@
+# CRNA_Data_Processor/backfill.py
+#
+# Reprocesses historical CRNA submissions through the same validation and enrichment
+# logic the Pub/Sub function uses (main.build_row_for_bq), sharded across all CPU cores.
+# Use it after changing ALLOWED_* lists, the compensation assumptions or STATE_TO_REGION.
+#
+# Usage:
+#   python backfill.py --input raw_submissions.jsonl --output-dir backfill_out
+#   python backfill.py --input pubsub_export.jsonl --input-format pubsub --output-dir backfill_out \
+#       --workers 8 --shard-size 5000 --load-table project.dataset.table
+#
+# Input formats (one record per line):
+#   jsonl  - the raw submission object, as published by CRNA_Submission_Run
+#   pubsub - {"data": "<base64 message data>", "attributes": {...}}, e.g. a dump of the topic
+#
+# Output: one part-NNNNNN.jsonl file of BigQuery-ready rows per shard, plus rejects-NNNNNN.jsonl
+# with the validation errors. Finished shards are recorded in _checkpoint.json, so re-running
+# the same command after an interruption only processes the shards that are still missing.
+# With --load-table, each shard's load job gets a deterministic job ID (output dir, input, shard), so
+# a shard that was loaded but not yet checkpointed when the run died is not appended a second time.
+import argparse
+import base64
+import hashlib
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+# The change log and shadow mode are configured from the environment when main is imported. They belong
+# to the Pub/Sub function only: a backfill would start them in every worker process.
+for env_var in ("CHANGELOG_DIR", "SHADOW_PROCESSOR"):
+    os.environ.pop(env_var, None)
+
+import json_codec
+import main # Importing initializes the shared clients (BigQuery, pgeocode) once per process
+
+logger = logging.getLogger("backfill")
+
+CHECKPOINT_FILE_NAME = "_checkpoint.json"
+LOAD_JOB_MAX_ATTEMPTS = 5
+
+
+# --- Helpers ---
+def write_file_atomically(path, chunks):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as fh:
+        fh.writelines(chunks)
+    os.replace(tmp_path, path)
+
+def decode_input_line(line, input_format):
+    if input_format == "pubsub":
+        message = main.json_loads(line)
+        return main.decode_submission_message(base64.b64decode(message["data"]), message.get("attributes"))
+    return main.json_loads(line)
+
+def iter_shards(input_path, shard_size):
+    # Yields (shard_index, first_line_number, lines). Shard boundaries only depend on the
+    # input file and shard_size, which is what makes checkpoints resumable.
+    shard_index, first_line_number, lines = 0, 1, []
+    with open(input_path, "rb") as fh:
+        for line_number, line in enumerate(fh, start=1):
+            if not lines:
+                first_line_number = line_number
+            lines.append(line)
+            if len(lines) >= shard_size:
+                yield shard_index, first_line_number, lines
+                shard_index, lines = shard_index + 1, []
+    if lines:
+        yield shard_index, first_line_number, lines
+
+
+# --- Checkpoints ---
+def load_checkpoint(output_dir, input_path, input_format, shard_size):
+    checkpoint_path = os.path.join(output_dir, CHECKPOINT_FILE_NAME)
+    if not os.path.exists(checkpoint_path):
+        return set()
+    with open(checkpoint_path, "r") as fh:
+        checkpoint = json.load(fh)
+    expected = {"input": os.path.abspath(input_path), "input_format": input_format, "shard_size": shard_size}
+    for key, value in expected.items():
+        if checkpoint.get(key) != value:
+            raise ValueError(
+                f"Checkpoint in {output_dir} was written with {key}={checkpoint.get(key)!r}, "
+                f"this run uses {value!r}. Use a fresh --output-dir or the original arguments."
+            )
+    return set(checkpoint.get("completed_shards", []))
+
+def save_checkpoint(output_dir, input_path, input_format, shard_size, completed_shards):
+    checkpoint = {
+        "input": os.path.abspath(input_path),
+        "input_format": input_format,
+        "shard_size": shard_size,
+        "completed_shards": sorted(completed_shards),
+        "updated_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    }
+    write_file_atomically(os.path.join(output_dir, CHECKPOINT_FILE_NAME), [json.dumps(checkpoint, indent=2).encode("utf-8")])
+
+
+# --- Worker ---
+def init_worker(verbose):
+    # The processor logs several INFO lines per row, which would dominate a backfill.
+    main.logger.setLevel(logging.INFO if verbose else logging.WARNING)
+
+def process_shard(shard_index, first_line_number, lines, output_dir, input_format):
+    started = time.perf_counter()
+    row_chunks = []
+    reject_chunks = []
+    for offset, line in enumerate(lines):
+        if not line.strip():
+            continue
+        line_number = first_line_number + offset
+        try:
+            submission = decode_input_line(line, input_format)
+            if not isinstance(submission, dict):
+                raise ValueError(f"expected a JSON object, got {type(submission).__name__}")
+        except Exception as e:
+            reject_chunks.append(json_codec.dumps_line({"line_number": line_number, "errors": [f"Undecodable record: {e}"]}))
+            continue
+
+        final_row_for_bq, validation_errors = main.build_row_for_bq(submission)
+        if validation_errors:
+            reject_chunks.append(json_codec.dumps_line({
+                "line_number": line_number,
+                "submission_id_server": submission.get("submission_id_server"),
+                "errors": validation_errors,
+            }))
+        else:
+            row_chunks.append(json_codec.dumps_line(final_row_for_bq))
+
+    part_path = os.path.join(output_dir, f"part-{shard_index:06d}.jsonl")
+    write_file_atomically(part_path, row_chunks)
+    write_file_atomically(os.path.join(output_dir, f"rejects-{shard_index:06d}.jsonl"), reject_chunks)
+    return {
+        "shard_index": shard_index,
+        "part_path": part_path,
+        "rows": len(row_chunks),
+        "rejected": len(reject_chunks),
+        "seconds": time.perf_counter() - started,
+    }
+
+
+# --- BigQuery Load ---
+def load_job_id_prefix(output_dir, input_path, input_format, shard_size, table_id, shard_index):
+    # Same backfill (output dir + input + sharding) and shard -> same prefix, across restarts.
+    identity = "|".join([os.path.abspath(output_dir), os.path.abspath(input_path), input_format, str(shard_size), table_id])
+    return f"crna_backfill_{hashlib.sha256(identity.encode('utf-8')).hexdigest()[:32]}_{shard_index:06d}"
+
+def load_part_into_bigquery(part_path, table_id, job_id_prefix, location=None):
+    # BigQuery refuses a second job with an existing ID (409 Conflict), which makes the load idempotent:
+    # on resume, a shard whose job already succeeded is skipped. A failed job's ID can't be reused, so
+    # each retry takes the next attempt suffix.
+    from google.api_core.exceptions import Conflict
+    from google.cloud import bigquery
+
+    job_config = bigquery.LoadJobConfig(
+        source_format=bigquery.SourceFormat.NEWLINE_DELIMITED_JSON,
+        write_disposition=bigquery.WriteDisposition.WRITE_APPEND,
+    )
+    for attempt in range(LOAD_JOB_MAX_ATTEMPTS):
+        job_id = f"{job_id_prefix}_{attempt}"
+        try:
+            with open(part_path, "rb") as fh:
+                load_job = main.bq_client.load_table_from_file(fh, table_id, job_id=job_id, location=location, job_config=job_config)
+        except Conflict:
+            existing_job = main.bq_client.get_job(job_id, location=location)
+            try:
+                existing_job.result() # Waits if still running; raises if it failed
+            except Exception as e:
+                logger.warning(f"Earlier load job {job_id} for {part_path} failed ({e}), retrying as a new job.")
+                continue
+            logger.info(f"{part_path} was already loaded by job {job_id} ({existing_job.output_rows} rows), skipping.")
+            return
+        load_job.result() # Raises on failure, so the shard is not checkpointed
+        logger.info(f"Loaded {load_job.output_rows} rows from {part_path} into {table_id} (job {load_job.job_id})")
+        return
+    raise RuntimeError(f"All {LOAD_JOB_MAX_ATTEMPTS} load jobs for {part_path} failed; see jobs {job_id_prefix}_*")
+
+
+# --- Runner ---
+def run_backfill(input_path, output_dir, input_format="jsonl", workers=None, shard_size=5000, load_table=None, verbose=False):
+    os.makedirs(output_dir, exist_ok=True)
+    workers = workers or os.cpu_count() or 1
+    if load_table and not main.bq_client:
+        raise ConnectionError("--load-table was given but the BigQuery client is not initialized.")
+    load_location = main.bq_client.get_table(load_table).location if load_table else None # also fails fast on a bad table
+
+    completed_shards = load_checkpoint(output_dir, input_path, input_format, shard_size)
+    if completed_shards:
+        logger.info(f"Resuming: {len(completed_shards)} shards already completed in {output_dir}")
+
+    init_worker(verbose)
+    totals = {"shards": 0, "rows": 0, "rejected": 0}
+    started = time.perf_counter()
+
+    def on_shard_done(result):
+        if load_table and result["rows"]:
+            job_id_prefix = load_job_id_prefix(output_dir, input_path, input_format, shard_size, load_table, result["shard_index"])
+            load_part_into_bigquery(result["part_path"], load_table, job_id_prefix, load_location)
+        completed_shards.add(result["shard_index"])
+        save_checkpoint(output_dir, input_path, input_format, shard_size, completed_shards)
+
+        totals["shards"] += 1
+        totals["rows"] += result["rows"]
+        totals["rejected"] += result["rejected"]
+        elapsed = time.perf_counter() - started
+        processed = totals["rows"] + totals["rejected"]
+        logger.info(
+            f"Shard {result['shard_index']} done in {result['seconds']:.1f}s: {result['rows']} rows, {result['rejected']} rejected. "
+            f"Progress: {totals['shards']} shards, {processed} records in {elapsed:.1f}s ({processed / elapsed if elapsed else 0:.0f} records/s)"
+        )
+
+    # Keep at most two shards per worker in flight so memory stays bounded on large exports.
+    max_in_flight = workers * 2
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(verbose,)) as executor:
+        pending = set()
+        for shard_index, first_line_number, lines in iter_shards(input_path, shard_size):
+            if shard_index in completed_shards:
+                continue
+            pending.add(executor.submit(process_shard, shard_index, first_line_number, lines, output_dir, input_format))
+            if len(pending) >= max_in_flight:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    on_shard_done(future.result())
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                on_shard_done(future.result())
+
+    logger.info(
+        f"Backfill finished: {totals['shards']} shards processed this run, {totals['rows']} rows written, "
+        f"{totals['rejected']} rejected, output in {output_dir}"
+    )
+    return totals
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Reprocess historical CRNA submissions in parallel.")
+    parser.add_argument("--input", required=True, help="File with one raw submission (or Pub/Sub message) per line.")
+    parser.add_argument("--input-format", choices=["jsonl", "pubsub"], default="jsonl")
+    parser.add_argument("--output-dir", required=True, help="Directory for part/reject files and the checkpoint.")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count).")
+    parser.add_argument("--shard-size", type=int, default=5000, help="Records per shard / output part file.")
+    parser.add_argument("--load-table", default=None, help="Optional BigQuery table ID to append each finished part to.")
+    parser.add_argument("--verbose", action="store_true", help="Keep the processor's per-row INFO logging.")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    args = parse_args()
+    try:
+        run_backfill(
+            args.input, args.output_dir, input_format=args.input_format, workers=args.workers,
+            shard_size=args.shard_size, load_table=args.load_table, verbose=args.verbose,
+        )
+    except (ValueError, ConnectionError) as e:
+        logger.error(str(e))
+        sys.exit(1)
@@ -0,0 +1,370 @@
+# CRNA_Data_Processor/changelog.py
+#
+# Append-only change log of the rows the processor writes, so downstream consumers (dashboards,
+# Looker Studio extracts) can apply only new rows instead of re-querying the whole submissions table.
+#
+# CHANGELOG_DIR must be storage that outlives function instances and is shared by all of them (e.g. a
+# Filestore/NFS volume mount). The function's local /tmp is per instance and is lost when the instance
+# is recycled, so it only suits local runs. The processor autoscales, so every writer process gets its
+# own namespace with its own seq numbers; no two writers ever append to the same files:
+#   <dir>/<writer_id>/segment-<first_seq>.log   JSON lines, one record per change, seq strictly increasing
+#   <dir>/<writer_id>/.lock                     flock held by the live writer of this namespace
+#   <dir>/offsets.json                          {"<consumer>": {"<writer_id>": <last seq applied>}}
+#   <dir>/offsets.lock                          flock serialising read-modify-writes of offsets.json
+# CHANGELOG_WRITER_ID pins the namespace (e.g. for a single long-lived instance); by default each
+# process starts a fresh one. Opening a namespace another live process holds raises RuntimeError.
+#
+# A record is compact: only non-null columns are stored, plus the names of the columns the
+# processor derived during enrichment.
+#   {"seq": 42, "writer": "...", "op": "insert", "ts": "...", "key": "<submission_id>", "columns": {...}, "enriched": [...]}
+#
+# Segments roll over at CHANGELOG_SEGMENT_MAX_BYTES. Only the newest segment of a live namespace is ever
+# appended to; older ones are sealed, as is every segment of a namespace whose writer has exited (its
+# .lock is free). compact() deletes sealed segments once every registered consumer has read past them,
+# and removes a dead namespace, with its offsets.json entries, once all of it has been read.
+#
+# Usage:
+#   python changelog.py read <dir> [--consumer NAME] [--follow] [--commit]
+#   python changelog.py compact <dir>
+#   python changelog.py offsets <dir>
+import argparse
+import bisect
+import fcntl
+import json
+import logging
+import os
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import json_codec
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+DEFAULT_SEGMENT_MAX_BYTES = 8 * 1024 * 1024
+OFFSETS_FILE_NAME = "offsets.json"
+OFFSETS_LOCK_FILE_NAME = "offsets.lock"
+LOCK_FILE_NAME = ".lock"
+SEGMENT_NAME_PATTERN = re.compile(r"^segment-(\d{20})\.log$")
+WRITER_ID_PATTERN = re.compile(r"^[A-Za-z0-9_.-]+$")
+
+# Columns filled in by build_row_for_bq rather than submitted by the user.
+ENRICHED_COLUMNS = (
+    "derived_location_state", "derived_location_city", "derived_location_county", "location_latitude",
+    "location_longitude", "location_region", "experience_bucket", "total_estimated_annual_compensation",
+)
+
+
+def segment_file_name(first_seq):
+    return f"segment-{first_seq:020d}.log"
+
+def list_writers(directory):
+    # Writer namespaces are the subdirectories of the change log directory.
+    if not os.path.isdir(directory):
+        return []
+    return sorted(name for name in os.listdir(directory)
+                  if WRITER_ID_PATTERN.match(name) and os.path.isdir(os.path.join(directory, name)))
+
+def list_segments(writer_dir):
+    # Returns [(first_seq, path), ...] sorted by first_seq.
+    segments = []
+    for name in os.listdir(writer_dir) if os.path.isdir(writer_dir) else []:
+        match = SEGMENT_NAME_PATTERN.match(name)
+        if match:
+            segments.append((int(match.group(1)), os.path.join(writer_dir, name)))
+    return sorted(segments)
+
+def _last_seq(segments):
+    # Seq of the last complete record of a namespace, 0 when it has none.
+    for _, path in reversed(segments):
+        last_seq = None
+        for record in _iter_segment(path):
+            last_seq = record["seq"]
+        if last_seq is not None:
+            return last_seq
+    return 0
+
+def _iter_segment(path):
+    # Skips a torn final line (a crash mid-append); the writer truncates it when the namespace is reopened.
+    with open(path, "rb") as fh:
+        for line in fh:
+            if line.endswith(b"\n"):
+                yield json_codec.loads(line)
+
+
+def build_change_record(row, op="insert"):
+    # Compact form of a BigQuery row: null columns are dropped, enriched columns are listed by name.
+    columns = {name: value for name, value in row.items() if value is not None}
+    return {
+        "op": op,
+        "ts": datetime.now(timezone.utc).isoformat(),
+        "key": row.get("submission_id"),
+        "columns": columns,
+        "enriched": [name for name in ENRICHED_COLUMNS if name in columns],
+    }
+
+
+# --- Writer ---
+class ChangeLogWriter:
+    def __init__(self, directory, writer_id=None, segment_max_bytes=DEFAULT_SEGMENT_MAX_BYTES):
+        self.directory = directory
+        self.writer_id = writer_id or f"{datetime.now(timezone.utc):%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:8]}"
+        if not WRITER_ID_PATTERN.match(self.writer_id):
+            raise ValueError(f"Invalid change log writer id '{self.writer_id}'")
+        self.writer_dir = os.path.join(directory, self.writer_id)
+        self.segment_max_bytes = segment_max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(self.writer_dir, exist_ok=True)
+        # Held for the writer's lifetime; released by the OS if the process dies.
+        self._lock_file = open(os.path.join(self.writer_dir, LOCK_FILE_NAME), "a")
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self._lock_file.close()
+            raise RuntimeError(f"Change log namespace {self.writer_dir} is held by another writer")
+        self._next_seq, self._segment_path = self._recover()
+        self._segment = open(self._segment_path, "ab")
+
+    @classmethod
+    def from_env(cls):
+        # Returns None when the change log is not configured.
+        directory = os.getenv("CHANGELOG_DIR")
+        if not directory:
+            return None
+        return cls(
+            directory,
+            writer_id=os.getenv("CHANGELOG_WRITER_ID"),
+            segment_max_bytes=int(os.getenv("CHANGELOG_SEGMENT_MAX_BYTES", str(DEFAULT_SEGMENT_MAX_BYTES))),
+        )
+
+    def _recover(self):
+        # Returns (next_seq, active_segment_path), trimming a torn last line from the newest segment.
+        segments = list_segments(self.writer_dir)
+        if not segments:
+            return 1, os.path.join(self.writer_dir, segment_file_name(1))
+        first_seq, path = segments[-1]
+        last_seq = first_seq - 1
+        valid_bytes = 0
+        with open(path, "rb") as fh:
+            for line in fh:
+                if not line.endswith(b"\n"):
+                    break
+                last_seq = json_codec.loads(line)["seq"]
+                valid_bytes += len(line)
+        if valid_bytes != os.path.getsize(path):
+            logger.warning(f"Truncating torn record at the end of change log segment {path}")
+            with open(path, "r+b") as fh:
+                fh.truncate(valid_bytes)
+        return last_seq + 1, path
+
+    def append(self, record):
+        # Assigns the next seq of this namespace to `record` (a dict from build_change_record) and returns it.
+        with self._lock:
+            seq = self._next_seq
+            line = json_codec.dumps_line({"seq": seq, "writer": self.writer_id, **record})
+            if self._segment.tell() and self._segment.tell() + len(line) > self.segment_max_bytes:
+                self._roll(seq)
+            self._segment.write(line)
+            self._segment.flush()
+            self._next_seq = seq + 1
+            return seq
+
+    def _roll(self, first_seq):
+        self._segment.close()
+        self._segment_path = os.path.join(self.writer_dir, segment_file_name(first_seq))
+        self._segment = open(self._segment_path, "ab")
+
+    @property
+    def last_seq(self):
+        return self._next_seq - 1
+
+    def close(self):
+        with self._lock:
+            self._segment.close()
+            self._lock_file.close() # releases the flock
+
+
+# --- Reader & Offsets ---
+class ChangeLogReader:
+    def __init__(self, directory):
+        self.directory = directory
+        self.offsets_path = os.path.join(directory, OFFSETS_FILE_NAME)
+
+    def read(self, writer_id, after_seq=0, max_records=None):
+        # Returns one namespace's records with seq > after_seq, in order. Compaction may leave gaps in seq.
+        segments = list_segments(os.path.join(self.directory, writer_id))
+        # Start at the last segment whose first seq is <= after_seq + 1; earlier ones are all older.
+        start = max(0, bisect.bisect_right([first_seq for first_seq, _ in segments], after_seq + 1) - 1)
+        records = []
+        for _, path in segments[start:]:
+            try:
+                for record in _iter_segment(path):
+                    if record["seq"] > after_seq:
+                        records.append(record)
+                        if max_records is not None and len(records) >= max_records:
+                            return records
+            except FileNotFoundError: # Deleted by a concurrent compaction; its records were consumed
+                continue
+        return records
+
+    def read_all(self, positions=None, max_records_per_writer=None):
+        # Returns {writer_id: [records]} with everything after `positions` ({writer_id: seq}, see get_offset).
+        positions = positions or {}
+        batches = {}
+        for writer_id in list_writers(self.directory):
+            records = self.read(writer_id, positions.get(writer_id, 0), max_records_per_writer)
+            if records:
+                batches[writer_id] = records
+        return batches
+
+    def tail(self, positions=None, poll_interval_seconds=1.0, batch_size=1000):
+        # Yields records from every namespace forever, polling for new appends once caught up.
+        # Order is per writer; records from different writers are interleaved batch by batch.
+        positions = dict(positions or {})
+        while True:
+            batches = self.read_all(positions, batch_size)
+            for writer_id, records in batches.items():
+                for record in records:
+                    yield record
+                    positions[writer_id] = record["seq"]
+            if not any(len(records) == batch_size for records in batches.values()):
+                time.sleep(poll_interval_seconds)
+
+    def load_offsets(self):
+        if not os.path.exists(self.offsets_path):
+            return {}
+        with open(self.offsets_path, "r") as fh:
+            return json.load(fh)
+
+    def get_offset(self, consumer):
+        # {writer_id: last seq the consumer committed}; a missing writer means "from the beginning".
+        return self.load_offsets().get(consumer, {})
+
+    @contextmanager
+    def update_offsets(self):
+        # Yields the offsets dict for in-place changes and writes it back on exit. The flock makes
+        # concurrent consumers (and compact()) take turns, so no commit is lost; each write goes through
+        # its own temp file and is swapped in atomically, so readers never see a partial file.
+        with open(os.path.join(self.directory, OFFSETS_LOCK_FILE_NAME), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            offsets = self.load_offsets()
+            yield offsets
+            fd, tmp_path = tempfile.mkstemp(prefix=f"{OFFSETS_FILE_NAME}.", suffix=".tmp", dir=self.directory)
+            try:
+                with os.fdopen(fd, "w") as fh:
+                    json.dump(offsets, fh, indent=4, sort_keys=True)
+                os.replace(tmp_path, self.offsets_path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+
+    def commit_offset(self, consumer, writer_id, seq):
+        # Offsets only move forward.
+        with self.update_offsets() as offsets:
+            positions = offsets.setdefault(consumer, {})
+            positions[writer_id] = max(seq, positions.get(writer_id, 0))
+            return positions[writer_id]
+
+
+# --- Compaction ---
+@contextmanager
+def _namespace_lock_if_dead(writer_dir):
+    # Yields True while holding the namespace's writer lock if no live writer holds it, False otherwise.
+    # Holding it keeps a writer reopening the same CHANGELOG_WRITER_ID out until compaction is done.
+    with open(os.path.join(writer_dir, LOCK_FILE_NAME), "a") as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        yield True
+
+def compact(directory):
+    """
+    Deletes what every consumer in offsets.json has read past:
+      - sealed segments, i.e. every segment but the newest of a namespace;
+      - namespaces whose writer has exited (its .lock can be taken), as a whole, pruning their entries
+        from offsets.json. Without this, every recycled instance would leave its namespace behind.
+    Nothing is deleted until at least one consumer is registered. Records are never rewritten: the
+    processor only appends inserts keyed by a unique submission_id, so there is no older version of a
+    key to drop. Returns a summary dict.
+    """
+    reader = ChangeLogReader(directory)
+    summary = {"segments_dropped": 0, "namespaces_removed": 0}
+    offsets = reader.load_offsets()
+    if not offsets:
+        logger.info(f"Compacted change log {directory}: no registered consumers, nothing dropped")
+        return summary
+
+    for writer_id in list_writers(directory):
+        writer_dir = os.path.join(directory, writer_id)
+        min_committed = min(positions.get(writer_id, 0) for positions in offsets.values())
+        with _namespace_lock_if_dead(writer_dir) as dead:
+            segments = list_segments(writer_dir)
+            if dead and _last_seq(segments) <= min_committed:
+                shutil.rmtree(writer_dir)
+                summary["segments_dropped"] += len(segments)
+                summary["namespaces_removed"] += 1
+                continue
+            # A segment with a successor is sealed and ends right before the successor's first seq. The
+            # newest segment only goes with its whole namespace, above, once its writer is gone.
+            for (_, path), (next_first_seq, _) in zip(segments, segments[1:]):
+                if next_first_seq - 1 <= min_committed:
+                    os.remove(path)
+                    summary["segments_dropped"] += 1
+
+    if summary["namespaces_removed"]:
+        # Prunes every entry whose namespace is gone, including a commit that raced the removal.
+        existing_writers = set(list_writers(directory))
+        with reader.update_offsets() as current_offsets:
+            for positions in current_offsets.values():
+                for writer_id in set(positions) - existing_writers:
+                    del positions[writer_id]
+    logger.info(f"Compacted change log {directory}: {summary}")
+    return summary
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Read, compact or inspect a CRNA submissions change log.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    read_parser = subparsers.add_parser("read", help="Print records as JSON lines.")
+    read_parser.add_argument("directory")
+    read_parser.add_argument("--consumer", default=None, help="Start from this consumer's committed offsets.")
+    read_parser.add_argument("--follow", action="store_true", help="Keep polling for new records.")
+    read_parser.add_argument("--commit", action="store_true", help="Commit the consumer offset after each record.")
+
+    compact_parser = subparsers.add_parser("compact", help="Delete segments and dead namespaces all consumers have read.")
+    compact_parser.add_argument("directory")
+
+    offsets_parser = subparsers.add_parser("offsets", help="Show committed consumer offsets.")
+    offsets_parser.add_argument("directory")
+    args = parser.parse_args()
+
+    if args.command == "compact":
+        print(json.dumps(compact(args.directory), indent=4))
+    elif args.command == "offsets":
+        print(json.dumps(ChangeLogReader(args.directory).load_offsets(), indent=4, sort_keys=True))
+    else:
+        reader = ChangeLogReader(args.directory)
+        positions = reader.get_offset(args.consumer) if args.consumer else {}
+        if args.follow:
+            records = reader.tail(positions)
+        else:
+            records = (record for batch in reader.read_all(positions).values() for record in batch)
+        try:
+            for record in records:
+                sys.stdout.write(json.dumps(record, default=str) + "\n")
+                sys.stdout.flush()
+                if args.commit and args.consumer:
+                    reader.commit_offset(args.consumer, record["writer"], record["seq"])
+        except KeyboardInterrupt:
+            pass
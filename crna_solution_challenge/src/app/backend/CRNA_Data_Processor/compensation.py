@@ -0,0 +1,209 @@
+# CRNA_Data_Processor/compensation.py
+#
+# Compensation model engine for total_estimated_annual_compensation.
+#
+# A model is a named set of assumptions (annual 1099 hours, call days, ...). Each model is compiled
+# once into per-employment-type calculators with the assumptions bound as constants, and each
+# calculator has a single-record form (used by the Pub/Sub function) and a vectorized pandas form
+# (used for batches). evaluate_models() runs several models side by side over one DataFrame so
+# analysts can compare scenarios across the full dataset in one pass.
+#
+# Models are loaded from a JSON file (see compensation_models.example.json):
+#   {"active_model": "baseline", "models": {"baseline": {}, "with_benefits": {"include_cme_allowance": true}}}
+# Every model starts from DEFAULT_ASSUMPTIONS, which reproduce the original hard-coded pipeline
+# numbers, and overrides only the keys it lists.
+#
+# Usage (compare models over backfill output):
+#   python compensation.py --models compensation_models.json --output comparison.csv backfill_out/part-*.jsonl
+import argparse
+import json
+import logging
+import os
+
+import numpy
+import pandas
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL_NAME = "baseline"
+
+DEFAULT_ASSUMPTIONS = {
+    "weeks_per_year_w2": 52,               # guaranteed_hours_w2 is weekly
+    "assumed_annual_hours_1099": 1800,
+    "assumed_call_days_per_year": 60,       # applied to "Per Diem" call stipends
+    "assumed_on_call_hours_per_year": 500,  # applied to "Hourly On Call" call stipends
+    "assumed_overtime_hours_per_year": 0,   # W2 overtime hours paid at hourly_rate_w2 * ot_rate_multiplier
+    "sign_on_bonus_weight": 1.0,            # e.g. 0.25 to amortize a sign-on bonus over 4 years
+    "include_retirement_match": False,      # adds retirement_match_percentage (0-100) of W2 base pay
+    "include_cme_allowance": False,         # adds cme_allowance_annual
+}
+
+# Typed row fields the calculators read (the same names as the BigQuery row).
+NUMERIC_INPUT_FIELDS = (
+    "base_salary_annual", "hourly_rate_w2", "guaranteed_hours_w2", "hourly_rate_1099", "ot_rate_multiplier",
+    "call_stipend_amount", "bonus_potential_annual", "sign_on_bonus", "retirement_match_percentage",
+    "cme_allowance_annual",
+)
+
+
+def _num(row, field):
+    # None/NaN/0 are all "not provided" for compensation purposes, matching the original truthiness checks.
+    value = row.get(field)
+    if value is None or value != value:
+        return 0.0
+    return float(value)
+
+
+# --- Model Compilation ---
+class CompensationModel:
+    def __init__(self, name, assumptions=None):
+        unknown_keys = set(assumptions or {}) - set(DEFAULT_ASSUMPTIONS)
+        if unknown_keys:
+            raise ValueError(f"Compensation model '{name}' has unknown assumption keys: {sorted(unknown_keys)}")
+        self.name = name
+        self.assumptions = {**DEFAULT_ASSUMPTIONS, **(assumptions or {})}
+        self.calculators, self.vector_calculators = self._compile()
+
+    def __repr__(self):
+        return f"CompensationModel({self.name!r}, {self.assumptions!r})"
+
+    def _compile(self):
+        a = self.assumptions
+        weeks_w2 = float(a["weeks_per_year_w2"])
+        hours_1099 = float(a["assumed_annual_hours_1099"])
+        ot_hours = float(a["assumed_overtime_hours_per_year"])
+        include_retirement = bool(a["include_retirement_match"])
+
+        # Base pay per employment type. Anything else (Part-time W2, Other) has no base pay estimate.
+        def w2(row):
+            base = _num(row, "base_salary_annual")
+            hourly = _num(row, "hourly_rate_w2")
+            if not base:
+                hours = _num(row, "guaranteed_hours_w2")
+                base = hourly * hours * weeks_w2 if hourly and hours else 0.0
+            if ot_hours:
+                base += hourly * _num(row, "ot_rate_multiplier") * ot_hours
+            if include_retirement:
+                base += base * _num(row, "retirement_match_percentage") / 100.0
+            return base
+
+        def contractor_1099(row):
+            return _num(row, "hourly_rate_1099") * hours_1099
+
+        def w2_vector(frame):
+            base = frame["base_salary_annual"]
+            hourly = frame["hourly_rate_w2"]
+            from_hours = numpy.where((hourly != 0) & (frame["guaranteed_hours_w2"] != 0), hourly * frame["guaranteed_hours_w2"] * weeks_w2, 0.0)
+            pay = numpy.where(base != 0, base, from_hours)
+            if ot_hours:
+                pay = pay + hourly * frame["ot_rate_multiplier"] * ot_hours
+            if include_retirement:
+                pay = pay + pay * frame["retirement_match_percentage"] / 100.0
+            return pay
+
+        def contractor_1099_vector(frame):
+            return frame["hourly_rate_1099"].to_numpy() * hours_1099
+
+        calculators = {"W2": w2, "1099/Contractor": contractor_1099}
+        vector_calculators = {"W2": w2_vector, "1099/Contractor": contractor_1099_vector}
+        return calculators, vector_calculators
+
+    def _extras(self, row):
+        a = self.assumptions
+        total = _num(row, "bonus_potential_annual") + _num(row, "sign_on_bonus") * a["sign_on_bonus_weight"]
+        stipend = _num(row, "call_stipend_amount")
+        if stipend > 0:
+            if row.get("call_stipend_type") == "Per Diem":
+                total += stipend * a["assumed_call_days_per_year"]
+            elif row.get("call_stipend_type") == "Hourly On Call":
+                total += stipend * a["assumed_on_call_hours_per_year"]
+        if a["include_cme_allowance"]:
+            total += _num(row, "cme_allowance_annual")
+        return total
+
+    def compute(self, row):
+        # Single record: `row` holds typed values (floats/ints/None), e.g. the BigQuery row being built.
+        calculator = self.calculators.get(row.get("employment_type"))
+        total = (calculator(row) if calculator else 0.0) + self._extras(row)
+        return total if total > 0 else None
+
+    def compute_batch(self, frame):
+        # Vectorized over a frame from prepare_frame(); returns a float Series with NaN where compute() returns None.
+        a = self.assumptions
+        total = numpy.zeros(len(frame))
+        employment_type = frame["employment_type"].to_numpy()
+        for type_name, vector_calculator in self.vector_calculators.items():
+            mask = employment_type == type_name
+            if mask.any():
+                total[mask] = vector_calculator(frame[mask])
+
+        total = total + frame["bonus_potential_annual"].to_numpy() + frame["sign_on_bonus"].to_numpy() * a["sign_on_bonus_weight"]
+        stipend = frame["call_stipend_amount"].to_numpy()
+        stipend_type = frame["call_stipend_type"].to_numpy()
+        total = total + numpy.where((stipend > 0) & (stipend_type == "Per Diem"), stipend * a["assumed_call_days_per_year"], 0.0)
+        total = total + numpy.where((stipend > 0) & (stipend_type == "Hourly On Call"), stipend * a["assumed_on_call_hours_per_year"], 0.0)
+        if a["include_cme_allowance"]:
+            total = total + frame["cme_allowance_annual"].to_numpy()
+        return pandas.Series(numpy.where(total > 0, total, numpy.nan), index=frame.index, name=self.name)
+
+
+# --- Batch Helpers ---
+def prepare_frame(rows):
+    # Builds the numeric frame all models share, so the conversion cost is paid once per batch.
+    frame = rows if isinstance(rows, pandas.DataFrame) else pandas.DataFrame.from_records(list(rows))
+    prepared = pandas.DataFrame(index=frame.index)
+    for field in NUMERIC_INPUT_FIELDS:
+        column = frame[field] if field in frame else pandas.Series(numpy.nan, index=frame.index)
+        prepared[field] = pandas.to_numeric(column, errors="coerce").fillna(0.0).astype(float)
+    for field in ("employment_type", "call_stipend_type"):
+        prepared[field] = frame[field].astype(object) if field in frame else None
+    return prepared
+
+def evaluate_models(rows, models):
+    # One column per model, computed side by side over the same prepared frame.
+    prepared = prepare_frame(rows)
+    return pandas.DataFrame({model.name: model.compute_batch(prepared) for model in models}, index=prepared.index)
+
+
+# --- Config Loading ---
+def load_compensation_models(path=None):
+    # Returns (models_by_name, active_model_name). Without a config file only the baseline model exists.
+    if not path:
+        return {DEFAULT_MODEL_NAME: CompensationModel(DEFAULT_MODEL_NAME)}, DEFAULT_MODEL_NAME
+    with open(path, "r") as fh:
+        config = json.load(fh)
+    models = {name: CompensationModel(name, assumptions) for name, assumptions in config.get("models", {}).items()}
+    models.setdefault(DEFAULT_MODEL_NAME, CompensationModel(DEFAULT_MODEL_NAME))
+    active_model_name = config.get("active_model", DEFAULT_MODEL_NAME)
+    if active_model_name not in models:
+        raise ValueError(f"active_model '{active_model_name}' is not defined in {path}")
+    return models, active_model_name
+
+def load_active_model(path=None, model_name=None):
+    models, active_model_name = load_compensation_models(path)
+    model_name = model_name or active_model_name
+    if model_name not in models:
+        raise ValueError(f"Compensation model '{model_name}' not found. Available: {sorted(models)}")
+    return models[model_name]
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Compare compensation models over BigQuery-shaped JSONL rows.")
+    parser.add_argument("inputs", nargs="+", help="JSONL files of rows, e.g. backfill part files.")
+    parser.add_argument("--models", default=os.getenv("COMPENSATION_MODELS_PATH"), help="Model config JSON file.")
+    parser.add_argument("--output", default=None, help="Optional CSV with one column per model.")
+    args = parser.parse_args()
+
+    models, _ = load_compensation_models(args.models)
+    rows = pandas.concat([pandas.read_json(path, lines=True, dtype=False) for path in args.inputs], ignore_index=True)
+    results = evaluate_models(rows, models.values())
+    if "submission_id" in rows:
+        results.insert(0, "submission_id", rows["submission_id"])
+    if "employment_type" in rows:
+        results.insert(1, "employment_type", rows["employment_type"])
+        print(results.groupby("employment_type")[list(models)].median().to_string())
+    print(results[list(models)].describe().to_string())
+    if args.output:
+        results.to_csv(args.output, index=False)
+        logger.info(f"Wrote {len(results)} rows to {args.output}")
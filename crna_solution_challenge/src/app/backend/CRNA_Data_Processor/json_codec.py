@@ -0,0 +1,27 @@
+# CRNA_Data_Processor/json_codec.py
+#
+# Single JSON entry point for the processor, the backfill runner and the change log: orjson when it
+# is installed (optional, see requirements.txt), the stdlib json module otherwise. Both backends
+# write compact UTF-8 with non-ASCII characters left unescaped, so the bytes match for ordinary values
+# (orjson writes NaN/Infinity as null where the stdlib writes NaN), and both accept bytes directly.
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+BACKEND = "orjson" if orjson is not None else "json"
+
+
+def loads(raw):
+    # Parses bytes or str. orjson.JSONDecodeError subclasses json.JSONDecodeError (a ValueError).
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+def dumps_line(obj):
+    # One compact JSON document plus "\n", as bytes. Types neither backend knows are written via str().
+    if orjson is not None:
+        return orjson.dumps(obj, default=str) + b"\n"
+    return (json.dumps(obj, separators=(",", ":"), ensure_ascii=False, default=str) + "\n").encode("utf-8")
@@ -1,15 +1,28 @@
 # CRNA_Data_Processor/main.py
 import base64
+import copy
 import json
 import os
 import logging 
 import re 
+import time
+import zlib
 from datetime import datetime 
 
 from google.cloud import bigquery
 import pgeocode # Make sure this is imported
 import pandas   # Make sure this is imported
 
+import changelog
+import compensation
+import json_codec
+import shadow
+
+try:
+    import msgpack # Optional: needed only to decode msgpack-encoded Pub/Sub messages
+except ImportError:
+    msgpack = None
+
 # --- Logger Setup (ONCE at the top) ---
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO) 
@@ -52,6 +65,40 @@ else:
     TABLE_ID = f"{BQ_PROJECT_ID_FUNC}.{BQ_DATASET_ID_FUNC}.{BQ_TABLE_NAME_FUNC}"
     logger.info(f"Target BigQuery Table ID successfully constructed: {TABLE_ID}")
 
+# --- Compensation Model ---
+# COMPENSATION_MODELS_PATH points at a JSON model config; COMPENSATION_MODEL picks a model from it
+# (defaults to the config's active_model). Without a config the baseline assumptions are used.
+COMPENSATION_MODELS_PATH = os.getenv("COMPENSATION_MODELS_PATH")
+COMPENSATION_MODEL_NAME = os.getenv("COMPENSATION_MODEL")
+try:
+    ACTIVE_COMPENSATION_MODEL = compensation.load_active_model(COMPENSATION_MODELS_PATH, COMPENSATION_MODEL_NAME)
+    logger.info(f"Using compensation model: {ACTIVE_COMPENSATION_MODEL}")
+except Exception as e_comp_init:
+    logger.error(f"Failed to load compensation model from '{COMPENSATION_MODELS_PATH}', falling back to baseline: {e_comp_init}", exc_info=True)
+    ACTIVE_COMPENSATION_MODEL = compensation.CompensationModel(compensation.DEFAULT_MODEL_NAME)
+
+# --- Shadow Mode ---
+# SHADOW_PROCESSOR names a candidate build_row_for_bq to run next to this one (see shadow.py).
+# The candidate only ever sees a copy of the payload and its row is never written.
+shadow_runner = None
+try:
+    shadow_runner = shadow.ShadowRunner.from_env()
+    if shadow_runner is not None:
+        logger.info(f"Shadow mode enabled: candidate '{shadow_runner.candidate_spec}', sample rate {shadow_runner.sample_rate}")
+except Exception as e_shadow_init:
+    logger.error(f"Failed to configure shadow mode, continuing without it: {e_shadow_init}", exc_info=True)
+
+# --- Change Log ---
+# CHANGELOG_DIR enables an append-only change log of inserted rows for incremental consumers. It must be a
+# volume shared by all instances, not the per-instance /tmp; each process writes its own namespace (see changelog.py).
+changelog_writer = None
+try:
+    changelog_writer = changelog.ChangeLogWriter.from_env()
+    if changelog_writer is not None:
+        logger.info(f"Change log enabled in {changelog_writer.writer_dir}, next seq {changelog_writer.last_seq + 1}")
+except Exception as e_changelog_init:
+    logger.error(f"Failed to open change log, continuing without it: {e_changelog_init}", exc_info=True)
+
 # --- Helper functions for type conversion ---
 def get_float_or_none(value, field_name="<unknown>"): # Level 0
     if value is None or str(value).strip() == "": # Level 1
@@ -71,12 +118,84 @@ def get_int_or_none(value, field_name="<unknown>"): # Level 0
         logger.warning(f"Could not convert '{value}' for field '{field_name}' to int, setting to None.") # Level 2
         return None # Level 2
 
+json_loads = json_codec.loads # Parses bytes or str (orjson when installed, see json_codec.py)
+
+# --- Pub/Sub Message Decoding ---
+# Field order per schema version is the wire contract with CRNA_Submission_Run/app.py
+# (tests/test_submission_codec.py fails if the two drift apart).
+CRNA_SUBMISSION_SCHEMAS = {
+    "1": (
+        "submission_id_server", "submission_timestamp_server", "years_experience", "location_zip_code",
+        "employment_type", "work_setting", "primary_state_of_licensure", "base_salary_annual",
+        "hourly_rate_w2", "guaranteed_hours_w2", "hourly_rate_1099", "ot_rate_multiplier",
+        "call_stipend_type", "call_stipend_amount", "bonus_potential_annual", "sign_on_bonus",
+        "retention_bonus_terms", "pto_weeks", "retirement_match_percentage", "cme_allowance_annual",
+        "malpractice_coverage_type", "comments", "data_source",
+    ),
+}
+
+_present_fields_cache = {} # (schema_version, presence_mask) -> tuple of field names
+
+def decode_submission_message(message_bytes, attributes=None):
+    # Decodes a submission published either as JSON (no attributes, the original format) or as a
+    # schema-versioned msgpack record. Raises ValueError (or zlib.error) on undecodable input.
+    attributes = attributes or {}
+    if attributes.get("content_encoding") == "zlib":
+        message_bytes = zlib.decompress(message_bytes)
+    elif attributes.get("content_encoding"):
+        raise ValueError(f"Unsupported content_encoding '{attributes.get('content_encoding')}'")
+
+    content_type = attributes.get("content_type", "application/json")
+    if content_type == "application/json":
+        return json_loads(message_bytes)
+    if content_type != "application/x-msgpack":
+        raise ValueError(f"Unsupported content_type '{content_type}'")
+    if msgpack is None:
+        raise ValueError("Received a msgpack-encoded message but the msgpack package is not installed")
+
+    schema_version = attributes.get("schema_version")
+    schema_fields = CRNA_SUBMISSION_SCHEMAS.get(schema_version)
+    if schema_fields is None:
+        raise ValueError(f"Unknown CRNA submission schema_version '{schema_version}'")
+
+    presence_mask, values, extras = msgpack.unpackb(message_bytes)
+    present_fields = _present_fields_cache.get((schema_version, presence_mask))
+    if present_fields is None:
+        # Submissions come from one form, so only a handful of distinct masks ever show up.
+        present_fields = tuple(field for i, field in enumerate(schema_fields) if presence_mask >> i & 1)
+        if len(_present_fields_cache) < 1024:
+            _present_fields_cache[(schema_version, presence_mask)] = present_fields
+    if len(present_fields) != len(values):
+        raise ValueError(f"msgpack record has {len(values)} values but its presence mask names {len(present_fields)} fields")
+    decoded = dict(zip(present_fields, values))
+    decoded.update(extras)
+    return decoded
+
 # --- Allowed Value Lists --- # Level 0
 ALLOWED_EMPLOYMENT_TYPES = ["W2", "1099/Contractor", "Part-time W2", "Other"]
 ALLOWED_WORK_SETTINGS = ["Hospital - Academic", "Hospital - Community", "ASC", "Office-Based", "VA/Military", "Locums", "Other"]
 ALLOWED_CALL_STIPEND_TYPES = ["Per Diem", "Hourly On Call", "Activation Only", "None", "", None] 
 ALLOWED_MALPRACTICE_TYPES = ["Occurrence", "Claims-Made", "Claims-Made with Tail", "None", "", None] 
 
+# Frozen lookup tables for validation. "" and None mean "not provided" for the optional enums and
+# are handled before the membership test, so they are left out of the sets.
+ALLOWED_EMPLOYMENT_TYPES_SET = frozenset(ALLOWED_EMPLOYMENT_TYPES)
+ALLOWED_WORK_SETTINGS_SET = frozenset(ALLOWED_WORK_SETTINGS)
+ALLOWED_CALL_STIPEND_TYPES_SET = frozenset(val for val in ALLOWED_CALL_STIPEND_TYPES if val)
+ALLOWED_MALPRACTICE_TYPES_SET = frozenset(val for val in ALLOWED_MALPRACTICE_TYPES if val)
+ALLOWED_CALL_STIPEND_TYPES_MESSAGE = str([val for val in ALLOWED_CALL_STIPEND_TYPES if val])
+ALLOWED_MALPRACTICE_TYPES_MESSAGE = str([val for val in ALLOWED_MALPRACTICE_TYPES if val])
+
+SERVER_GENERATED_FIELDS = ('submission_id_server', 'submission_timestamp_server')
+REQUIRED_USER_FIELDS = ('years_experience', 'location_zip_code', 'employment_type', 'work_setting')
+
+ZIP_CODE_PATTERN = re.compile(r"^\d{5}(-\d{4})?$")
+STATE_CODE_PATTERN = re.compile(r"^[A-Z]{2}$")
+
+def is_allowed_value(value, allowed_set): # Level 0
+    # All allowed values are strings; the isinstance check also keeps unhashable JSON values (lists, objects) out of the set lookup.
+    return isinstance(value, str) and value in allowed_set # Level 1
+
 STATE_TO_REGION = { # Level 0
     'AL': 'South', 'AK': 'West', 'AZ': 'West', 'AR': 'South', 'CA': 'West', 
     'CO': 'West', 'CT': 'Northeast', 'DE': 'South', 'FL': 'South', 'GA': 'South', 
@@ -87,8 +206,321 @@ STATE_TO_REGION = { # Level 0
     'NM': 'West', 'NY': 'Northeast', 'NC': 'South', 'ND': 'Midwest', 'OH': 'Midwest', 
     'OK': 'South', 'OR': 'West', 'PA': 'Northeast', 'RI': 'Northeast', 'SC': 'South', 
     'SD': 'Midwest', 'TN': 'South', 'TX': 'South', 'UT': 'West', 'VT': 'Northeast', 
-    'VA': 'South', 'WA': 'West', 'WV': 'South', 'WI': 'Midwest', 'WY': 'West'
+    'VA': 'South', 'WA': 'West', 'WV': 'South', 'WI': 'Midwest', 'WY': 'West',
+    'DC': 'South' # Census Bureau region; DC issues its own CRNA licenses
 }
+VALID_STATE_CODES = frozenset(STATE_TO_REGION) # primary_state_of_licensure must be one of these
+
+BQ_ACTUAL_COLUMN_NAMES = [
+    "submission_id", "submission_timestamp", "years_experience", "location_zip_code",
+    "derived_location_state", "derived_location_city", "derived_location_county", "location_region",
+    "location_latitude", "location_longitude",
+    "experience_bucket", "total_estimated_annual_compensation", 
+    "employment_type", "work_setting", "primary_state_of_licensure", "base_salary_annual", 
+    "hourly_rate_w2", "guaranteed_hours_w2", "hourly_rate_1099", "ot_rate_multiplier", 
+    "call_stipend_type", "call_stipend_amount", "bonus_potential_annual", "sign_on_bonus", 
+    "retention_bonus_terms", "pto_weeks", "retirement_match_percentage", "cme_allowance_annual", 
+    "malpractice_coverage_type", "comments", "data_source", "is_validated", "anomaly_score"
+]
+
+# --- Optional Columns ---
+# The ZIP centroid columns only exist once schema/add_location_centroid_columns.sql has been applied;
+# insert_rows_json rejects rows carrying unknown columns. BQ_LOCATION_COLUMNS controls them:
+# "auto" (default) checks the table schema at cold start, "true"/"false" skips the check.
+LOCATION_CENTROID_COLUMNS = ("location_latitude", "location_longitude")
+BQ_LOCATION_COLUMNS_MODE = os.getenv("BQ_LOCATION_COLUMNS", "auto").lower()
+
+def table_has_columns(table_id, column_names): # Level 0
+    # False when the table can't be inspected, so a missing migration never drops submissions.
+    if bq_client is None or not table_id: # Level 1
+        return False # Level 2
+    try: # Level 1
+        existing_columns = {field.name for field in bq_client.get_table(table_id).schema} # Level 2
+    except Exception as e: # Level 1
+        logger.error(f"Could not read the schema of {table_id}: {e}", exc_info=True) # Level 2
+        return False # Level 2
+    return all(name in existing_columns for name in column_names) # Level 1
+
+if BQ_LOCATION_COLUMNS_MODE == "true":
+    write_location_columns = True
+elif BQ_LOCATION_COLUMNS_MODE == "false":
+    write_location_columns = False
+else:
+    write_location_columns = table_has_columns(TABLE_ID, LOCATION_CENTROID_COLUMNS)
+if not write_location_columns:
+    BQ_ACTUAL_COLUMN_NAMES = [col for col in BQ_ACTUAL_COLUMN_NAMES if col not in LOCATION_CENTROID_COLUMNS]
+    logger.warning(f"Not writing {LOCATION_CENTROID_COLUMNS} (BQ_LOCATION_COLUMNS={BQ_LOCATION_COLUMNS_MODE}); apply schema/add_location_centroid_columns.sql to enable them.")
+
+# --- Validation ---
+# Returns (validated_fields, validation_errors). validated_fields holds the normalized values the
+# enrichment step needs; it is only meaningful when validation_errors is empty.
+def validate_submission(submission): # Level 0
+    validation_errors = [] # Level 1
+
+    # --- Required Fields --- # Level 1
+    for field in SERVER_GENERATED_FIELDS: # Level 1
+        if field not in submission or submission.get(field) is None or str(submission.get(field, "")).strip() == "": # Level 2
+            validation_errors.append(f"Missing critical server-generated field: {field}.") # Level 3
+    
+    for field in REQUIRED_USER_FIELDS: # Level 1
+        val = submission.get(field) # Level 2
+        if val is None or str(val).strip() == "": # Level 2
+            validation_errors.append(f"Missing or empty required user field: {field}.") # Level 3
+    
+    years_experience = None # Level 1
+    years_experience_from_data = submission.get('years_experience') # Level 1
+    if years_experience_from_data is not None and str(years_experience_from_data).strip() != "": # Level 1
+        try: # Level 2
+            years_experience_val_int = int(years_experience_from_data) # Level 3
+            if not (0 <= years_experience_val_int <= 60): # Level 3
+                validation_errors.append(f"years_experience ({years_experience_val_int}) out of range (0-60).") # Level 4
+            else: # Level 3
+                years_experience = years_experience_val_int # Level 4
+        except (ValueError, TypeError): # Level 2
+            validation_errors.append(f"years_experience ('{years_experience_from_data}') must be a valid integer.") # Level 3
+    elif 'years_experience' in REQUIRED_USER_FIELDS: # Level 1
+         validation_errors.append("years_experience is required and cannot be empty.") # Level 2
+
+    location_zip_code_from_data = str(submission.get('location_zip_code', "")) # Level 1
+    if not ZIP_CODE_PATTERN.match(location_zip_code_from_data): # Level 1
+        validation_errors.append(f"location_zip_code ('{location_zip_code_from_data}') has an invalid format.") # Level 2
+
+    employment_type_from_data = submission.get('employment_type') # Level 1
+    if not is_allowed_value(employment_type_from_data, ALLOWED_EMPLOYMENT_TYPES_SET): # Level 1
+        validation_errors.append(f"employment_type ('{employment_type_from_data}') is not a valid option.") # Level 2
+    
+    work_setting_from_data = submission.get('work_setting') # Level 1
+    if not is_allowed_value(work_setting_from_data, ALLOWED_WORK_SETTINGS_SET): # Level 1
+        validation_errors.append(f"work_setting ('{work_setting_from_data}') is not a valid option.") # Level 2
+
+    primary_state_of_licensure_raw = submission.get('primary_state_of_licensure') # Level 1
+    primary_state_of_licensure_validated = None # Level 1
+    if primary_state_of_licensure_raw and str(primary_state_of_licensure_raw).strip() != "": # Level 1
+        processed_state_val = str(primary_state_of_licensure_raw).upper().strip() # Level 2
+        if not STATE_CODE_PATTERN.match(processed_state_val): # Level 2
+            validation_errors.append(f"primary_state_of_licensure ('{primary_state_of_licensure_raw}') if provided, must be a 2-letter state code.") # Level 3
+        elif processed_state_val not in VALID_STATE_CODES: # Level 2
+            validation_errors.append(f"primary_state_of_licensure ('{primary_state_of_licensure_raw}') is not a recognized US state code.") # Level 3
+        else: # Level 2
+            primary_state_of_licensure_validated = processed_state_val # Level 3
+    
+    # --- Numeric Range Validations --- # Level 1
+    base_salary_annual_val = submission.get('base_salary_annual') # Level 1
+    if base_salary_annual_val is not None and str(base_salary_annual_val).strip() != "": # Level 1
+        try: # Level 2
+            bsa = float(base_salary_annual_val) # Level 3
+            if not (0 <= bsa <= 2000000): # Level 3
+                validation_errors.append(f"base_salary_annual ({bsa}) is out of a reasonable range (0-2,000,000).") # Level 4
+        except (ValueError, TypeError): # Level 2
+            validation_errors.append(f"base_salary_annual ('{base_salary_annual_val}') is not a valid number.") # Level 3
+    
+    pto_weeks_val = submission.get('pto_weeks') # Level 1
+    if pto_weeks_val is not None and str(pto_weeks_val).strip() != "": # Level 1
+        try: # Level 2
+            ptow = int(pto_weeks_val) # Level 3
+            if not (0 <= ptow <= 52): # Level 3
+                validation_errors.append(f"pto_weeks ({ptow}) is out of a reasonable range (0-52).") # Level 4
+        except (ValueError, TypeError): # Level 2
+            validation_errors.append(f"pto_weeks ('{pto_weeks_val}') is not a valid integer.") # Level 3
+
+    # --- Enum Validations for Optional Fields --- # Level 1
+    call_stipend_type_from_data_raw = submission.get('call_stipend_type') # Level 1
+    call_stipend_type_validated = None # Level 1
+    if call_stipend_type_from_data_raw is not None and str(call_stipend_type_from_data_raw).strip() != "": # Level 1
+        if not is_allowed_value(call_stipend_type_from_data_raw, ALLOWED_CALL_STIPEND_TYPES_SET): # Level 2
+            validation_errors.append(f"call_stipend_type ('{call_stipend_type_from_data_raw}') is not valid. Allowed: {ALLOWED_CALL_STIPEND_TYPES_MESSAGE}") # Level 3
+        else: # Level 2
+            call_stipend_type_validated = call_stipend_type_from_data_raw # Level 3
+    
+    malpractice_coverage_type_from_data_raw = submission.get('malpractice_coverage_type') # Level 1
+    malpractice_coverage_type_validated = None # Level 1
+    if malpractice_coverage_type_from_data_raw is not None and str(malpractice_coverage_type_from_data_raw).strip() != "": # Level 1
+        if not is_allowed_value(malpractice_coverage_type_from_data_raw, ALLOWED_MALPRACTICE_TYPES_SET): # Level 2
+            validation_errors.append(f"malpractice_coverage_type ('{malpractice_coverage_type_from_data_raw}') is not valid. Allowed: {ALLOWED_MALPRACTICE_TYPES_MESSAGE}") # Level 3
+        else: # Level 2
+            malpractice_coverage_type_validated = malpractice_coverage_type_from_data_raw # Level 3
+
+    # --- Conditional Validation --- # Level 1
+    if employment_type_from_data == "W2": # Level 1
+        has_salary = submission.get('base_salary_annual') is not None and str(submission.get('base_salary_annual')).strip() != "" # Level 2
+        has_hourly_components = (submission.get('hourly_rate_w2') is not None and str(submission.get('hourly_rate_w2')).strip() != "" and # Level 2
+                                 submission.get('guaranteed_hours_w2') is not None and str(submission.get('guaranteed_hours_w2')).strip() != "") # Level 2
+        if not (has_salary or has_hourly_components): # Level 2
+            validation_errors.append("For W2 employment, please provide Annual Base Salary OR both W2 Hourly Rate and Guaranteed Hours.") # Level 3
+
+    if call_stipend_type_validated and call_stipend_type_validated != "None": # Level 1
+        if submission.get('call_stipend_amount') is None or str(submission.get('call_stipend_amount')).strip() == "": # Level 2
+            validation_errors.append(f"call_stipend_amount is required when call_stipend_type is '{call_stipend_type_validated}'.") # Level 3
+    
+    validated_fields = { # Level 1
+        "years_experience": years_experience, # Level 2
+        "location_zip_code": location_zip_code_from_data, # Level 2
+        "employment_type": employment_type_from_data, # Level 2
+        "work_setting": work_setting_from_data, # Level 2
+        "primary_state_of_licensure": primary_state_of_licensure_validated, # Level 2
+        "call_stipend_type": call_stipend_type_validated, # Level 2
+        "malpractice_coverage_type": malpractice_coverage_type_validated, # Level 2
+    } # Level 1
+    return validated_fields, validation_errors # Level 1
+
+# --- Validation & Enrichment ---
+# Returns (final_row_for_bq, validation_errors). The row is None when validation fails.
+# Pure with respect to BigQuery: the Pub/Sub entry point and the backfill runner both call it.
+# When a stage_timings dict is passed, seconds spent per stage are stored under
+# "validate", "enrich" and "compose" (shadow mode compares these across implementations).
+def build_row_for_bq(data_from_pubsub, stage_timings=None): # Level 0
+    stage_started = time.perf_counter() # Level 1
+    # --- 1. Detailed Validation --- # Level 1
+    validated_fields, validation_errors = validate_submission(data_from_pubsub) # Level 1
+    if stage_timings is not None: # Level 1
+        stage_timings["validate"] = time.perf_counter() - stage_started # Level 2
+        stage_started = time.perf_counter() # Level 2
+    if validation_errors: # Level 1
+        return None, validation_errors # Level 2
+
+    enriched_data = data_from_pubsub.copy() # Level 1
+    years_experience = validated_fields["years_experience"] # Level 1
+    location_zip_code_from_data = validated_fields["location_zip_code"] # Level 1
+    employment_type_from_data = validated_fields["employment_type"] # Level 1
+    work_setting_from_data = validated_fields["work_setting"] # Level 1
+    primary_state_of_licensure_validated = validated_fields["primary_state_of_licensure"] # Level 1
+    call_stipend_type_validated = validated_fields["call_stipend_type"] # Level 1
+    malpractice_coverage_type_validated = validated_fields["malpractice_coverage_type"] # Level 1
+
+    logger.info(f"Validation successful for submission_id_server: {enriched_data.get('submission_id_server')}") # Level 1
+    
+    # --- 2. Data Enrichment --- # Level 1
+    logger.info(f"Starting data enrichment for submission_id_server: {enriched_data.get('submission_id_server')}") # Level 1
+    
+    # A. Derive State, City, County from ZIP # Level 1
+    enriched_data['derived_location_state'] = None # Level 1
+    enriched_data['derived_location_city'] = None # Level 1
+    enriched_data['derived_location_county'] = None # Level 1
+    enriched_data['location_latitude'] = None # Level 1 - ZIP centroid, feeds the local-market spatial index
+    enriched_data['location_longitude'] = None # Level 1
+
+    current_location_zip_code = str(enriched_data.get('location_zip_code', "")) # Level 1
+
+    if geo_nomi and current_location_zip_code: # Level 1
+        logger.info(f"Attempting geocoding for ZIP: '{current_location_zip_code}'") # Level 2
+        try: # Level 2
+            zip_info = geo_nomi.query_postal_code(current_location_zip_code) # Level 3
+            logger.info(f"Pgeocode query_postal_code raw result for '{current_location_zip_code}':\n{zip_info.to_string() if isinstance(zip_info, pandas.Series) else zip_info}") # Level 3
+            logger.info(f"Type of zip_info: {type(zip_info)}") # Level 3
+            
+            if isinstance(zip_info, pandas.Series) and not zip_info.empty: # Level 3
+                logger.info(f"zip_info Series index (keys): {zip_info.index.tolist()}") # Level 4
+                
+                if 'state_code' in zip_info and not pandas.isna(zip_info['state_code']): # Level 4
+                    enriched_data['derived_location_state'] = zip_info['state_code'] # Level 5
+                else: # Level 4
+                    logger.warning(f"Field 'state_code' missing or NaN in Series for ZIP: {current_location_zip_code}.") # Level 5
+
+                if 'place_name' in zip_info and not pandas.isna(zip_info['place_name']): # Level 4
+                    enriched_data['derived_location_city'] = zip_info['place_name'] # Level 5
+                else: # Level 4
+                    logger.warning(f"Field 'place_name' missing or NaN in Series for ZIP: {current_location_zip_code}.") # Level 5
+
+                if 'county_name' in zip_info and not pandas.isna(zip_info['county_name']): # Level 4
+                    enriched_data['derived_location_county'] = zip_info['county_name'] # Level 5
+                else: # Level 4
+                    logger.warning(f"Field 'county_name' missing or NaN in Series for ZIP: {current_location_zip_code}.") # Level 5
+
+                if 'latitude' in zip_info and 'longitude' in zip_info and not pandas.isna(zip_info['latitude']) and not pandas.isna(zip_info['longitude']): # Level 4
+                    enriched_data['location_latitude'] = float(zip_info['latitude']) # Level 5
+                    enriched_data['location_longitude'] = float(zip_info['longitude']) # Level 5
+                else: # Level 4
+                    logger.warning(f"Fields 'latitude'/'longitude' missing or NaN in Series for ZIP: {current_location_zip_code}.") # Level 5
+                
+                logger.info(f"Geocoded ZIP {current_location_zip_code}: State={enriched_data['derived_location_state']}, City={enriched_data['derived_location_city']}, County={enriched_data['derived_location_county']}, Lat/Lon=({enriched_data['location_latitude']}, {enriched_data['location_longitude']})") # Level 4
+            else: # Level 3 
+                logger.warning(f"Pgeocode returned an empty or non-Series result for ZIP: {current_location_zip_code}. Result: {zip_info}") # Level 4
+        except Exception as e_geo: # Level 2
+            logger.error(f"Error during geocoding execution for ZIP {current_location_zip_code}: {e_geo}", exc_info=True) # Level 3
+    elif not geo_nomi: # Level 1
+        logger.warning(f"Pgeocode client (geo_nomi) not initialized, skipping geocoding for ZIP: {current_location_zip_code}") # Level 2
+    else: # Level 1
+         logger.info(f"No valid location_zip_code ('{current_location_zip_code}') provided to geocode, skipping.") # Level 2
+
+
+    # B. Create Experience Bucket # Level 1
+    if years_experience is not None: # Level 1
+        if years_experience <= 2: enriched_data["experience_bucket"] = "0-2 yrs" # Level 2
+        elif years_experience <= 5: enriched_data["experience_bucket"] = "3-5 yrs" # Level 2
+        elif years_experience <= 10: enriched_data["experience_bucket"] = "6-10 yrs" # Level 2
+        elif years_experience <= 15: enriched_data["experience_bucket"] = "11-15 yrs" # Level 2
+        else: enriched_data["experience_bucket"] = ">15 yrs" # Level 2
+        logger.info(f"Derived experience_bucket: {enriched_data.get('experience_bucket')}") # Level 2
+    else: # Level 1
+        enriched_data["experience_bucket"] = None # Level 2
+
+    # C. Total Estimated Annual Compensation is computed by the active compensation model # Level 1
+    #    from the typed row below (see compensation.py), so the inputs are parsed only once. # Level 1
+
+    # D. Derive Region from State # Level 1
+    current_derived_state_for_region = enriched_data.get('derived_location_state') # Level 1
+    if current_derived_state_for_region and current_derived_state_for_region in STATE_TO_REGION: # Level 1
+        enriched_data['location_region'] = STATE_TO_REGION[current_derived_state_for_region] # Level 2
+        logger.info(f"Derived location_region: {enriched_data.get('location_region')}") # Level 2
+    else: # Level 1
+        enriched_data['location_region'] = None # Level 2
+
+    if stage_timings is not None: # Level 1
+        stage_timings["enrich"] = time.perf_counter() - stage_started # Level 2
+        stage_started = time.perf_counter() # Level 2
+
+    # --- 3. Prepare Final Row for BigQuery --- # Level 1
+    row_to_insert = { # Level 1
+        "submission_id": enriched_data.get("submission_id_server"), # Level 2
+        "submission_timestamp": enriched_data.get("submission_timestamp_server"), # Level 2
+        "years_experience": years_experience, # Level 2
+        "location_zip_code": location_zip_code_from_data, # Level 2
+        "derived_location_state": enriched_data.get("derived_location_state"), # Level 2
+        "derived_location_city": enriched_data.get("derived_location_city"), # Level 2
+        "derived_location_county": enriched_data.get("derived_location_county"), # Level 2
+        "location_latitude": enriched_data.get("location_latitude"), # Level 2
+        "location_longitude": enriched_data.get("location_longitude"), # Level 2
+        "location_region": enriched_data.get("location_region"), # Level 2
+        "experience_bucket": enriched_data.get("experience_bucket"), # Level 2
+        "total_estimated_annual_compensation": None, # Level 2 - filled in below from the typed values
+        "employment_type": employment_type_from_data, # Level 2
+        "work_setting": work_setting_from_data, # Level 2
+        "primary_state_of_licensure": primary_state_of_licensure_validated, # Level 2
+        "base_salary_annual": get_float_or_none(enriched_data.get('base_salary_annual'), 'base_salary_annual'), # Level 2
+        "hourly_rate_w2": get_float_or_none(enriched_data.get('hourly_rate_w2'), 'hourly_rate_w2'), # Level 2
+        "guaranteed_hours_w2": get_int_or_none(enriched_data.get('guaranteed_hours_w2'), 'guaranteed_hours_w2'), # Level 2
+        "hourly_rate_1099": get_float_or_none(enriched_data.get('hourly_rate_1099'), 'hourly_rate_1099'), # Level 2
+        "ot_rate_multiplier" : get_float_or_none(enriched_data.get('ot_rate_multiplier'), 'ot_rate_multiplier'), # Level 2
+        "call_stipend_type": call_stipend_type_validated, # Level 2
+        "call_stipend_amount": get_float_or_none(enriched_data.get('call_stipend_amount'), 'call_stipend_amount'), # Level 2
+        "bonus_potential_annual": get_float_or_none(enriched_data.get('bonus_potential_annual'), 'bonus_potential_annual'), # Level 2
+        "sign_on_bonus": get_float_or_none(enriched_data.get('sign_on_bonus'), 'sign_on_bonus'), # Level 2
+        "retention_bonus_terms": enriched_data.get('retention_bonus_terms'), # Level 2
+        "pto_weeks": get_int_or_none(enriched_data.get('pto_weeks'), 'pto_weeks'), # Level 2
+        "retirement_match_percentage": get_float_or_none(enriched_data.get('retirement_match_percentage'), 'retirement_match_percentage'), # Level 2
+        "cme_allowance_annual": get_float_or_none(enriched_data.get('cme_allowance_annual'), 'cme_allowance_annual'), # Level 2
+        "malpractice_coverage_type": malpractice_coverage_type_validated, # Level 2
+        "comments": enriched_data.get('comments'), # Level 2
+        "data_source": enriched_data.get("data_source", "user_submission_pubsub"), # Level 2
+        "is_validated": False, # Level 2
+        "anomaly_score": None # Level 2
+    }
+    row_to_insert["total_estimated_annual_compensation"] = ACTIVE_COMPENSATION_MODEL.compute(row_to_insert) # Level 1
+    logger.info(f"Derived total_estimated_annual_compensation ({ACTIVE_COMPENSATION_MODEL.name}): {row_to_insert['total_estimated_annual_compensation']}") # Level 1
+    
+    final_row_for_bq = {k: v for k, v in row_to_insert.items() if k in BQ_ACTUAL_COLUMN_NAMES} # Level 1
+
+    # Critical Log: Print the exact row being sent
+    logger.info(f"Final row data being sent to BigQuery: {final_row_for_bq}") # Level 1
+    missing_bq_cols = [col for col in BQ_ACTUAL_COLUMN_NAMES if col not in final_row_for_bq] # Level 1
+    if missing_bq_cols: # Level 1
+        logger.error(f"CRITICAL: The following BQ columns are missing from the final row to be inserted: {missing_bq_cols}") # Level 2
+        # This might indicate typos in row_to_insert keys or BQ_ACTUAL_COLUMN_NAMES
+
+    if stage_timings is not None: # Level 1
+        stage_timings["compose"] = time.perf_counter() - stage_started # Level 2
+    return final_row_for_bq, [] # Level 1
+
 
 # --- Entry point function ---
 def process_crna_submission_event(event, context): # Level 0
@@ -121,275 +553,37 @@ def process_crna_submission_event(event, context): # Level 0
             logger.error("Malformed Pub/Sub event: No 'data' field found.") # Level 3
             return # Level 3
         
-        pubsub_message_data_str = None # Level 2
+        pubsub_message_data_bytes = None # Level 2
         try: # Level 2
-            pubsub_message_data_str = base64.b64decode(event['data']).decode('utf-8') # Level 3
+            pubsub_message_data_bytes = base64.b64decode(event['data']) # Level 3
         except Exception as e: # Level 2
             logger.error(f"Failed to decode base64 data from Pub/Sub message: {e}", exc_info=True) # Level 3
             return # Level 3
         
         data_from_pubsub = None # Level 2
+        message_attributes = event.get('attributes') or {} # Level 2
         try: # Level 2
-            data_from_pubsub = json.loads(pubsub_message_data_str) # Level 3
-            logger.info(f"Starting detailed validation for submission_id_server: {data_from_pubsub.get('submission_id_server')}") # Level 3
-        except json.JSONDecodeError as e: # Level 2
-            logger.error(f"Error decoding JSON from Pub/Sub message string: {e}. String was: {pubsub_message_data_str}") # Level 3
+            data_from_pubsub = decode_submission_message(pubsub_message_data_bytes, message_attributes) # Level 3 - parsed from bytes, no intermediate str
+        except (ValueError, TypeError, zlib.error) as e: # Level 2 - JSONDecodeError and msgpack errors are ValueErrors
+            logger.error(f"Error decoding Pub/Sub message (attributes: {message_attributes}): {e}. Bytes were: {pubsub_message_data_bytes[:500]!r}") # Level 3
             return # Level 3
+        if not isinstance(data_from_pubsub, dict): # Level 2
+            logger.error(f"Decoded Pub/Sub message is not an object (got {type(data_from_pubsub).__name__}), skipping.") # Level 3
+            return # Level 3
+        logger.info(f"Starting detailed validation for submission_id_server: {data_from_pubsub.get('submission_id_server')}") # Level 2
 
-        validation_errors = [] # Level 2
-        enriched_data = data_from_pubsub.copy() # Level 2
-
-        # --- 1. Detailed Validation (operates on 'enriched_data') --- # Level 2
-        server_generated_fields = ['submission_id_server', 'submission_timestamp_server'] # Level 2
-        for field in server_generated_fields: # Level 2
-            if field not in enriched_data or enriched_data.get(field) is None or str(enriched_data.get(field, "")).strip() == "": # Level 3
-                validation_errors.append(f"Missing critical server-generated field: {field}.") # Level 4
-        
-        required_user_fields = ['years_experience', 'location_zip_code', 'employment_type', 'work_setting'] # Level 2
-        for field in required_user_fields: # Level 2
-            val = enriched_data.get(field) # Level 3
-            if val is None or str(val).strip() == "": # Level 3
-                validation_errors.append(f"Missing or empty required user field: {field}.") # Level 4
-        
-        years_experience = None # Level 2
-        years_experience_from_data = enriched_data.get('years_experience') # Level 2
-        if years_experience_from_data is not None and str(years_experience_from_data).strip() != "": # Level 2
-            try: # Level 3
-                years_experience_val_int = int(years_experience_from_data) # Level 4
-                if not (0 <= years_experience_val_int <= 60): # Level 4
-                    validation_errors.append(f"years_experience ({years_experience_val_int}) out of range (0-60).") # Level 5
-                else: # Level 4
-                    years_experience = years_experience_val_int # Level 5
-            except (ValueError, TypeError): # Level 3
-                validation_errors.append(f"years_experience ('{years_experience_from_data}') must be a valid integer.") # Level 4
-        elif 'years_experience' in required_user_fields: # Level 2
-             validation_errors.append("years_experience is required and cannot be empty.") # Level 3
-
-        location_zip_code_from_data = str(enriched_data.get('location_zip_code', "")) # Level 2
-        if not re.match(r"^\d{5}(-\d{4})?$", location_zip_code_from_data): # Level 2
-            validation_errors.append(f"location_zip_code ('{location_zip_code_from_data}') has an invalid format.") # Level 3
-
-        employment_type_from_data = enriched_data.get('employment_type') # Level 2
-        if employment_type_from_data not in ALLOWED_EMPLOYMENT_TYPES: # Level 2
-            validation_errors.append(f"employment_type ('{employment_type_from_data}') is not a valid option.") # Level 3
-        
-        work_setting_from_data = enriched_data.get('work_setting') # Level 2
-        if work_setting_from_data not in ALLOWED_WORK_SETTINGS: # Level 2
-            validation_errors.append(f"work_setting ('{work_setting_from_data}') is not a valid option.") # Level 3
-
-        primary_state_of_licensure_raw = enriched_data.get('primary_state_of_licensure') # Level 2
-        primary_state_of_licensure_validated = None # Level 2
-        if primary_state_of_licensure_raw and str(primary_state_of_licensure_raw).strip() != "": # Level 2
-            processed_state_val = str(primary_state_of_licensure_raw).upper().strip() # Level 3
-            if re.match(r"^[A-Z]{2}$", processed_state_val): # Level 3
-                primary_state_of_licensure_validated = processed_state_val # Level 4
-            else: # Level 3
-                validation_errors.append(f"primary_state_of_licensure ('{primary_state_of_licensure_raw}') if provided, must be a 2-letter state code.") # Level 4
-        
-        # --- Numeric Range Validations --- # Level 2
-        base_salary_annual_val = enriched_data.get('base_salary_annual') # Level 2
-        if base_salary_annual_val is not None and str(base_salary_annual_val).strip() != "": # Level 2
-            try: # Level 3
-                bsa = float(base_salary_annual_val) # Level 4
-                if not (0 <= bsa <= 2000000): # Level 4
-                    validation_errors.append(f"base_salary_annual ({bsa}) is out of a reasonable range (0-2,000,000).") # Level 5
-            except (ValueError, TypeError): # Level 3
-                validation_errors.append(f"base_salary_annual ('{base_salary_annual_val}') is not a valid number.") # Level 4
-        
-        pto_weeks_val = enriched_data.get('pto_weeks') # Level 2
-        if pto_weeks_val is not None and str(pto_weeks_val).strip() != "": # Level 2
-            try: # Level 3
-                ptow = int(pto_weeks_val) # Level 4
-                if not (0 <= ptow <= 52): # Level 4
-                    validation_errors.append(f"pto_weeks ({ptow}) is out of a reasonable range (0-52).") # Level 5
-            except (ValueError, TypeError): # Level 3
-                validation_errors.append(f"pto_weeks ('{pto_weeks_val}') is not a valid integer.") # Level 4
-
-        # --- Enum Validations for Optional Fields --- # Level 2
-        call_stipend_type_from_data_raw = enriched_data.get('call_stipend_type') # Level 2
-        call_stipend_type_validated = None # Level 2
-        if call_stipend_type_from_data_raw is not None and str(call_stipend_type_from_data_raw).strip() != "": # Level 2
-            if call_stipend_type_from_data_raw not in [val for val in ALLOWED_CALL_STIPEND_TYPES if val is not None and val != ""]: # Level 3
-                validation_errors.append(f"call_stipend_type ('{call_stipend_type_from_data_raw}') is not valid. Allowed: {[val for val in ALLOWED_CALL_STIPEND_TYPES if val]}") # Level 4
-            else: # Level 3
-                call_stipend_type_validated = call_stipend_type_from_data_raw if call_stipend_type_from_data_raw and str(call_stipend_type_from_data_raw).strip() != "" else None # Level 4
-        
-        malpractice_coverage_type_from_data_raw = enriched_data.get('malpractice_coverage_type') # Level 2
-        malpractice_coverage_type_validated = None # Level 2
-        if malpractice_coverage_type_from_data_raw is not None and str(malpractice_coverage_type_from_data_raw).strip() != "": # Level 2
-            if malpractice_coverage_type_from_data_raw not in [val for val in ALLOWED_MALPRACTICE_TYPES if val is not None and val != ""]: # Level 3
-                validation_errors.append(f"malpractice_coverage_type ('{malpractice_coverage_type_from_data_raw}') is not valid. Allowed: {[val for val in ALLOWED_MALPRACTICE_TYPES if val]}") # Level 4
-            else: # Level 3
-                malpractice_coverage_type_validated = malpractice_coverage_type_from_data_raw if malpractice_coverage_type_from_data_raw and str(malpractice_coverage_type_from_data_raw).strip() != "" else None # Level 4
-
-        # --- Conditional Validation --- # Level 2
-        if employment_type_from_data == "W2": # Level 2
-            has_salary = enriched_data.get('base_salary_annual') is not None and str(enriched_data.get('base_salary_annual')).strip() != "" # Level 3
-            has_hourly_components = (enriched_data.get('hourly_rate_w2') is not None and str(enriched_data.get('hourly_rate_w2')).strip() != "" and # Level 3
-                                     enriched_data.get('guaranteed_hours_w2') is not None and str(enriched_data.get('guaranteed_hours_w2')).strip() != "") # Level 3
-            if not (has_salary or has_hourly_components): # Level 3
-                validation_errors.append("For W2 employment, please provide Annual Base Salary OR both W2 Hourly Rate and Guaranteed Hours.") # Level 4
-
-        if call_stipend_type_validated and call_stipend_type_validated != "None": # Level 2
-            if enriched_data.get('call_stipend_amount') is None or str(enriched_data.get('call_stipend_amount')).strip() == "": # Level 3
-                validation_errors.append(f"call_stipend_amount is required when call_stipend_type is '{call_stipend_type_validated}'.") # Level 4
-        
-        # --- Final Check for Validation Errors --- # Level 2
+        shadow_payload = None # Level 2
+        if shadow_runner is not None and shadow_runner.should_sample(): # Level 2
+            shadow_payload = copy.deepcopy(data_from_pubsub) # Level 3 - copied before the primary run can touch it
+        final_row_for_bq, validation_errors = build_row_for_bq(data_from_pubsub) # Level 2
         if validation_errors: # Level 2
-            error_message_summary = f"Validation failed for submission_id_server {enriched_data.get('submission_id_server')}: {'; '.join(validation_errors)}" # Level 3
+            error_message_summary = f"Validation failed for submission_id_server {data_from_pubsub.get('submission_id_server')}: {'; '.join(validation_errors)}" # Level 3
             logger.error(error_message_summary) # Level 3
-            logger.error(f"Invalid data payload: {enriched_data}") # Level 3
+            logger.error(f"Invalid data payload: {data_from_pubsub}") # Level 3
+            if shadow_payload is not None: # Level 3
+                shadow_runner.compare(shadow_payload, final_row_for_bq, validation_errors, build_row_for_bq) # Level 4
             return # Level 3
 
-        logger.info(f"Validation successful for submission_id_server: {enriched_data.get('submission_id_server')}") # Level 2
-        
-        # --- 2. Data Enrichment --- # Level 2
-        logger.info(f"Starting data enrichment for submission_id_server: {enriched_data.get('submission_id_server')}") # Level 2
-        
-        # A. Derive State, City, County from ZIP # Level 2
-        enriched_data['derived_location_state'] = None # Level 2
-        enriched_data['derived_location_city'] = None # Level 2
-        enriched_data['derived_location_county'] = None # Level 2
-    
-        current_location_zip_code = str(enriched_data.get('location_zip_code', "")) # Level 2
-
-        if geo_nomi and current_location_zip_code: # Level 2
-            logger.info(f"Attempting geocoding for ZIP: '{current_location_zip_code}'") # Level 3
-            try: # Level 3
-                zip_info = geo_nomi.query_postal_code(current_location_zip_code) # Level 4
-                logger.info(f"Pgeocode query_postal_code raw result for '{current_location_zip_code}':\n{zip_info.to_string() if isinstance(zip_info, pandas.Series) else zip_info}") # Level 4
-                logger.info(f"Type of zip_info: {type(zip_info)}") # Level 4
-                
-                if isinstance(zip_info, pandas.Series) and not zip_info.empty: # Level 4
-                    logger.info(f"zip_info Series index (keys): {zip_info.index.tolist()}") # Level 5
-                    
-                    if 'state_code' in zip_info and not pandas.isna(zip_info['state_code']): # Level 5
-                        enriched_data['derived_location_state'] = zip_info['state_code'] # Level 6
-                    else: # Level 5
-                        logger.warning(f"Field 'state_code' missing or NaN in Series for ZIP: {current_location_zip_code}.") # Level 6
-
-                    if 'place_name' in zip_info and not pandas.isna(zip_info['place_name']): # Level 5
-                        enriched_data['derived_location_city'] = zip_info['place_name'] # Level 6
-                    else: # Level 5
-                        logger.warning(f"Field 'place_name' missing or NaN in Series for ZIP: {current_location_zip_code}.") # Level 6
-
-                    if 'county_name' in zip_info and not pandas.isna(zip_info['county_name']): # Level 5
-                        enriched_data['derived_location_county'] = zip_info['county_name'] # Level 6
-                    else: # Level 5
-                        logger.warning(f"Field 'county_name' missing or NaN in Series for ZIP: {current_location_zip_code}.") # Level 6
-                    
-                    logger.info(f"Geocoded ZIP {current_location_zip_code}: State={enriched_data['derived_location_state']}, City={enriched_data['derived_location_city']}, County={enriched_data['derived_location_county']}") # Level 5
-                else: # Level 4 
-                    logger.warning(f"Pgeocode returned an empty or non-Series result for ZIP: {current_location_zip_code}. Result: {zip_info}") # Level 5
-            except Exception as e_geo: # Level 3
-                logger.error(f"Error during geocoding execution for ZIP {current_location_zip_code}: {e_geo}", exc_info=True) # Level 4
-        elif not geo_nomi: # Level 2
-            logger.warning(f"Pgeocode client (geo_nomi) not initialized, skipping geocoding for ZIP: {current_location_zip_code}") # Level 3
-        else: # Level 2
-             logger.info(f"No valid location_zip_code ('{current_location_zip_code}') provided to geocode, skipping.") # Level 3
-
-
-        # B. Create Experience Bucket # Level 2
-        if years_experience is not None: # Level 2
-            if years_experience <= 2: enriched_data["experience_bucket"] = "0-2 yrs" # Level 3
-            elif years_experience <= 5: enriched_data["experience_bucket"] = "3-5 yrs" # Level 3
-            elif years_experience <= 10: enriched_data["experience_bucket"] = "6-10 yrs" # Level 3
-            elif years_experience <= 15: enriched_data["experience_bucket"] = "11-15 yrs" # Level 3
-            else: enriched_data["experience_bucket"] = ">15 yrs" # Level 3
-            logger.info(f"Derived experience_bucket: {enriched_data.get('experience_bucket')}") # Level 3
-        else: # Level 2
-            enriched_data["experience_bucket"] = None # Level 3
-
-        # C. Calculate Total Estimated Annual Compensation # Level 2
-        total_comp = 0.0 # Level 2
-        if employment_type_from_data == "W2": # Level 2
-            base_val = get_float_or_none(enriched_data.get('base_salary_annual')) # Level 3
-            hourly_val = get_float_or_none(enriched_data.get('hourly_rate_w2')) # Level 3
-            guar_hours_val = get_int_or_none(enriched_data.get('guaranteed_hours_w2')) # Level 3
-            if base_val: total_comp += base_val # Level 4
-            elif hourly_val and guar_hours_val: total_comp += hourly_val * guar_hours_val * 52 # Level 4
-        elif employment_type_from_data == "1099/Contractor": # Level 2
-            hourly_1099 = get_float_or_none(enriched_data.get('hourly_rate_1099')) # Level 3
-            if hourly_1099: # Level 3
-                assumed_annual_hours_1099 = 1800 # Level 4
-                total_comp += hourly_1099 * assumed_annual_hours_1099 # Level 4
-        
-        total_comp += get_float_or_none(enriched_data.get('bonus_potential_annual')) or 0 # Level 2
-        total_comp += get_float_or_none(enriched_data.get('sign_on_bonus')) or 0 # Level 2
-        
-        current_call_stipend_amount = get_float_or_none(enriched_data.get('call_stipend_amount')) or 0 # Level 2
-        if call_stipend_type_validated == "Per Diem" and current_call_stipend_amount > 0: # Level 2
-            assumed_call_days_per_year = 60 # Level 3
-            total_comp += current_call_stipend_amount * assumed_call_days_per_year # Level 3
-        elif call_stipend_type_validated == "Hourly On Call" and current_call_stipend_amount > 0: # Level 2
-            assumed_on_call_hours_per_year = 500 # Level 3
-            total_comp += current_call_stipend_amount * assumed_on_call_hours_per_year # Level 3
-        
-        enriched_data["total_estimated_annual_compensation"] = total_comp if total_comp > 0 else None # Level 2
-        logger.info(f"Derived total_estimated_annual_compensation: {enriched_data.get('total_estimated_annual_compensation')}") # Level 2
-
-        # D. Derive Region from State # Level 2
-        current_derived_state_for_region = enriched_data.get('derived_location_state') # Level 2
-        if current_derived_state_for_region and current_derived_state_for_region in STATE_TO_REGION: # Level 2
-            enriched_data['location_region'] = STATE_TO_REGION[current_derived_state_for_region] # Level 3
-            logger.info(f"Derived location_region: {enriched_data.get('location_region')}") # Level 3
-        else: # Level 2
-            enriched_data['location_region'] = None # Level 3
-
-        # --- 3. Prepare Final Row for BigQuery --- # Level 2
-        row_to_insert = { # Level 2
-            "submission_id": enriched_data.get("submission_id_server"), # Level 3
-            "submission_timestamp": enriched_data.get("submission_timestamp_server"), # Level 3
-            "years_experience": years_experience, # Level 3
-            "location_zip_code": location_zip_code_from_data, # Level 3
-            "derived_location_state": enriched_data.get("derived_location_state"), # Level 3
-            "derived_location_city": enriched_data.get("derived_location_city"), # Level 3
-            "derived_location_county": enriched_data.get("derived_location_county"), # Level 3
-            "location_region": enriched_data.get("location_region"), # Level 3
-            "experience_bucket": enriched_data.get("experience_bucket"), # Level 3
-            "total_estimated_annual_compensation": enriched_data.get("total_estimated_annual_compensation"), # Level 3
-            "employment_type": employment_type_from_data, # Level 3
-            "work_setting": work_setting_from_data, # Level 3
-            "primary_state_of_licensure": primary_state_of_licensure_validated, # Level 3
-            "base_salary_annual": get_float_or_none(enriched_data.get('base_salary_annual'), 'base_salary_annual'), # Level 3
-            "hourly_rate_w2": get_float_or_none(enriched_data.get('hourly_rate_w2'), 'hourly_rate_w2'), # Level 3
-            "guaranteed_hours_w2": get_int_or_none(enriched_data.get('guaranteed_hours_w2'), 'guaranteed_hours_w2'), # Level 3
-            "hourly_rate_1099": get_float_or_none(enriched_data.get('hourly_rate_1099'), 'hourly_rate_1099'), # Level 3
-            "ot_rate_multiplier" : get_float_or_none(enriched_data.get('ot_rate_multiplier'), 'ot_rate_multiplier'), # Level 3
-            "call_stipend_type": call_stipend_type_validated, # Level 3
-            "call_stipend_amount": get_float_or_none(enriched_data.get('call_stipend_amount'), 'call_stipend_amount'), # Level 3
-            "bonus_potential_annual": get_float_or_none(enriched_data.get('bonus_potential_annual'), 'bonus_potential_annual'), # Level 3
-            "sign_on_bonus": get_float_or_none(enriched_data.get('sign_on_bonus'), 'sign_on_bonus'), # Level 3
-            "retention_bonus_terms": enriched_data.get('retention_bonus_terms'), # Level 3
-            "pto_weeks": get_int_or_none(enriched_data.get('pto_weeks'), 'pto_weeks'), # Level 3
-            "retirement_match_percentage": get_float_or_none(enriched_data.get('retirement_match_percentage'), 'retirement_match_percentage'), # Level 3
-            "cme_allowance_annual": get_float_or_none(enriched_data.get('cme_allowance_annual'), 'cme_allowance_annual'), # Level 3
-            "malpractice_coverage_type": malpractice_coverage_type_validated, # Level 3
-            "comments": enriched_data.get('comments'), # Level 3
-            "data_source": enriched_data.get("data_source", "user_submission_pubsub"), # Level 3
-            "is_validated": False, # Level 3
-            "anomaly_score": None # Level 3
-        }
-        
-        BQ_ACTUAL_COLUMN_NAMES = [ # Level 2
-            "submission_id", "submission_timestamp", "years_experience", "location_zip_code",
-            "derived_location_state", "derived_location_city", "derived_location_county", "location_region",
-            "experience_bucket", "total_estimated_annual_compensation", 
-            "employment_type", "work_setting", "primary_state_of_licensure", "base_salary_annual", 
-            "hourly_rate_w2", "guaranteed_hours_w2", "hourly_rate_1099", "ot_rate_multiplier", 
-            "call_stipend_type", "call_stipend_amount", "bonus_potential_annual", "sign_on_bonus", 
-            "retention_bonus_terms", "pto_weeks", "retirement_match_percentage", "cme_allowance_annual", 
-            "malpractice_coverage_type", "comments", "data_source", "is_validated", "anomaly_score"
-        ]
-        final_row_for_bq = {k: v for k, v in row_to_insert.items() if k in BQ_ACTUAL_COLUMN_NAMES} # Level 2
-
-        # Critical Log: Print the exact row being sent
-        logger.info(f"Final row data being sent to BigQuery: {final_row_for_bq}") # Level 2
-        missing_bq_cols = [col for col in BQ_ACTUAL_COLUMN_NAMES if col not in final_row_for_bq] # Level 2
-        if missing_bq_cols: # Level 2
-            logger.error(f"CRITICAL: The following BQ columns are missing from the final row to be inserted: {missing_bq_cols}") # Level 3
-            # This might indicate typos in row_to_insert keys or BQ_ACTUAL_COLUMN_NAMES
-
         logger.info(f"Attempting to insert row into BigQuery table {TABLE_ID} for submission_id: {final_row_for_bq.get('submission_id')}") # Level 2
         errors = bq_client.insert_rows_json(TABLE_ID, [final_row_for_bq]) # Level 2
         if not errors: # Level 2
@@ -398,6 +592,17 @@ def process_crna_submission_event(event, context): # Level 0
             logger.error(f"BigQuery insertion errors for submission_id {final_row_for_bq.get('submission_id')}: {errors}") # Level 3
             return  # Level 3
 
+        if changelog_writer is not None: # Level 2
+            try: # Level 3 - the row is already in BigQuery, so a change log failure must not trigger a retry
+                seq = changelog_writer.append(changelog.build_change_record(final_row_for_bq)) # Level 4
+                logger.info(f"Appended submission_id {final_row_for_bq.get('submission_id')} to change log at seq {seq}") # Level 4
+            except Exception as e_changelog: # Level 3
+                logger.error(f"Failed to append submission_id {final_row_for_bq.get('submission_id')} to change log: {e_changelog}", exc_info=True) # Level 4
+
+        # Shadow comparison runs after the write, so the candidate never delays or changes what is stored.
+        if shadow_payload is not None: # Level 2
+            shadow_runner.compare(shadow_payload, final_row_for_bq, validation_errors, build_row_for_bq) # Level 3
+
     # except blocks aligned with the main 'try' (Level 1)
     except json.JSONDecodeError as e: # Level 1
         logger.error(f"Error decoding JSON from Pub/Sub message (outer try): {e}. Raw data (first 100 chars): {str(event.get('data'))[:100]}") # Level 2
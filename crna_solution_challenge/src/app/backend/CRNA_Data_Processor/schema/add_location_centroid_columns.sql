@@ -0,0 +1,8 @@
+-- ZIP centroid columns written by build_row_for_bq (main.py) and read by the
+-- local-market benchmark endpoint in BLS_Query_Run/app.py.
+-- Apply before setting BQ_LOCATION_COLUMNS=true; with the default "auto" the processor
+-- starts writing them on the first cold start after this has run.
+-- Replace the table reference with BQ_PROJECT_ID_FOR_FUNCTION.BQ_DATASET_ID_FOR_FUNCTION.BQ_TABLE_NAME_FOR_FUNCTION.
+ALTER TABLE `your-project.your_dataset.crna_submissions`
+  ADD COLUMN IF NOT EXISTS location_latitude FLOAT64,
+  ADD COLUMN IF NOT EXISTS location_longitude FLOAT64;
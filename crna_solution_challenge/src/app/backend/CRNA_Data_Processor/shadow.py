@@ -0,0 +1,239 @@
+# CRNA_Data_Processor/shadow.py
+#
+# Shadow mode: runs a candidate implementation of build_row_for_bq next to the current one on the
+# same decoded Pub/Sub payloads, diffs the resulting BigQuery rows field by field and compares
+# per-stage latency. Only the primary row is ever written; the candidate's output is discarded
+# after the comparison.
+#
+# Enable with SHADOW_PROCESSOR="module" or "module:function" (the function defaults to
+# build_row_for_bq and must accept (data_from_pubsub, stage_timings=None) and return
+# (row or None, errors)). SHADOW_SAMPLE_RATE (0-1, default 0.01) picks the fraction of messages that
+# are compared and SHADOW_REPORT_EVERY (default 100) how often a summary is logged.
+#
+# A sampled invocation does extra work after the row is written: the row diff uses the written
+# (primary) row, and latency is measured by running the primary again next to the candidate on
+# separate copies of the payload. The order of those two runs alternates between comparisons, so
+# neither implementation is systematically the one that runs on warm caches. Keep the sample rate low
+# in production, since every sampled message costs roughly two more build_row_for_bq runs. If the
+# primary's timing run raises (it already succeeded on the write path), that comparison is still
+# diffed but its latency is left out and it is counted under primary_errors, not against the candidate.
+#
+# Usage (offline, over backfill-style input):
+#   python shadow.py --candidate main_candidate --input submissions.jsonl
+import argparse
+import copy
+import importlib
+import itertools
+import json
+import logging
+import math
+import os
+import random
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+STAGES = ("validate", "enrich", "compose")
+DEFAULT_SAMPLE_RATE = 0.01
+MAX_EXAMPLES_PER_FIELD = 3
+
+
+def load_candidate(spec):
+    module_name, _, function_name = spec.partition(":")
+    return getattr(importlib.import_module(module_name), function_name or "build_row_for_bq")
+
+
+def values_match(primary, candidate, rel_tol=1e-9):
+    # Floats are compared with a tolerance so a reordered sum does not count as a regression.
+    if isinstance(primary, float) or isinstance(candidate, float):
+        if not isinstance(primary, (int, float)) or not isinstance(candidate, (int, float)):
+            return False
+        if math.isnan(primary) or math.isnan(candidate):
+            return math.isnan(primary) and math.isnan(candidate)
+        return math.isclose(primary, candidate, rel_tol=rel_tol, abs_tol=1e-9)
+    return primary == candidate
+
+
+def diff_rows(primary_row, candidate_row, ignore_fields=()):
+    # Returns the sorted field names whose values differ. Missing keys count as None.
+    if primary_row is None or candidate_row is None:
+        return [] if primary_row is candidate_row else ["<row>"]
+    fields = (set(primary_row) | set(candidate_row)) - set(ignore_fields)
+    return sorted(field for field in fields if not values_match(primary_row.get(field), candidate_row.get(field)))
+
+
+class ShadowStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.compared = 0
+        self.mismatched = 0
+        self.candidate_errors = 0
+        self.primary_errors = 0
+        self.timed = 0
+        self.field_mismatches = {}
+        self.examples = {}
+        self.primary_seconds = dict.fromkeys(STAGES + ("total",), 0.0)
+        self.candidate_seconds = dict.fromkeys(STAGES + ("total",), 0.0)
+
+    def record(self, mismatched_fields, primary_timings, candidate_timings, submission_id=None,
+               candidate_failed=False, primary_failed=False):
+        with self._lock:
+            self.compared += 1
+            if candidate_failed:
+                self.candidate_errors += 1
+            if primary_failed:
+                self.primary_errors += 1
+            if mismatched_fields:
+                self.mismatched += 1
+                for field in mismatched_fields:
+                    self.field_mismatches[field] = self.field_mismatches.get(field, 0) + 1
+                    examples = self.examples.setdefault(field, [])
+                    if len(examples) < MAX_EXAMPLES_PER_FIELD:
+                        examples.append(submission_id)
+            if not candidate_failed and not primary_failed:
+                self.timed += 1
+                for stage in self.primary_seconds:
+                    self.primary_seconds[stage] += primary_timings.get(stage, 0.0)
+                    self.candidate_seconds[stage] += candidate_timings.get(stage, 0.0)
+
+    def summary(self):
+        with self._lock:
+            timed = self.timed
+            stages = {}
+            for stage in self.primary_seconds:
+                primary_mean = self.primary_seconds[stage] / timed if timed else 0.0
+                candidate_mean = self.candidate_seconds[stage] / timed if timed else 0.0
+                stages[stage] = {
+                    "primary_mean_us": round(primary_mean * 1e6, 2),
+                    "candidate_mean_us": round(candidate_mean * 1e6, 2),
+                    # > 1 means the candidate is faster
+                    "speedup": round(primary_mean / candidate_mean, 3) if candidate_mean else None,
+                }
+            return {
+                "compared": self.compared,
+                "mismatched": self.mismatched,
+                "mismatch_rate": round(self.mismatched / self.compared, 6) if self.compared else 0.0,
+                "candidate_errors": self.candidate_errors,
+                "primary_errors": self.primary_errors,
+                "field_mismatches": dict(sorted(self.field_mismatches.items(), key=lambda item: -item[1])),
+                "mismatch_examples": {field: list(ids) for field, ids in self.examples.items()},
+                "stages": stages,
+            }
+
+
+class ShadowRunner:
+    def __init__(self, candidate_spec, sample_rate=DEFAULT_SAMPLE_RATE, report_every=100, ignore_fields=()):
+        # The candidate is imported on first use so a candidate module may itself import main.
+        self.candidate_spec = candidate_spec
+        self.sample_rate = sample_rate
+        self.report_every = max(1, int(report_every))
+        self.ignore_fields = tuple(ignore_fields)
+        self.stats = ShadowStats()
+        self._candidate = None
+        self._comparisons = itertools.count(1)
+
+    @classmethod
+    def from_env(cls):
+        # Returns None when shadow mode is not configured.
+        candidate_spec = os.getenv("SHADOW_PROCESSOR")
+        if not candidate_spec:
+            return None
+        return cls(
+            candidate_spec,
+            sample_rate=float(os.getenv("SHADOW_SAMPLE_RATE", str(DEFAULT_SAMPLE_RATE))),
+            report_every=int(os.getenv("SHADOW_REPORT_EVERY", "100")),
+        )
+
+    @property
+    def candidate(self):
+        if self._candidate is None:
+            self._candidate = load_candidate(self.candidate_spec)
+        return self._candidate
+
+    def should_sample(self):
+        return self.sample_rate >= 1.0 or random.random() < self.sample_rate
+
+    def compare(self, payload, primary_row, primary_errors, primary):
+        # `payload` must be a private copy taken before `primary` (the function that produced primary_row)
+        # ran: the candidate is untrusted and may mutate its input. Never raises, so a broken candidate
+        # cannot affect the primary write path.
+        comparison_number = next(self._comparisons)
+        primary_timings, candidate_timings = {}, {}
+        primary_payload = copy.deepcopy(payload)
+        if comparison_number % 2:
+            candidate_result = self._run_timed("candidate", self._call_candidate, payload, candidate_timings)
+            primary_result = self._run_timed("primary", primary, primary_payload, primary_timings)
+        else:
+            primary_result = self._run_timed("primary", primary, primary_payload, primary_timings)
+            candidate_result = self._run_timed("candidate", self._call_candidate, payload, candidate_timings)
+        candidate_failed = candidate_result is None
+        if candidate_failed:
+            mismatched_fields = ["<exception>"]
+        else:
+            candidate_row, candidate_errors = candidate_result
+            mismatched_fields = diff_rows(primary_row, candidate_row, self.ignore_fields)
+            if list(primary_errors or []) != candidate_errors:
+                mismatched_fields.append("<validation_errors>")
+
+        submission_id = (primary_row or {}).get("submission_id") or (payload or {}).get("submission_id_server")
+        if mismatched_fields and not candidate_failed:
+            logger.warning(f"Shadow mismatch for submission_id {submission_id}: {mismatched_fields}")
+        self.stats.record(mismatched_fields, primary_timings, candidate_timings, submission_id,
+                          candidate_failed=candidate_failed, primary_failed=primary_result is None)
+
+        if comparison_number % self.report_every == 0:
+            self.log_summary()
+
+    def _call_candidate(self, payload, stage_timings=None):
+        # Resolves the candidate inside _run_timed, so a candidate that fails to import is a candidate error.
+        return self.candidate(payload, stage_timings=stage_timings)
+
+    def _run_timed(self, role, build, payload, stage_timings):
+        # Returns build's (row, errors as a list), or None if it raised or returned something else.
+        try:
+            row, errors = timed_build(build, payload, stage_timings)
+            if row is not None and not isinstance(row, dict):
+                raise TypeError(f"expected a row dict or None, got {type(row).__name__}")
+            return row, list(errors or [])
+        except Exception as e:
+            logger.warning(f"Shadow {role} run raised (candidate '{self.candidate_spec}'): {e}", exc_info=True)
+            return None
+
+    def log_summary(self):
+        logger.info(f"Shadow summary ({self.candidate_spec}): {json.dumps(self.stats.summary(), sort_keys=True)}")
+
+    def summary(self):
+        return self.stats.summary()
+
+
+def timed_build(build, payload, stage_timings):
+    # Calls build(payload, stage_timings=...) and adds the wall-clock "total" to stage_timings.
+    started = time.perf_counter()
+    result = build(payload, stage_timings=stage_timings)
+    stage_timings["total"] = time.perf_counter() - started
+    return result
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Compare a candidate processor against main.build_row_for_bq over JSONL submissions.")
+    parser.add_argument("--candidate", required=True, help="'module' or 'module:function' of the candidate.")
+    parser.add_argument("--input", required=True, help="JSONL file of decoded submission payloads.")
+    parser.add_argument("--limit", type=int, default=None, help="Stop after this many payloads.")
+    args = parser.parse_args()
+
+    import main # Imported here so `import shadow` from main stays cycle-free
+
+    main.logger.setLevel(logging.WARNING)
+    runner = ShadowRunner(args.candidate, sample_rate=1.0, report_every=10 ** 9)
+    with open(args.input, "r") as fh:
+        for line in itertools.islice(fh, args.limit):
+            if not line.strip():
+                continue
+            payload = json.loads(line)
+            shadow_payload = copy.deepcopy(payload)
+            row, errors = main.build_row_for_bq(payload)
+            runner.compare(shadow_payload, row, errors, main.build_row_for_bq)
+    print(json.dumps(runner.summary(), indent=4, sort_keys=True))
@@ -0,0 +1,105 @@
+# Shared fixtures for the CRNA_Data_Processor tests and benchmarks.
+# Run from CRNA_Data_Processor/:  pip install -r requirements-test.txt && python -m pytest tests
+import importlib.util
+import logging
+import os
+import random
+import sys
+import uuid
+
+import pytest
+
+PROCESSOR_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SUBMISSION_SERVICE_DIR = os.path.join(os.path.dirname(PROCESSOR_DIR), "CRNA_Submission_Run")
+sys.path.insert(0, PROCESSOR_DIR)
+
+# Importing main must not touch a real table: skip the cold-start schema check and any opt-in side effects.
+os.environ.setdefault("BQ_LOCATION_COLUMNS", "false")
+os.environ.pop("CHANGELOG_DIR", None)
+os.environ.pop("SHADOW_PROCESSOR", None)
+os.environ.pop("COMPENSATION_MODELS_PATH", None) # rows are computed with the baseline model
+os.environ.pop("COMPENSATION_MODEL", None)
+
+import main  # noqa: E402
+
+main.logger.setLevel(logging.WARNING) # build_row_for_bq logs every step at INFO
+
+SYNTHETIC_PAYLOAD_COUNT = 500
+SYNTHETIC_ZIP_CODES = ("90210", "10001", "60601", "77002", "98101", "30301", "02108", "85001")
+SYNTHETIC_STATES = ("CA", "ny", "IL", "tx", "WA", "GA", "MA", "AZ", "DC")
+
+
+def make_submission(rng):
+    # A valid submission shaped like what CRNA_Submission_Run publishes (form values arrive as strings).
+    employment_type = rng.choice(main.ALLOWED_EMPLOYMENT_TYPES)
+    submission = {
+        "submission_id_server": str(uuid.UUID(int=rng.getrandbits(128))),
+        "submission_timestamp_server": "2025-06-01T12:00:00+00:00",
+        "years_experience": str(rng.randint(0, 40)),
+        "location_zip_code": rng.choice(SYNTHETIC_ZIP_CODES),
+        "employment_type": employment_type,
+        "work_setting": rng.choice(main.ALLOWED_WORK_SETTINGS),
+        "primary_state_of_licensure": rng.choice(SYNTHETIC_STATES),
+        "call_stipend_type": rng.choice(["Per Diem", "Hourly On Call", "None", ""]),
+        "call_stipend_amount": str(rng.choice([0, 250, 500, 1200])),
+        "bonus_potential_annual": str(rng.choice([0, 5000, 15000])),
+        "pto_weeks": str(rng.randint(2, 8)),
+        "malpractice_coverage_type": rng.choice(["Occurrence", "Claims-Made", ""]),
+        "comments": rng.choice(["", "Great team, heavy call schedule.", "Rural ASC, no OB."]),
+        "data_source": "user_submission_pubsub",
+    }
+    if employment_type == "1099/Contractor":
+        submission["hourly_rate_1099"] = str(rng.choice([150, 175, 200, 225]))
+    else:
+        submission["base_salary_annual"] = str(rng.randint(160, 260) * 1000)
+    return submission
+
+
+def make_invalid_submission(rng):
+    # Breaks a valid submission in a few independent ways, so every validation branch sees errors.
+    submission = make_submission(rng)
+    submission["location_zip_code"] = rng.choice(["ABCDE", "1234", "90210-12"])
+    submission["employment_type"] = rng.choice(["Full-time", "", "w2"])
+    submission["primary_state_of_licensure"] = rng.choice(["PR", "GU", "California", "X1"])
+    submission["call_stipend_type"] = rng.choice(["Weekly", ["Per Diem"]])
+    submission["pto_weeks"] = rng.choice(["sixty", "99"])
+    return submission
+
+
+@pytest.fixture(scope="session")
+def valid_submissions():
+    rng = random.Random(26)
+    return [make_submission(rng) for _ in range(SYNTHETIC_PAYLOAD_COUNT)]
+
+
+@pytest.fixture(scope="session")
+def invalid_submissions():
+    rng = random.Random(31)
+    return [make_invalid_submission(rng) for _ in range(SYNTHETIC_PAYLOAD_COUNT)]
+
+
+@pytest.fixture(scope="session")
+def submission_app():
+    # CRNA_Submission_Run/app.py (the publishing side of the wire format), loaded as "submission_app"
+    # so it cannot clash with this directory's modules. Its Pub/Sub client fails to initialize without
+    # credentials, which the app tolerates; only its encoding helpers are used here.
+    pytest.importorskip("flask_cors")
+    pytest.importorskip("google.cloud.pubsub_v1")
+    sys.path.insert(0, SUBMISSION_SERVICE_DIR) # for its own `import admission`
+    spec = importlib.util.spec_from_file_location("submission_app", os.path.join(SUBMISSION_SERVICE_DIR, "app.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def record_throughput(benchmark):
+    # Call after benchmark(...): stores labels plus "<unit>_per_second" (items per timed round / mean
+    # round time) in the benchmark's extra_info. With --benchmark-disable the function runs once
+    # without stats, so only the labels are stored.
+    def record(item_count, unit="messages", **labels):
+        benchmark.extra_info.update(labels)
+        if benchmark.stats is None:
+            return
+        benchmark.extra_info[f"{unit}_per_second"] = round(item_count / benchmark.stats.stats.mean)
+    return record
@@ -0,0 +1,161 @@
+# Change log tests: writer recovery and roll-over, reader seeks, offset commits and compaction.
+import os
+import threading
+
+import pytest
+
+import changelog
+
+
+def make_record(n):
+    return changelog.build_change_record({"submission_id": f"sub-{n}", "years_experience": n, "notes": None})
+
+
+def write_records(writer, count):
+    return [writer.append(make_record(n)) for n in range(count)]
+
+
+@pytest.fixture
+def log_dir(tmp_path):
+    return str(tmp_path / "changelog")
+
+
+def test_torn_last_line_is_skipped_then_truncated_on_reopen(log_dir):
+    writer = changelog.ChangeLogWriter(log_dir, writer_id="w1")
+    write_records(writer, 3)
+    writer.close()
+    (_, segment_path), = changelog.list_segments(writer.writer_dir)
+    with open(segment_path, "ab") as fh:
+        fh.write(b'{"seq": 4, "writer": "w1", "op": "ins')
+
+    assert [record["seq"] for record in changelog.ChangeLogReader(log_dir).read("w1")] == [1, 2, 3]
+
+    writer = changelog.ChangeLogWriter(log_dir, writer_id="w1")
+    assert writer.last_seq == 3
+    assert writer.append(make_record(3)) == 4
+    writer.close()
+    with open(segment_path, "rb") as fh:
+        lines = fh.read().split(b"\n")
+    assert lines[-1] == b"" and len(lines) == 5
+    assert [record["seq"] for record in changelog.ChangeLogReader(log_dir).read("w1")] == [1, 2, 3, 4]
+
+
+def test_live_namespace_cannot_be_opened_twice(log_dir):
+    writer = changelog.ChangeLogWriter(log_dir, writer_id="w1")
+    with pytest.raises(RuntimeError):
+        changelog.ChangeLogWriter(log_dir, writer_id="w1")
+    writer.close()
+    changelog.ChangeLogWriter(log_dir, writer_id="w1").close()
+
+
+def test_segments_roll_over_at_max_bytes(log_dir):
+    writer = changelog.ChangeLogWriter(log_dir, writer_id="w1", segment_max_bytes=400)
+    write_records(writer, 20)
+    writer.close()
+
+    segments = changelog.list_segments(writer.writer_dir)
+    assert len(segments) > 3
+    for first_seq, path in segments:
+        assert os.path.getsize(path) <= 400
+        assert next(changelog._iter_segment(path))["seq"] == first_seq
+    assert [record["seq"] for record in changelog.ChangeLogReader(log_dir).read("w1")] == list(range(1, 21))
+
+
+def test_read_starts_at_the_segment_holding_after_seq(log_dir, monkeypatch):
+    writer = changelog.ChangeLogWriter(log_dir, writer_id="w1", segment_max_bytes=400)
+    write_records(writer, 20)
+    writer.close()
+    segments = changelog.list_segments(writer.writer_dir)
+    first_seqs = [first_seq for first_seq, _ in segments]
+
+    opened = []
+    iter_segment = changelog._iter_segment
+    def recording_iter_segment(path):
+        opened.append(path)
+        return iter_segment(path)
+    monkeypatch.setattr(changelog, "_iter_segment", recording_iter_segment)
+
+    reader = changelog.ChangeLogReader(log_dir)
+    for after_seq in range(0, 21):
+        opened.clear()
+        assert [record["seq"] for record in reader.read("w1", after_seq)] == list(range(after_seq + 1, 21))
+        # The first segment opened is the one that holds after_seq + 1 (or the newest one once caught up).
+        expected_index = max(index for index, first_seq in enumerate(first_seqs) if first_seq <= after_seq + 1)
+        assert opened[0] == segments[expected_index][1]
+
+    opened.clear()
+    assert [record["seq"] for record in reader.read("w1", 0, max_records=1)] == [1]
+    assert opened == [segments[0][1]]
+
+
+def test_commit_offset_only_moves_forward(log_dir):
+    os.makedirs(log_dir)
+    reader = changelog.ChangeLogReader(log_dir)
+    assert reader.commit_offset("dash", "w1", 5) == 5
+    assert reader.commit_offset("dash", "w1", 3) == 5
+    assert reader.get_offset("dash") == {"w1": 5}
+    assert reader.get_offset("other") == {}
+
+
+def test_concurrent_commits_are_not_lost(log_dir):
+    os.makedirs(log_dir)
+    reader = changelog.ChangeLogReader(log_dir)
+    consumers = [f"consumer-{n}" for n in range(8)]
+    def commit_all(consumer):
+        for seq in range(1, 26):
+            changelog.ChangeLogReader(log_dir).commit_offset(consumer, "w1", seq)
+    threads = [threading.Thread(target=commit_all, args=(consumer,)) for consumer in consumers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert reader.load_offsets() == {consumer: {"w1": 25} for consumer in consumers}
+    assert not [name for name in os.listdir(log_dir) if name.endswith(".tmp")]
+
+
+def test_compact_drops_only_segments_every_consumer_has_read(log_dir):
+    writer = changelog.ChangeLogWriter(log_dir, writer_id="w1", segment_max_bytes=400)
+    write_records(writer, 20)
+    segments = changelog.list_segments(writer.writer_dir)
+    reader = changelog.ChangeLogReader(log_dir)
+
+    assert changelog.compact(log_dir) == {"segments_dropped": 0, "namespaces_removed": 0} # no consumers yet
+
+    reader.commit_offset("dash", "w1", 20)
+    reader.commit_offset("looker", "w1", segments[2][0] - 1) # read exactly through the second segment
+    assert changelog.compact(log_dir)["segments_dropped"] == 2
+    assert changelog.list_segments(writer.writer_dir) == segments[2:]
+    assert [record["seq"] for record in reader.read("w1", segments[2][0] - 1)] == list(range(segments[2][0], 21))
+
+    # Once everyone is caught up, the live writer's newest segment is all that is left.
+    reader.commit_offset("looker", "w1", 20)
+    changelog.compact(log_dir)
+    assert changelog.list_segments(writer.writer_dir) == segments[-1:]
+    assert writer.append(make_record(20)) == 21
+    writer.close()
+
+
+def test_compact_removes_fully_consumed_dead_namespaces(log_dir):
+    dead = changelog.ChangeLogWriter(log_dir, writer_id="dead", segment_max_bytes=400)
+    write_records(dead, 10)
+    dead.close()
+    unread = changelog.ChangeLogWriter(log_dir, writer_id="unread")
+    write_records(unread, 3)
+    unread.close()
+    live = changelog.ChangeLogWriter(log_dir, writer_id="live")
+    write_records(live, 3)
+    reader = changelog.ChangeLogReader(log_dir)
+    for consumer in ("dash", "looker"):
+        reader.commit_offset(consumer, "dead", 10)
+        reader.commit_offset(consumer, "unread", 2)
+        reader.commit_offset(consumer, "live", 3)
+
+    summary = changelog.compact(log_dir)
+
+    assert summary["namespaces_removed"] == 1
+    assert changelog.list_writers(log_dir) == ["live", "unread"]
+    assert reader.load_offsets() == {consumer: {"unread": 2, "live": 3} for consumer in ("dash", "looker")}
+    assert reader.read("dead") == []
+    assert [record["seq"] for record in reader.read("unread", 2)] == [3]
+    live.close()
@@ -0,0 +1,83 @@
+# JSON codec benchmarks: orjson vs stdlib json on realistic CRNA payloads, through the code paths the
+# services actually use (submission_app.json_dumps_bytes on publish, json_codec on the processor side).
+# Benchmarks only:  python -m pytest tests/test_codec_benchmark.py --benchmark-only
+import json
+from datetime import datetime, timezone
+
+import pytest
+
+import json_codec
+import main
+
+BACKENDS = [
+    "json",
+    pytest.param("orjson", marks=pytest.mark.skipif(json_codec.orjson is None, reason="orjson is not installed")),
+]
+
+
+@pytest.fixture(params=BACKENDS)
+def backend(request, monkeypatch, submission_app):
+    # Both modules check their `orjson` global on every call, so clearing it selects the stdlib path.
+    if request.param == "json":
+        monkeypatch.setattr(json_codec, "orjson", None)
+        monkeypatch.setattr(submission_app, "orjson", None)
+    return request.param
+
+
+@pytest.fixture(scope="session")
+def published_messages(valid_submissions):
+    # Message bodies as CRNA_Submission_Run publishes them; identical bytes for every decode backend.
+    return [json.dumps(submission).encode("utf-8") for submission in valid_submissions]
+
+
+@pytest.fixture(scope="session")
+def bigquery_rows(valid_submissions):
+    return [main.build_row_for_bq(submission)[0] for submission in valid_submissions]
+
+
+def test_backends_round_trip_submissions(backend, submission_app, valid_submissions):
+    for submission in valid_submissions:
+        assert json_codec.loads(submission_app.json_dumps_bytes(submission)) == submission
+
+
+def test_backends_round_trip_bigquery_rows(backend, bigquery_rows):
+    for row in bigquery_rows:
+        assert json_codec.loads(json_codec.dumps_line(row)) == row
+
+
+@pytest.mark.skipif(json_codec.orjson is None, reason="orjson is not installed")
+def test_backends_write_identical_lines(monkeypatch, bigquery_rows):
+    rows = bigquery_rows[:50] + [{"city": "Mayagüez", "notes": "née Ångström – ✓", "n": 1.5}]
+    with_orjson = [json_codec.dumps_line(row) for row in rows]
+    monkeypatch.setattr(json_codec, "orjson", None)
+    assert [json_codec.dumps_line(row) for row in rows] == with_orjson
+
+
+def test_datetimes_encode_as_iso_strings(backend, submission_app):
+    timestamp = datetime(2025, 6, 1, 12, 0, tzinfo=timezone.utc)
+    encoded = submission_app.json_dumps_bytes({"ts": timestamp}, default=submission_app.app.json.default)
+    assert json.loads(encoded) == {"ts": timestamp.isoformat()}
+
+
+def test_benchmark_encode_submissions(benchmark, record_throughput, backend, submission_app, valid_submissions):
+    def encode_all():
+        return [submission_app.json_dumps_bytes(submission) for submission in valid_submissions]
+    encoded = benchmark(encode_all)
+    record_throughput(len(valid_submissions), backend=backend, mean_message_bytes=round(sum(map(len, encoded)) / len(encoded), 1))
+
+
+def test_benchmark_decode_messages(benchmark, record_throughput, backend, published_messages):
+    def decode_all():
+        for message in published_messages:
+            json_codec.loads(message)
+    benchmark(decode_all)
+    record_throughput(len(published_messages), backend=backend,
+                      mean_message_bytes=round(sum(map(len, published_messages)) / len(published_messages), 1))
+
+
+def test_benchmark_encode_bigquery_rows(benchmark, record_throughput, backend, bigquery_rows):
+    def encode_all():
+        for row in bigquery_rows:
+            json_codec.dumps_line(row)
+    benchmark(encode_all)
+    record_throughput(len(bigquery_rows), backend=backend)
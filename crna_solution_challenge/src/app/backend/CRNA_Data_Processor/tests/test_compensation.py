@@ -0,0 +1,119 @@
+# Compensation models: the single-record and vectorized forms agree, and the baseline reproduces the
+# formula main.py used inline before models were configurable.
+import math
+import os
+import random
+
+import pytest
+
+import compensation
+import main
+
+EXAMPLE_MODELS_PATH = os.path.join(os.path.dirname(os.path.abspath(compensation.__file__)), "compensation_models.example.json")
+EMPLOYMENT_TYPES = ("W2", "1099/Contractor", "Part-time W2", "Other", None)
+CALL_STIPEND_TYPES = ("Per Diem", "Hourly On Call", "Activation Only", "None", None)
+
+
+def maybe(rng, value):
+    # Typed rows leave optional fields as None, and 0 means "not provided" just the same.
+    return rng.choice((value, value, None, 0))
+
+
+def make_row(rng):
+    return {
+        "submission_id": f"sub-{rng.getrandbits(32)}",
+        "employment_type": rng.choice(EMPLOYMENT_TYPES),
+        "base_salary_annual": maybe(rng, round(rng.uniform(150000, 300000), 2)),
+        "hourly_rate_w2": maybe(rng, round(rng.uniform(80, 200), 2)),
+        "guaranteed_hours_w2": maybe(rng, rng.randint(20, 60)),
+        "hourly_rate_1099": maybe(rng, round(rng.uniform(120, 300), 2)),
+        "ot_rate_multiplier": maybe(rng, rng.choice((1.0, 1.5, 2.0))),
+        "call_stipend_type": rng.choice(CALL_STIPEND_TYPES),
+        "call_stipend_amount": maybe(rng, round(rng.uniform(-50, 1500), 2)),
+        "bonus_potential_annual": maybe(rng, round(rng.uniform(0, 40000), 2)),
+        "sign_on_bonus": maybe(rng, round(rng.uniform(0, 50000), 2)),
+        "retirement_match_percentage": maybe(rng, round(rng.uniform(0, 10), 1)),
+        "cme_allowance_annual": maybe(rng, round(rng.uniform(0, 5000), 2)),
+    }
+
+
+@pytest.fixture(scope="module")
+def synthetic_rows():
+    rng = random.Random(29)
+    return [make_row(rng) for _ in range(2000)]
+
+
+@pytest.fixture(scope="module")
+def processed_rows(valid_submissions):
+    return [main.build_row_for_bq(submission)[0] for submission in valid_submissions]
+
+
+@pytest.fixture(scope="module")
+def example_models():
+    models, active_model_name = compensation.load_compensation_models(EXAMPLE_MODELS_PATH)
+    assert active_model_name == compensation.DEFAULT_MODEL_NAME
+    assert set(models) == {"baseline", "with_benefits", "heavy_call", "amortized_sign_on"}
+    return models
+
+
+def legacy_total(row):
+    # The inline calculation main.build_row_for_bq performed before compensation.py existed.
+    total_comp = 0.0
+    if row["employment_type"] == "W2":
+        base_val = row["base_salary_annual"]
+        hourly_val = row["hourly_rate_w2"]
+        guar_hours_val = row["guaranteed_hours_w2"]
+        if base_val: total_comp += base_val
+        elif hourly_val and guar_hours_val: total_comp += hourly_val * guar_hours_val * 52
+    elif row["employment_type"] == "1099/Contractor":
+        hourly_1099 = row["hourly_rate_1099"]
+        if hourly_1099:
+            total_comp += hourly_1099 * 1800
+    total_comp += row["bonus_potential_annual"] or 0
+    total_comp += row["sign_on_bonus"] or 0
+    current_call_stipend_amount = row["call_stipend_amount"] or 0
+    if row["call_stipend_type"] == "Per Diem" and current_call_stipend_amount > 0:
+        total_comp += current_call_stipend_amount * 60
+    elif row["call_stipend_type"] == "Hourly On Call" and current_call_stipend_amount > 0:
+        total_comp += current_call_stipend_amount * 500
+    return total_comp if total_comp > 0 else None
+
+
+def assert_totals_match(actual, expected):
+    assert len(actual) == len(expected)
+    for index, (got, want) in enumerate(zip(actual, expected)):
+        if want is None:
+            assert got is None, f"row {index}: expected None, got {got}"
+        else:
+            assert got == pytest.approx(want, rel=1e-9), f"row {index}"
+
+
+@pytest.mark.parametrize("rows_fixture", ["synthetic_rows", "processed_rows"])
+def test_compute_and_compute_batch_agree_for_every_example_model(request, example_models, rows_fixture):
+    rows = request.getfixturevalue(rows_fixture)
+    batch = compensation.evaluate_models(rows, example_models.values())
+    for name, model in example_models.items():
+        vectorized = [None if math.isnan(value) else value for value in batch[name]]
+        assert_totals_match(vectorized, [model.compute(row) for row in rows])
+
+
+@pytest.mark.parametrize("rows_fixture", ["synthetic_rows", "processed_rows"])
+def test_baseline_matches_legacy_formula(request, example_models, rows_fixture):
+    rows = request.getfixturevalue(rows_fixture)
+    expected = [legacy_total(row) for row in rows]
+    assert any(value is not None for value in expected) and any(value is None for value in expected)
+    assert_totals_match([example_models["baseline"].compute(row) for row in rows], expected)
+    assert_totals_match([main.ACTIVE_COMPENSATION_MODEL.compute(row) for row in rows], expected)
+
+
+def test_models_differ_where_their_assumptions_apply(example_models, synthetic_rows):
+    totals = compensation.evaluate_models(synthetic_rows, example_models.values()).fillna(0.0)
+    for name in ("with_benefits", "heavy_call"):
+        assert (totals[name] >= totals["baseline"]).all()
+        assert (totals[name] > totals["baseline"]).any()
+    assert (totals["amortized_sign_on"] <= totals["baseline"]).all()
+
+
+def test_unknown_assumption_keys_are_rejected():
+    with pytest.raises(ValueError):
+        compensation.CompensationModel("typo", {"assumed_call_day_per_year": 90})
@@ -0,0 +1,137 @@
+# Shadow mode: row diffing, stats and how ShadowRunner.compare attributes failures.
+import copy
+import math
+
+import pytest
+
+import main
+import shadow
+
+
+@pytest.mark.parametrize("primary,candidate,expected", [
+    (float("nan"), float("nan"), True),
+    (float("nan"), 1.0, False),
+    (1.0, float("nan"), False),
+    (0.1 + 0.2, 0.3, True),
+    (215000.0, 215000.0000001, True),
+    (1.0, 1.0001, False),
+    (1, 1.0, True),
+    (0.0, 1e-12, True),
+    ("1.0", 1.0, False),
+    (None, 0.0, False),
+    (None, None, True),
+    ("W2", "W2", True),
+    ("W2", "w2", False),
+])
+def test_values_match(primary, candidate, expected):
+    assert shadow.values_match(primary, candidate) is expected
+
+
+def test_diff_rows():
+    row = {"submission_id": "a", "total_estimated_annual_compensation": 0.1 + 0.2, "location_region": None}
+    assert shadow.diff_rows(row, {"submission_id": "a", "total_estimated_annual_compensation": 0.3}) == []
+    assert shadow.diff_rows(row, dict(row, submission_id="b", location_region="West")) == ["location_region", "submission_id"]
+    assert shadow.diff_rows(row, dict(row, extra=1)) == ["extra"]
+    assert shadow.diff_rows(row, dict(row, submission_id="b"), ignore_fields=("submission_id",)) == []
+    assert shadow.diff_rows({"x": math.nan}, {"x": math.nan}) == []
+    assert shadow.diff_rows(None, None) == []
+    assert shadow.diff_rows(row, None) == ["<row>"]
+    assert shadow.diff_rows(None, row) == ["<row>"]
+
+
+def test_stats_summary():
+    stats = shadow.ShadowStats()
+    timings = {"validate": 1e-5, "enrich": 2e-5, "compose": 1e-5, "total": 4e-5}
+    faster = {stage: seconds / 2 for stage, seconds in timings.items()}
+    for n in range(5):
+        stats.record(["location_region"] if n < 4 else [], timings, faster, submission_id=f"id-{n}")
+    stats.record(["<exception>"], {}, {}, submission_id="id-5", candidate_failed=True)
+    stats.record(["experience_bucket", "location_region"], {}, {}, submission_id="id-6", primary_failed=True)
+
+    summary = stats.summary()
+    assert summary["compared"] == 7
+    assert summary["mismatched"] == 6
+    assert summary["mismatch_rate"] == round(6 / 7, 6)
+    assert summary["candidate_errors"] == 1
+    assert summary["primary_errors"] == 1
+    assert list(summary["field_mismatches"].items()) == [("location_region", 5), ("<exception>", 1), ("experience_bucket", 1)]
+    assert summary["mismatch_examples"]["location_region"] == ["id-0", "id-1", "id-2"] # capped
+    # Only the five comparisons where both runs succeeded are timed.
+    assert summary["stages"]["total"] == {"primary_mean_us": 40.0, "candidate_mean_us": 20.0, "speedup": 2.0}
+
+
+def test_empty_stats_summary():
+    summary = shadow.ShadowStats().summary()
+    assert summary["compared"] == 0 and summary["mismatch_rate"] == 0.0
+    assert summary["stages"]["total"]["speedup"] is None
+
+
+def make_runner(candidate):
+    runner = shadow.ShadowRunner("test-candidate", sample_rate=1.0, report_every=10 ** 9)
+    runner._candidate = candidate
+    return runner
+
+
+def compare_all(runner, submissions, primary=main.build_row_for_bq):
+    for submission in submissions:
+        shadow_payload = copy.deepcopy(submission)
+        row, errors = main.build_row_for_bq(copy.deepcopy(submission))
+        runner.compare(shadow_payload, row, errors, primary)
+    return runner.summary()
+
+
+def test_identical_candidate_has_no_mismatches(valid_submissions, invalid_submissions):
+    summary = compare_all(make_runner(main.build_row_for_bq), valid_submissions[:20] + invalid_submissions[:20])
+    assert summary["compared"] == 40
+    assert summary["mismatched"] == 0
+    assert summary["candidate_errors"] == summary["primary_errors"] == 0
+    assert summary["stages"]["total"]["candidate_mean_us"] > 0
+
+
+def test_changed_field_is_reported(valid_submissions):
+    def candidate(payload, stage_timings=None):
+        row, errors = main.build_row_for_bq(payload, stage_timings=stage_timings)
+        return dict(row, experience_bucket="other"), errors
+    summary = compare_all(make_runner(candidate), valid_submissions[:10])
+    assert summary["field_mismatches"] == {"experience_bucket": 10}
+
+
+def test_raising_candidate_is_counted_and_never_propagates(valid_submissions):
+    def candidate(payload, stage_timings=None):
+        raise RuntimeError("candidate bug")
+    summary = compare_all(make_runner(candidate), valid_submissions[:6])
+    assert summary["candidate_errors"] == 6
+    assert summary["primary_errors"] == 0
+    assert summary["field_mismatches"] == {"<exception>": 6}
+
+
+def test_candidate_returning_garbage_is_a_candidate_error(valid_submissions):
+    summary = compare_all(make_runner(lambda payload, stage_timings=None: ("not a row", 7)), valid_submissions[:2])
+    assert summary["candidate_errors"] == 2
+
+
+def test_unimportable_candidate_is_a_candidate_error(valid_submissions):
+    runner = shadow.ShadowRunner("no_such_candidate_module", sample_rate=1.0, report_every=10 ** 9)
+    summary = compare_all(runner, valid_submissions[:2])
+    assert summary["candidate_errors"] == 2
+
+
+def test_primary_rerun_failure_is_not_blamed_on_candidate(valid_submissions):
+    def flaky_primary(payload, stage_timings=None):
+        raise TimeoutError("geocoder timed out")
+    summary = compare_all(make_runner(main.build_row_for_bq), valid_submissions[:4], primary=flaky_primary)
+    assert summary["primary_errors"] == 4
+    assert summary["candidate_errors"] == 0
+    assert summary["mismatched"] == 0 # still diffed against the row that was written
+    assert summary["stages"]["total"]["primary_mean_us"] == 0.0 # but left out of the latency comparison
+
+
+def test_run_order_alternates(valid_submissions):
+    calls = []
+    def recording(role):
+        def build(payload, stage_timings=None):
+            calls.append(role)
+            return main.build_row_for_bq(payload, stage_timings=stage_timings)
+        return build
+    compare_all(make_runner(recording("candidate")), valid_submissions[:4], primary=recording("primary"))
+    assert calls == ["candidate", "primary", "primary", "candidate"] * 2
@@ -0,0 +1,61 @@
+# Wire contract between CRNA_Submission_Run (encode_submission_message) and this processor
+# (decode_submission_message), plus a codec benchmark over synthetic submissions.
+# Benchmarks only:  python -m pytest tests/test_submission_codec.py --benchmark-only
+import pytest
+
+import main
+
+FORMATS = [
+    ("json", ""),
+    ("json", "zlib"),
+    pytest.param(("msgpack", ""), marks=pytest.mark.skipif(main.msgpack is None, reason="msgpack is not installed")),
+    pytest.param(("msgpack", "zlib"), marks=pytest.mark.skipif(main.msgpack is None, reason="msgpack is not installed")),
+]
+
+
+@pytest.fixture(params=FORMATS, ids=lambda fmt: "+".join(part for part in fmt if part))
+def message_format(request, monkeypatch, submission_app):
+    message_format, compression = request.param
+    monkeypatch.setattr(submission_app, "PUB_SUB_MESSAGE_FORMAT", message_format)
+    monkeypatch.setattr(submission_app, "PUB_SUB_MESSAGE_COMPRESSION", compression)
+    return request.param
+
+
+def test_schema_fields_match(submission_app):
+    # The msgpack field order is duplicated in both services; any drift corrupts every message.
+    assert submission_app.CRNA_SUBMISSION_SCHEMA_VERSION in main.CRNA_SUBMISSION_SCHEMAS
+    assert submission_app.CRNA_SUBMISSION_SCHEMA_FIELDS == main.CRNA_SUBMISSION_SCHEMAS[submission_app.CRNA_SUBMISSION_SCHEMA_VERSION]
+
+
+def test_submissions_survive_encode_decode(message_format, submission_app, valid_submissions):
+    for submission in valid_submissions:
+        data_bytes, attributes = submission_app.encode_submission_message(submission)
+        assert all(isinstance(value, str) for value in attributes.values()) # Pub/Sub attributes must be strings
+        assert main.decode_submission_message(data_bytes, attributes) == submission
+
+
+def test_unknown_fields_survive_encode_decode(message_format, submission_app, valid_submissions):
+    submission = dict(valid_submissions[0], field_added_by_newer_form="kept", hourly_rate_w2=None)
+    data_bytes, attributes = submission_app.encode_submission_message(submission)
+    assert main.decode_submission_message(data_bytes, attributes) == submission
+
+
+def test_unknown_schema_version_is_rejected(submission_app, valid_submissions, monkeypatch):
+    pytest.importorskip("msgpack")
+    monkeypatch.setattr(submission_app, "PUB_SUB_MESSAGE_FORMAT", "msgpack")
+    data_bytes, attributes = submission_app.encode_submission_message(valid_submissions[0])
+    with pytest.raises(ValueError):
+        main.decode_submission_message(data_bytes, dict(attributes, schema_version="999"))
+
+
+def test_benchmark_decode(benchmark, record_throughput, message_format, submission_app, valid_submissions):
+    messages = [submission_app.encode_submission_message(submission) for submission in valid_submissions]
+    def decode_all():
+        for data_bytes, attributes in messages:
+            main.decode_submission_message(data_bytes, attributes)
+    benchmark(decode_all)
+    record_throughput(
+        len(messages),
+        format="+".join(part for part in message_format if part),
+        mean_message_bytes=round(sum(len(data_bytes) for data_bytes, _ in messages) / len(messages), 1),
+    )
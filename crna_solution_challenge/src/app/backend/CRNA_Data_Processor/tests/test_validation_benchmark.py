@@ -0,0 +1,55 @@
+# validate_submission: behavior checks plus a pytest-benchmark suite reporting validations per second.
+# Benchmarks only:  python -m pytest tests/test_validation_benchmark.py --benchmark-only
+import main
+
+
+def test_valid_synthetic_payloads_pass(valid_submissions):
+    for submission in valid_submissions:
+        _, errors = main.validate_submission(submission)
+        assert errors == [], submission
+
+
+def test_invalid_synthetic_payloads_fail(invalid_submissions):
+    for submission in invalid_submissions:
+        _, errors = main.validate_submission(submission)
+        assert len(errors) >= 4, submission
+
+
+def test_state_of_licensure_is_normalized(valid_submissions):
+    validated, errors = main.validate_submission(dict(valid_submissions[0], primary_state_of_licensure=" ny "))
+    assert errors == []
+    assert validated["primary_state_of_licensure"] == "NY"
+
+
+def test_dc_license_is_accepted(valid_submissions):
+    validated, errors = main.validate_submission(dict(valid_submissions[0], primary_state_of_licensure="DC"))
+    assert errors == []
+    assert main.STATE_TO_REGION[validated["primary_state_of_licensure"]] == "South"
+
+
+def test_territory_licenses_are_rejected(valid_submissions):
+    # Two-letter codes outside STATE_TO_REGION used to pass the format check; they are rejected now.
+    for territory in ("PR", "GU", "VI"):
+        _, errors = main.validate_submission(dict(valid_submissions[0], primary_state_of_licensure=territory))
+        assert errors == [f"primary_state_of_licensure ('{territory}') is not a recognized US state code."]
+
+
+def test_unhashable_enum_value_is_rejected(valid_submissions):
+    _, errors = main.validate_submission(dict(valid_submissions[0], employment_type=["W2"]))
+    assert errors == ["employment_type ('['W2']') is not a valid option."]
+
+
+def test_benchmark_validate_valid_payloads(benchmark, record_throughput, valid_submissions):
+    def validate_all():
+        for submission in valid_submissions:
+            main.validate_submission(submission)
+    benchmark(validate_all)
+    record_throughput(len(valid_submissions), unit="validations", payloads_per_round=len(valid_submissions))
+
+
+def test_benchmark_validate_invalid_payloads(benchmark, record_throughput, invalid_submissions):
+    def validate_all():
+        for submission in invalid_submissions:
+            main.validate_submission(submission)
+    benchmark(validate_all)
+    record_throughput(len(invalid_submissions), unit="validations", payloads_per_round=len(invalid_submissions))
@@ -0,0 +1,185 @@
+# submit_crna_data_service/admission.py
+#
+# Admission control for /submit-crna-compensation:
+#   1. A token bucket per client (origin + client IP), refilled at `requests_per_second` up to `burst`.
+#      Buckets live in process memory by default, or in Redis when a URL is configured so that
+#      every Cloud Run instance shares the same budget.
+#   2. A bounded admission queue in front of the Pub/Sub publish: at most `max_in_flight` publishes
+#      run at once, at most `queue_size` more requests wait (up to `queue_timeout_seconds`), and
+#      anything beyond that is rejected immediately with a 429 instead of piling up on the workers.
+import itertools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import redis # Optional shared backend for the token buckets
+except ImportError:
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+
+class AdmissionStats:
+    # Counters ("admitted", "rate_limited", "queue_rejected") bumped on every request without a lock:
+    # next() on an itertools.count is a single atomic step under the GIL. A count can only be read by
+    # advancing it, so each read also advances a second count of reads and subtracts it back out.
+    # Reads are rare (log lines), and the read lock keeps concurrent readers from pairing up
+    # each other's advances.
+    COUNTERS = ("admitted", "rate_limited", "queue_rejected")
+
+    def __init__(self):
+        self._counts = {name: itertools.count() for name in self.COUNTERS}
+        self._reads = {name: itertools.count() for name in self.COUNTERS}
+        self._read_lock = threading.Lock()
+
+    def record_admitted(self):
+        next(self._counts["admitted"])
+
+    def record_rate_limited(self):
+        next(self._counts["rate_limited"])
+
+    def record_queue_rejected(self):
+        next(self._counts["queue_rejected"])
+
+    def snapshot(self):
+        with self._read_lock:
+            return {name: next(self._counts[name]) - next(self._reads[name]) for name in self.COUNTERS}
+
+
+# --- Token Buckets ---
+class InProcessTokenBuckets:
+    # Bucket state is (tokens, last_refill_monotonic). Updates go through one of a few striped locks,
+    # so unrelated clients rarely contend. Idle buckets are pruned once max_tracked_clients is hit.
+    LOCK_STRIPES = 16
+
+    def __init__(self, max_tracked_clients=10000):
+        self._buckets = {}
+        self._locks = [threading.Lock() for _ in range(self.LOCK_STRIPES)]
+        self._max_tracked_clients = max_tracked_clients
+        self._last_prune = 0.0
+
+    def try_acquire(self, key, requests_per_second, burst):
+        # Returns (allowed, retry_after_seconds)
+        now = time.monotonic()
+        with self._locks[hash(key) % self.LOCK_STRIPES]:
+            tokens, last_refill = self._buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - last_refill) * requests_per_second)
+            if tokens >= 1:
+                self._buckets[key] = (tokens - 1, now)
+                allowed, retry_after = True, 0.0
+            else:
+                self._buckets[key] = (tokens, now)
+                allowed, retry_after = False, (1 - tokens) / requests_per_second
+        if len(self._buckets) > self._max_tracked_clients and now - self._last_prune > 1.0:
+            self._last_prune = now
+            self._prune(now, requests_per_second, burst)
+        return allowed, retry_after
+
+    def _prune(self, now, requests_per_second, burst):
+        # A bucket that would be full again by now carries no state worth keeping. Uses the calling
+        # request's limits as an approximation for every bucket; a pruned bucket simply restarts full.
+        refill_seconds = burst / requests_per_second
+        for key, (_, last_refill) in list(self._buckets.items()):
+            if now - last_refill >= refill_seconds:
+                self._buckets.pop(key, None)
+
+
+class RedisTokenBuckets:
+    # Same algorithm, evaluated atomically inside Redis so all service instances share the buckets.
+    TOKEN_BUCKET_SCRIPT = """
+        local rate = tonumber(ARGV[1])
+        local burst = tonumber(ARGV[2])
+        local now = tonumber(ARGV[3])
+        local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+        local tokens = tonumber(state[1]) or burst
+        local ts = tonumber(state[2]) or now
+        tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+        local allowed = 0
+        if tokens >= 1 then
+            tokens = tokens - 1
+            allowed = 1
+        end
+        redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+        redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+        return {allowed, tostring(tokens)}
+    """
+
+    def __init__(self, redis_url, key_prefix="crna-rate-limit:"):
+        self._client = redis.Redis.from_url(redis_url, socket_timeout=0.05, socket_connect_timeout=0.05)
+        self._script = self._client.register_script(self.TOKEN_BUCKET_SCRIPT)
+        self._key_prefix = key_prefix
+
+    def try_acquire(self, key, requests_per_second, burst):
+        allowed, tokens = self._script(keys=[self._key_prefix + key], args=[requests_per_second, burst, time.time()])
+        if allowed:
+            return True, 0.0
+        return False, (1 - float(tokens)) / requests_per_second
+
+
+# --- Admission Queue ---
+class AdmissionQueue:
+    def __init__(self, max_in_flight, queue_size, queue_timeout_seconds):
+        # Tickets cap in-flight + waiting requests; taking one never blocks, which is what makes
+        # the "queue full" rejection fast.
+        self._tickets = threading.BoundedSemaphore(max_in_flight + queue_size)
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._queue_timeout_seconds = queue_timeout_seconds
+
+    @contextmanager
+    def admit(self):
+        # Yields True when the caller may proceed, False when it should be rejected.
+        if not self._tickets.acquire(blocking=False):
+            yield False
+            return
+        try:
+            if not self._slots.acquire(timeout=self._queue_timeout_seconds):
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                self._slots.release()
+        finally:
+            self._tickets.release()
+
+
+class AdmissionController:
+    def __init__(self, origin_limits, default_limits, max_in_flight, queue_size, queue_timeout_seconds, redis_url=None):
+        # origin_limits: {origin: {"requests_per_second": float, "burst": int}}; default_limits applies
+        # to requests without a configured Origin (server-to-server integrations, curl, ...).
+        self.origin_limits = origin_limits
+        self.default_limits = default_limits
+        self.queue = AdmissionQueue(max_in_flight, queue_size, queue_timeout_seconds)
+        self.stats = AdmissionStats()
+        self.local_buckets = InProcessTokenBuckets()
+        self.shared_buckets = None
+        if redis_url:
+            if redis is None:
+                logger.warning("RATE_LIMIT_REDIS_URL is set but the redis package is not installed; using in-process rate limits.")
+            else:
+                self.shared_buckets = RedisTokenBuckets(redis_url)
+                logger.info("Rate limit buckets are shared through Redis.")
+
+    def limits_for(self, origin):
+        return self.origin_limits.get(origin, self.default_limits)
+
+    def check_rate_limit(self, origin, client_id):
+        # Returns (allowed, retry_after_seconds)
+        limits = self.limits_for(origin)
+        # Unknown origins share the default bucket, so rotating the Origin header buys no extra budget.
+        key = f"{origin if origin in self.origin_limits else '-'}|{client_id}"
+        rate, burst = float(limits["requests_per_second"]), float(limits["burst"])
+        if self.shared_buckets is not None:
+            try:
+                allowed, retry_after = self.shared_buckets.try_acquire(key, rate, burst)
+            except Exception as e:
+                # Fail over to local buckets: a Redis outage must not take submissions down with it.
+                logger.warning(f"Redis rate limiter unavailable ({e}); falling back to in-process buckets.")
+                allowed, retry_after = self.local_buckets.try_acquire(key, rate, burst)
+        else:
+            allowed, retry_after = self.local_buckets.try_acquire(key, rate, burst)
+        if not allowed:
+            self.stats.record_rate_limited()
+        return allowed, retry_after
@@ -7,23 +7,55 @@ import os
 import uuid
 from datetime import datetime, timezone, date # 'date' import might not be strictly needed by this file
 from flask.json.provider import JSONProvider
+from werkzeug.middleware.proxy_fix import ProxyFix
 import json
 import logging
+import zlib
+
+from admission import AdmissionController
+
+try:
+    import orjson # Optional fast JSON backend; stdlib json is used when it is not installed
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack # Optional compact binary encoding for Pub/Sub messages
+except ImportError:
+    msgpack = None
 
 # --- Logger Setup ---
 logging.basicConfig(level=logging.INFO) # Basic config for Gunicorn logs
 logger = logging.getLogger(__name__) # Use Flask's app.logger for route-specific logging
 
+# --- JSON Serialization Helpers ---
+# orjson serializes datetime/date natively and works on bytes directly, so it skips
+# both the Python-level `default` hook and the intermediate str round trip.
+# Any call that needs stdlib-only kwargs (indent, sort_keys, ...) falls back to json.
+def json_dumps_bytes(obj, default=None) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj, default=default)
+    return json.dumps(obj, default=default).encode("utf-8")
+
 # --- Custom JSON Provider (if still needed for jsonify responses, good practice) ---
 class CustomJSONProvider(JSONProvider):
     def dumps(self, obj: any, **kwargs: any) -> str:
         # logger.info(f"CustomJSONProvider: 'dumps' called for obj of type: {type(obj)}") # Can be verbose
+        if orjson is not None and not kwargs:
+            return orjson.dumps(obj, default=self.default).decode("utf-8")
         return json.dumps(obj, default=self.default, **kwargs)
 
     def loads(self, s: str | bytes, **kwargs: any) -> any:
         # logger.info("CustomJSONProvider: 'loads' called.") # Can be verbose
+        if orjson is not None and not kwargs:
+            return orjson.loads(s)
         return json.loads(s, **kwargs)
 
+    def response(self, *args: any, **kwargs: any):
+        # Build the response body straight from bytes instead of going through dumps() -> str
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(json_dumps_bytes(obj, default=self.default), mimetype="application/json")
+
     def default(self, obj):
         # logger.info(f"CustomJSONProvider: 'default' method called with obj: {repr(obj)}, type: {type(obj)}")
         if isinstance(obj, (datetime, date)): # datetime.date might not be used by this app directly
@@ -37,6 +69,10 @@ class CustomJSONProvider(JSONProvider):
 app = Flask(__name__)
 app.json = CustomJSONProvider(app) # Register custom JSON provider
 
+# Cloud Run's front end appends the real client address to X-Forwarded-For; anything before it is
+# client-supplied. ProxyFix trusts only the last TRUSTED_PROXY_HOPS entries and sets remote_addr from them.
+app.wsgi_app = ProxyFix(app.wsgi_app, x_for=int(os.getenv("TRUSTED_PROXY_HOPS", 1)))
+
 # --- CORS Configuration ---
 # This allows requests from your Firebase Hosting URL and localhost (for firebase serve)
 # to the /submit-crna-compensation endpoint.
@@ -44,13 +80,17 @@ app.json = CustomJSONProvider(app) # Register custom JSON provider
 FIREBASE_HOSTING_URL = f"https://{os.getenv('GCP_PROJECT_ID', 'mythical-patrol-455417-a7')}.web.app"
 FIREBASE_HOSTING_URL_ALT = f"https://{os.getenv('GCP_PROJECT_ID', 'mythical-patrol-455417-a7')}.firebaseapp.com"
 
-# Be as specific as possible with origins in production
-origins = [
-    "http://localhost:5000", # For `firebase serve` or other local dev
-    FIREBASE_HOSTING_URL,
-    FIREBASE_HOSTING_URL_ALT
+# Be as specific as possible with origins in production.
+# Each origin listed here carries its own rate limit (token bucket per origin + client IP, see admission.py).
+# The Origin header is not authenticated (any non-browser client can set it), so keep these limits modest.
+ORIGIN_RATE_LIMITS = {
+    FIREBASE_HOSTING_URL: {"requests_per_second": 1, "burst": 10},
+    FIREBASE_HOSTING_URL_ALT: {"requests_per_second": 1, "burst": 10},
     # Add any other specific origins you need to allow, e.g., a custom domain for Firebase Hosting
-]
+}
+# Local dev origins are allowed by CORS but get no budget of their own: they share DEFAULT_RATE_LIMIT.
+LOCAL_DEV_ORIGINS = ["http://localhost:5000"] # For `firebase serve` or other local dev
+origins = list(ORIGIN_RATE_LIMITS) + LOCAL_DEV_ORIGINS
 # You can also use "*" to allow all origins for initial testing, but it's less secure for production.
 # CORS(app) # Allows all origins for all routes
 
@@ -58,13 +98,69 @@ CORS(app, resources={
     r"/submit-crna-compensation": {"origins": origins}
 })
 app.logger.info(f"CORS enabled for /submit-crna-compensation, allowed origins: {origins}")
-app.logger.info("CustomJSONProvider registered with Flask app.")
+app.logger.info(f"CustomJSONProvider registered with Flask app (backend: {'orjson' if orjson else 'json'}).")
 
 
 # --- Pub/Sub Configuration ---
 GCP_PROJECT_ID = os.getenv("GCP_PROJECT_ID", "mythical-patrol-455417-a7")
 PUB_SUB_TOPIC_NAME = os.getenv("PUB_SUB_TOPIC_NAME", "crna-raw-submissions-topic")
 
+# --- Pub/Sub Message Format ---
+# "json" (default) publishes the payload as UTF-8 JSON, exactly as before.
+# "msgpack" publishes a compact record against the versioned schema below: the key names are
+# replaced by a presence bitmask and the values are packed in schema order.
+# Compression ("zlib" or empty) applies to either format. The processor picks the decoder from
+# the message attributes, so both formats can be in flight on the same topic.
+PUB_SUB_MESSAGE_FORMAT = os.getenv("PUB_SUB_MESSAGE_FORMAT", "json").lower()
+PUB_SUB_MESSAGE_COMPRESSION = os.getenv("PUB_SUB_MESSAGE_COMPRESSION", "").lower()
+
+# Field order is the wire contract; keep it in sync with CRNA_Data_Processor/main.py
+# (CRNA_Data_Processor/tests/test_submission_codec.py checks both sides).
+# Never reorder or remove fields of a published version, add a new version instead.
+CRNA_SUBMISSION_SCHEMA_VERSION = "1"
+CRNA_SUBMISSION_SCHEMA_FIELDS = (
+    "submission_id_server", "submission_timestamp_server", "years_experience", "location_zip_code",
+    "employment_type", "work_setting", "primary_state_of_licensure", "base_salary_annual",
+    "hourly_rate_w2", "guaranteed_hours_w2", "hourly_rate_1099", "ot_rate_multiplier",
+    "call_stipend_type", "call_stipend_amount", "bonus_potential_annual", "sign_on_bonus",
+    "retention_bonus_terms", "pto_weeks", "retirement_match_percentage", "cme_allowance_annual",
+    "malpractice_coverage_type", "comments", "data_source",
+)
+
+if PUB_SUB_MESSAGE_FORMAT not in ("json", "msgpack"):
+    app.logger.warning(f"Unknown PUB_SUB_MESSAGE_FORMAT '{PUB_SUB_MESSAGE_FORMAT}', using json.")
+    PUB_SUB_MESSAGE_FORMAT = "json"
+if PUB_SUB_MESSAGE_FORMAT == "msgpack" and msgpack is None:
+    app.logger.warning("PUB_SUB_MESSAGE_FORMAT is msgpack but the msgpack package is not installed, using json.")
+    PUB_SUB_MESSAGE_FORMAT = "json"
+if PUB_SUB_MESSAGE_COMPRESSION not in ("", "zlib"):
+    app.logger.warning(f"Unknown PUB_SUB_MESSAGE_COMPRESSION '{PUB_SUB_MESSAGE_COMPRESSION}', sending uncompressed.")
+    PUB_SUB_MESSAGE_COMPRESSION = ""
+
+def encode_submission_message(message_payload):
+    # Returns (data_bytes, attributes) for publisher.publish. Attribute values must be strings.
+    if PUB_SUB_MESSAGE_FORMAT == "msgpack":
+        presence_mask = 0
+        values = []
+        for i, field in enumerate(CRNA_SUBMISSION_SCHEMA_FIELDS):
+            if field in message_payload:
+                presence_mask |= 1 << i
+                values.append(message_payload[field])
+        # Keys the schema doesn't know yet travel as a plain map so nothing is dropped.
+        extras = {k: v for k, v in message_payload.items() if k not in CRNA_SUBMISSION_SCHEMA_FIELDS}
+        data_bytes = msgpack.packb([presence_mask, values, extras], default=app.json.default)
+        attributes = {"content_type": "application/x-msgpack", "schema_version": CRNA_SUBMISSION_SCHEMA_VERSION}
+    else:
+        data_bytes = json_dumps_bytes(message_payload, default=app.json.default)
+        attributes = {}
+
+    if PUB_SUB_MESSAGE_COMPRESSION == "zlib":
+        data_bytes = zlib.compress(data_bytes)
+        attributes["content_encoding"] = "zlib"
+    return data_bytes, attributes
+
+app.logger.info(f"Pub/Sub message format: {PUB_SUB_MESSAGE_FORMAT}, compression: {PUB_SUB_MESSAGE_COMPRESSION or 'none'}")
+
 publisher = None
 TOPIC_PATH = None # Initialize TOPIC_PATH
 try:
@@ -74,6 +170,32 @@ try:
 except Exception as e:
     app.logger.error(f"Failed to initialize Pub/Sub publisher: {e}", exc_info=True)
 
+# --- Admission Control ---
+# Requests without one of the origins above (server-to-server integrations) get DEFAULT_RATE_LIMIT.
+# RATE_LIMIT_REDIS_URL (e.g. redis://localhost:6379/0) shares the buckets across instances.
+DEFAULT_RATE_LIMIT = {
+    "requests_per_second": float(os.getenv("DEFAULT_RATE_LIMIT_PER_SECOND", 0.5)),
+    "burst": int(os.getenv("DEFAULT_RATE_LIMIT_BURST", 5)),
+}
+admission_controller = AdmissionController(
+    origin_limits=ORIGIN_RATE_LIMITS,
+    default_limits=DEFAULT_RATE_LIMIT,
+    max_in_flight=int(os.getenv("ADMISSION_MAX_IN_FLIGHT", 8)),
+    queue_size=int(os.getenv("ADMISSION_QUEUE_SIZE", 16)),
+    queue_timeout_seconds=float(os.getenv("ADMISSION_QUEUE_TIMEOUT_SECONDS", 2.0)),
+    redis_url=os.getenv("RATE_LIMIT_REDIS_URL"),
+)
+
+def get_client_id():
+    # remote_addr is the hop appended by the trusted proxy (see ProxyFix above), never a client-supplied one.
+    return request.remote_addr or "unknown"
+
+def too_many_requests(message, retry_after_seconds):
+    response = jsonify({'error': message})
+    response.status_code = 429
+    response.headers["Retry-After"] = str(max(1, int(retry_after_seconds + 0.999)))
+    return response
+
 # --- Your Data Submission Route ---
 @app.route('/submit-crna-compensation', methods=['POST'])
 def submit_crna_compensation():
@@ -83,6 +205,20 @@ def submit_crna_compensation():
         app.logger.error("Pub/Sub publisher or TOPIC_PATH not available.")
         return jsonify({'error': 'Service temporarily unavailable (Pub/Sub configuration error)'}), 503
 
+    allowed, retry_after = admission_controller.check_rate_limit(request.headers.get("Origin"), get_client_id())
+    if not allowed:
+        app.logger.warning(f"Rate limit exceeded for origin={request.headers.get('Origin')} client={get_client_id()}")
+        return too_many_requests('Too many submissions, please retry later.', retry_after)
+
+    with admission_controller.queue.admit() as admitted:
+        if not admitted:
+            admission_controller.stats.record_queue_rejected()
+            app.logger.warning(f"Admission queue full, rejecting submission. Stats: {admission_controller.stats.snapshot()}")
+            return too_many_requests('Service is busy, please retry shortly.', 1)
+        admission_controller.stats.record_admitted()
+        return publish_submission()
+
+def publish_submission():
     try:
         data_from_request = request.get_json()
         if not data_from_request:
@@ -99,15 +235,13 @@ def submit_crna_compensation():
         message_payload["submission_id_server"] = str(uuid.uuid4())
         message_payload["submission_timestamp_server"] = datetime.now(timezone.utc).isoformat()
 
-        # For serializing the message_payload to Pub/Sub, standard json.dumps is usually fine
-        # as the critical datetime (submission_timestamp_server) is already an ISO string.
-        # If data_from_request could contain other datetime objects from the client, 
-        # then app.json.dumps(message_payload) would be safer.
-        message_data_bytes = json.dumps(message_payload).encode("utf-8")
+        # Serialize straight to bytes (orjson/msgpack). The provider's default hook
+        # still covers any datetime/date values the encoder can't handle natively.
+        message_data_bytes, message_attributes = encode_submission_message(message_payload)
         
         app.logger.info(f"Publishing message to {TOPIC_PATH} with submission_id_server: {message_payload['submission_id_server']}")
         
-        future = publisher.publish(TOPIC_PATH, data=message_data_bytes)
+        future = publisher.publish(TOPIC_PATH, data=message_data_bytes, **message_attributes)
         message_id = future.result() # Ensure this is .result()
 
         app.logger.info(f"Message {message_id} published to {TOPIC_PATH} for submission_id_server: {message_payload['submission_id_server']}")
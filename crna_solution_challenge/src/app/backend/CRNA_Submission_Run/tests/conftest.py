@@ -0,0 +1,36 @@
+# Shared fixtures for the CRNA_Submission_Run tests.
+# Run from CRNA_Submission_Run/:  pip install -r requirements-test.txt && python -m pytest tests
+import importlib.util
+import os
+import sys
+from unittest import mock
+
+import pytest
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVICE_DIR)
+
+
+@pytest.fixture(scope="session")
+def submission_app():
+    # app.py loaded as "submission_app" so it cannot clash with the other services' app modules. Its
+    # Pub/Sub client fails to initialize without credentials, which the app tolerates.
+    spec = importlib.util.spec_from_file_location("submission_app", os.path.join(SERVICE_DIR, "app.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def http(submission_app, monkeypatch):
+    # Publishes go to a mock; rate limits and the admission queue start fresh for every test.
+    monkeypatch.setattr(submission_app, "publisher", mock.MagicMock())
+    monkeypatch.setattr(submission_app, "TOPIC_PATH", "projects/test/topics/crna-raw-submissions-topic")
+    monkeypatch.setattr(submission_app, "admission_controller", submission_app.AdmissionController(
+        origin_limits=submission_app.ORIGIN_RATE_LIMITS,
+        default_limits={"requests_per_second": 0.01, "burst": 5},
+        max_in_flight=2,
+        queue_size=1,
+        queue_timeout_seconds=0.05,
+    ))
+    return submission_app.app.test_client()
@@ -0,0 +1,167 @@
+# Admission control: token buckets, the bounded admission queue and rate limiting through ProxyFix.
+import threading
+import time
+
+import pytest
+
+import admission
+
+SUBMISSION = {"years_experience": "5", "location_zip_code": "90210", "employment_type": "W2"}
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(admission.time, "monotonic", fake)
+    return fake
+
+
+# --- Token Buckets ---
+def test_bucket_allows_burst_then_reports_retry_after(clock):
+    buckets = admission.InProcessTokenBuckets()
+    assert [buckets.try_acquire("a", 2.0, 3)[0] for _ in range(3)] == [True, True, True]
+    allowed, retry_after = buckets.try_acquire("a", 2.0, 3)
+    assert not allowed
+    assert retry_after == pytest.approx(0.5)
+
+
+def test_bucket_refills_at_rate_up_to_burst(clock):
+    buckets = admission.InProcessTokenBuckets()
+    for _ in range(3):
+        buckets.try_acquire("a", 2.0, 3)
+    clock.now += 0.5
+    assert buckets.try_acquire("a", 2.0, 3) == (True, 0.0)
+    assert not buckets.try_acquire("a", 2.0, 3)[0]
+    clock.now += 3600
+    assert [buckets.try_acquire("a", 2.0, 3)[0] for _ in range(4)] == [True, True, True, False]
+
+
+def test_buckets_are_per_key(clock):
+    buckets = admission.InProcessTokenBuckets()
+    assert buckets.try_acquire("a", 1.0, 1)[0]
+    assert not buckets.try_acquire("a", 1.0, 1)[0]
+    assert buckets.try_acquire("b", 1.0, 1)[0]
+
+
+def test_idle_buckets_are_pruned_past_max_tracked_clients(clock):
+    buckets = admission.InProcessTokenBuckets(max_tracked_clients=10)
+    for n in range(10):
+        buckets.try_acquire(f"idle-{n}", 1.0, 2)
+    clock.now += 5 # every idle bucket is full again
+    buckets.try_acquire("busy-0", 1.0, 2)
+    buckets.try_acquire("busy-1", 1.0, 2)
+    assert sorted(buckets._buckets) == ["busy-0", "busy-1"]
+
+
+def test_unknown_origins_share_the_default_bucket():
+    controller = admission.AdmissionController(
+        origin_limits={"https://app.example": {"requests_per_second": 0.01, "burst": 1}},
+        default_limits={"requests_per_second": 0.01, "burst": 1},
+        max_in_flight=1, queue_size=0, queue_timeout_seconds=0,
+    )
+    assert controller.check_rate_limit("https://evil-1.example", "203.0.113.7")[0]
+    assert not controller.check_rate_limit("https://evil-2.example", "203.0.113.7")[0]
+    assert controller.check_rate_limit("https://app.example", "203.0.113.7")[0]
+    assert controller.stats.snapshot()["rate_limited"] == 1
+
+
+# --- Admission Queue ---
+def hold_admission(queue, started, release):
+    def run():
+        with queue.admit() as admitted:
+            assert admitted
+            started.set()
+            release.wait(5)
+    thread = threading.Thread(target=run)
+    thread.start()
+    assert started.wait(5)
+    return thread
+
+
+def test_queue_overflow_is_rejected_without_waiting():
+    queue = admission.AdmissionQueue(max_in_flight=1, queue_size=0, queue_timeout_seconds=5)
+    release = threading.Event()
+    holder = hold_admission(queue, threading.Event(), release)
+    started = time.monotonic()
+    with queue.admit() as admitted:
+        assert not admitted
+    assert time.monotonic() - started < 0.5 # no queue_timeout_seconds wait
+    release.set()
+    holder.join()
+    with queue.admit() as admitted:
+        assert admitted
+
+
+def test_queued_request_waits_for_a_slot_then_times_out():
+    queue = admission.AdmissionQueue(max_in_flight=1, queue_size=1, queue_timeout_seconds=0.05)
+    release = threading.Event()
+    holder = hold_admission(queue, threading.Event(), release)
+    started = time.monotonic()
+    with queue.admit() as admitted:
+        assert not admitted
+    assert time.monotonic() - started >= 0.05
+    release.set()
+    holder.join()
+
+
+def test_stats_count_concurrent_increments():
+    stats = admission.AdmissionStats()
+    def record():
+        for _ in range(10000):
+            stats.record_admitted()
+            stats.record_queue_rejected()
+    threads = [threading.Thread(target=record) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for _ in range(20):
+        stats.snapshot() # reads must not disturb the counts
+    for thread in threads:
+        thread.join()
+    assert stats.snapshot() == {"admitted": 40000, "rate_limited": 0, "queue_rejected": 40000}
+    assert stats.snapshot() == {"admitted": 40000, "rate_limited": 0, "queue_rejected": 40000}
+
+
+# --- Endpoint ---
+def test_full_admission_queue_returns_fast_429(submission_app, http, monkeypatch):
+    queue = admission.AdmissionQueue(max_in_flight=1, queue_size=0, queue_timeout_seconds=5)
+    monkeypatch.setattr(submission_app.admission_controller, "queue", queue)
+    release = threading.Event()
+    holder = hold_admission(queue, threading.Event(), release)
+    started = time.monotonic()
+    response = http.post("/submit-crna-compensation", json=SUBMISSION)
+    assert response.status_code == 429
+    assert time.monotonic() - started < 0.5
+    assert response.headers["Retry-After"] == "1"
+    assert submission_app.admission_controller.stats.snapshot()["queue_rejected"] == 1
+    release.set()
+    holder.join()
+    submission_app.publisher.publish.assert_not_called()
+
+
+def test_spoofed_forwarded_for_prefix_is_still_rate_limited(submission_app, http):
+    # The front end appends the real client address; everything before it is whatever the client sent.
+    statuses = [
+        http.post("/submit-crna-compensation", json=SUBMISSION,
+                  headers={"X-Forwarded-For": f"198.51.100.{n}, 203.0.113.7"}).status_code
+        for n in range(7)
+    ]
+    assert statuses == [202] * 5 + [429] * 2
+    other_client = http.post("/submit-crna-compensation", json=SUBMISSION, headers={"X-Forwarded-For": "203.0.113.8"})
+    assert other_client.status_code == 202
+
+
+def test_rate_limited_response_carries_retry_after(submission_app, http):
+    for _ in range(5):
+        http.post("/submit-crna-compensation", json=SUBMISSION, headers={"X-Forwarded-For": "203.0.113.9"})
+    response = http.post("/submit-crna-compensation", json=SUBMISSION, headers={"X-Forwarded-For": "203.0.113.9"})
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
+    submission_app.publisher.publish.assert_called()
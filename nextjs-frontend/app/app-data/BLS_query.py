@@ -1,6 +1,7 @@
 from google.cloud import bigquery
 import os
 import json  # Importing JSON module to handle JSON export
+from wage_snapshot import write_snapshot, occ_major_group  # Versioned Arrow snapshot (optional, needs pyarrow)
 
 # --- Authentication Note ---
 # Ensure you have authenticated before running this script:
@@ -63,6 +64,9 @@ try:
 
         print("Query results have been written to query_results.json")
 
+        # Also refresh the memory-mappable Arrow snapshot; only changed partitions are rewritten
+        write_snapshot(results_list, "wage_snapshot", "oews_wages", partition_key=occ_major_group)
+
     else:
         print("No results found for the specified OCC_CODE.")
 
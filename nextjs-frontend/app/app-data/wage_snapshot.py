@@ -0,0 +1,184 @@
+import hashlib
+import json  # Importing JSON module for the manifest sidecar and the legacy JSON inputs
+import os
+import sys
+from datetime import datetime, timezone
+
+# pyarrow is optional: without it the producer scripts keep writing only the JSON files.
+try:
+    import pyarrow as pa
+    import pyarrow.compute
+    import pyarrow.ipc
+except ImportError:
+    pa = None
+
+# --- Snapshot Layout ---
+# <snapshot_dir>/<dataset>/manifest.json                  JSON summary sidecar (version, schema, partitions)
+# <snapshot_dir>/<dataset>/part-<partition>-v<N>.arrow    Arrow IPC *file* format, uncompressed so that
+#                                                         readers can memory-map it and slice columns
+#                                                         without parsing the whole dataset.
+#
+# Rows are partitioned by a key function (e.g. the OEWS major occupation group). On every write
+# each partition's content hash is compared with the manifest, and only changed partitions are
+# rewritten. The snapshot version is bumped only when something actually changed.
+#
+# Partition files are never overwritten: a rewrite goes to a new file named after the new snapshot
+# version, and the manifest is swapped in afterwards. Files referenced by neither the new nor the
+# previous manifest are deleted only after that swap, so a reader still holding the previous manifest
+# keeps finding the exact files (and data) it names.
+SNAPSHOT_FORMAT = "arrow-ipc"
+SNAPSHOT_FORMAT_VERSION = 1
+MANIFEST_FILE_NAME = "manifest.json"
+
+
+def occ_major_group(row):
+    # "29-1151" -> "29": OEWS major occupation group, a stable and reasonably sized partition
+    occ_code = str(row.get("OCC_CODE") or "")
+    return occ_code.split("-")[0] if occ_code else "unknown"
+
+
+def _partition_hash(rows):
+    canonical = json.dumps(rows, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def _safe_partition_name(key):
+    return "".join(ch if ch.isalnum() or ch in "-_" else "_" for ch in str(key)) or "empty"
+
+
+def _numeric_column_stats(table):
+    # Per-column min/max so consumers can skip partitions using the manifest alone
+    stats = {}
+    for field in table.schema:
+        if pa.types.is_integer(field.type) or pa.types.is_floating(field.type):
+            min_max = pa.compute.min_max(table[field.name]).as_py()
+            stats[field.name] = {"min": min_max["min"], "max": min_max["max"]}
+    return stats
+
+
+def _delete_unreferenced_partitions(dataset_dir, partitions, previous_partitions):
+    # Keeps the files of the current and the previous manifest; older generations are removed.
+    referenced = {entry["file"] for entry in partitions.values()} | {entry["file"] for entry in previous_partitions.values()}
+    for file_name in os.listdir(dataset_dir):
+        if file_name.startswith("part-") and file_name.endswith(".arrow") and file_name not in referenced:
+            os.remove(os.path.join(dataset_dir, file_name))
+
+
+def load_manifest(dataset_dir):
+    manifest_path = os.path.join(dataset_dir, MANIFEST_FILE_NAME)
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path, "r") as manifest_file:
+        return json.load(manifest_file)
+
+
+def write_snapshot(rows, snapshot_dir, dataset_name, partition_key=None):
+    """
+    Writes `rows` (a list of dicts) as a partitioned Arrow snapshot, rewriting only changed partitions.
+    Returns the manifest dict, or None when pyarrow is not installed.
+    """
+    if pa is None:
+        print("pyarrow is not installed, skipping the Arrow snapshot (pip install pyarrow).")
+        return None
+
+    dataset_dir = os.path.join(snapshot_dir, dataset_name)
+    os.makedirs(dataset_dir, exist_ok=True)
+    previous_manifest = load_manifest(dataset_dir) or {}
+    previous_partitions = previous_manifest.get("partitions", {})
+    previous_version = previous_manifest.get("snapshot_version", 0)
+
+    partition_key = partition_key or (lambda row: "all")
+    partitioned_indexes = {}
+    for index, row in enumerate(rows):
+        partitioned_indexes.setdefault(str(partition_key(row)), []).append(index)
+
+    # Infer the schema once over all rows so that every partition file shares it.
+    table = pa.Table.from_pylist(rows) if rows else pa.table({})
+    schema_fields = [{"name": field.name, "type": str(field.type)} for field in table.schema]
+    schema_changed = schema_fields != previous_manifest.get("schema")
+    new_version = previous_version + 1
+
+    partitions = {}
+    rewritten, unchanged = [], []
+    for key in sorted(partitioned_indexes):
+        indexes = partitioned_indexes[key]
+        content_hash = _partition_hash([rows[i] for i in indexes])
+        previous = previous_partitions.get(key)
+        if (not schema_changed and previous and previous.get("sha256") == content_hash
+                and os.path.exists(os.path.join(dataset_dir, previous["file"]))):
+            partitions[key] = previous
+            unchanged.append(key)
+            continue
+
+        file_name = f"part-{_safe_partition_name(key)}-v{new_version}.arrow"
+
+        partition_table = table.take(pa.array(indexes, type=pa.int64()))
+        tmp_path = os.path.join(dataset_dir, f"{file_name}.tmp")
+        with pa.OSFile(tmp_path, "wb") as sink:
+            with pa.ipc.new_file(sink, partition_table.schema) as writer:
+                writer.write_table(partition_table)
+        os.replace(tmp_path, os.path.join(dataset_dir, file_name))
+        partitions[key] = {
+            "file": file_name,
+            "rows": len(indexes),
+            "sha256": content_hash,
+            "snapshot_version": new_version,
+            "stats": _numeric_column_stats(partition_table),
+        }
+        rewritten.append(key)
+
+    removed = [key for key in previous_partitions if key not in partitions]
+
+    if not rewritten and not removed and not schema_changed:
+        print(f"Snapshot '{dataset_name}' unchanged at version {previous_version}.")
+        return previous_manifest
+
+    manifest = {
+        "dataset": dataset_name,
+        "format": SNAPSHOT_FORMAT,
+        "format_version": SNAPSHOT_FORMAT_VERSION,
+        "snapshot_version": new_version,
+        "updated_at": datetime.now(timezone.utc).isoformat(),
+        "schema": schema_fields,
+        "total_rows": len(rows),
+        "partitions": partitions,
+    }
+    tmp_manifest_path = os.path.join(dataset_dir, f"{MANIFEST_FILE_NAME}.tmp")
+    with open(tmp_manifest_path, "w") as manifest_file:
+        json.dump(manifest, manifest_file, indent=4)
+    # The manifest is replaced after every partition it names is in place, so readers never see it
+    # pointing at a half-written or missing partition.
+    os.replace(tmp_manifest_path, os.path.join(dataset_dir, MANIFEST_FILE_NAME))
+    _delete_unreferenced_partitions(dataset_dir, partitions, previous_partitions)
+
+    print(
+        f"Snapshot '{dataset_name}' version {new_version}: {len(rewritten)} partitions rewritten, "
+        f"{len(unchanged)} unchanged, {len(removed)} removed ({len(rows)} rows)."
+    )
+    return manifest
+
+
+def read_partition(snapshot_dir, dataset_name, partition, columns=None):
+    """
+    Memory-maps one partition and returns it as a pyarrow Table (zero-copy for fixed-width columns).
+    """
+    dataset_dir = os.path.join(snapshot_dir, dataset_name)
+    manifest = load_manifest(dataset_dir)
+    if manifest is None or partition not in manifest["partitions"]:
+        raise KeyError(f"Partition '{partition}' not found in snapshot '{dataset_name}'")
+    source = pa.memory_map(os.path.join(dataset_dir, manifest["partitions"][partition]["file"]), "r")
+    table = pa.ipc.open_file(source).read_all()
+    return table.select(columns) if columns else table
+
+
+# --- Convert the existing JSON datasets ---
+# Usage: python wage_snapshot.py [snapshot_dir]
+if __name__ == "__main__":
+    snapshot_dir = sys.argv[1] if len(sys.argv) > 1 else "wage_snapshot"
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+
+    with open(os.path.join(script_dir, "query_results.json"), "r") as json_file:
+        write_snapshot(json.load(json_file), snapshot_dir, "oews_wages", partition_key=occ_major_group)
+
+    with open(os.path.join(script_dir, "crna_mock_data.json"), "r") as json_file:
+        write_snapshot(json.load(json_file), snapshot_dir, "crna_mock_data")